@@ -0,0 +1,163 @@
+# Cold/warm page-load benchmark for the Streamlit dashboard against a mock Athena.
+#
+#   python benchmarks/bench_dashboard_queries.py --latency 1.0 --jitter 0.5 [--mode local]
+#
+# Runs streamlit_dashboard.py headless (streamlit.testing AppTest) with pyathena replaced
+# by an in-process stand-in whose cursors sleep for an injected latency per query and
+# return one sample row with the query's select-list columns. Reports the cold page
+# time next to the serial sum and the slowest single query, the warm (cached) page
+# time, and how many connections were opened. The channel list (the small
+# event_type_channels table semi-joined to the spend table's partitions in range) is
+# fetched before the panel queries start, so a cold page
+# waits on it plus the slowest panel query.
+import argparse
+import os
+import random
+import re
+import sys
+import threading
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DASHBOARD = os.path.join(ROOT, "streamlit_dashboard", "streamlit_dashboard.py")
+
+
+def select_columns(sql):
+    """Output column names of the outermost SELECT in sql."""
+    depth, spans, start = 0, [], None
+    for match in re.finditer(r"\(|\)|\bselect\b|\bfrom\b", sql, re.I):
+        token = match.group(0).lower()
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0 and token == "select":
+            start = match.end()
+        elif depth == 0 and token == "from" and start is not None:
+            spans.append((start, match.start()))
+            start = None
+    items, depth, current = [], 0, ""
+    for char in sql[slice(*spans[-1])]:
+        depth += char == "("
+        depth -= char == ")"
+        if char == "," and depth == 0:
+            items.append(current)
+            current = ""
+        else:
+            current += char
+    items.append(current)
+    return [re.search(r"(\w+)\s*$", item.strip()).group(1) for item in items]
+
+
+SAMPLE_TEXT = {"channel": "youtube", "employee_name": "Rep", "day": "2024-05-01", "kind": "booking"}
+
+
+def sample_value(column):
+    if column.endswith("_date"):
+        return "2024-05-01"
+    if column.endswith("_day"):
+        return "Monday"
+    return SAMPLE_TEXT.get(column, 1)
+
+
+class MockAthena:
+    def __init__(self, latency, jitter, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.query_times = []
+
+    def connect(self, **kwargs):
+        with self.lock:
+            self.connections += 1
+        return MockConnection(self)
+
+    def sleep_time(self):
+        with self.lock:
+            return self.latency + self.random.uniform(0, self.jitter)
+
+
+class MockConnection:
+    def __init__(self, athena):
+        self.athena = athena
+
+    def cursor(self):
+        return MockCursor(self.athena)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MockCursor:
+    def __init__(self, athena):
+        self.athena = athena
+        self.description = None
+        self.columns = []
+
+    def execute(self, sql, *args):
+        delay = self.athena.sleep_time()
+        time.sleep(delay)
+        with self.athena.lock:
+            self.athena.query_times.append(delay)
+        self.columns = select_columns(sql)
+        self.description = [(name, None, None, None, None, None, None) for name in self.columns]
+        return self
+
+    def fetchall(self):
+        return [tuple(sample_value(column) for column in self.columns)]
+
+    def close(self):
+        pass
+
+
+def load_page(timeout, mode):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(DASHBOARD, default_timeout=timeout)
+    app.secrets["s3_staging_dir"] = "s3://bench/athena/"
+    app.secrets["aws_region"] = "us-east-1"
+    app.secrets["aws_access_key_id"] = "bench"
+    app.secrets["aws_secret_access_key"] = "bench"
+    app.secrets["aggregation_mode"] = mode
+    started = time.perf_counter()
+    app.run()
+    elapsed = time.perf_counter() - started
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=1.0, help="base seconds per query")
+    parser.add_argument("--jitter", type=float, default=0.5, help="extra random seconds per query")
+    parser.add_argument("--mode", choices=["athena", "local"], default="athena", help="dashboard aggregation_mode")
+    args = parser.parse_args()
+
+    athena = MockAthena(args.latency, args.jitter)
+    sys.modules["pyathena"] = types.SimpleNamespace(connect=athena.connect)
+    timeout = 10 * (args.latency + args.jitter) + 30
+
+    cold = load_page(timeout, args.mode)
+    cold_queries = list(athena.query_times)
+    warm = load_page(timeout, args.mode)
+
+    print(f"queries           {len(cold_queries)}")
+    print(f"serial sum        {sum(cold_queries):.2f}s")
+    print(f"slowest query     {max(cold_queries):.2f}s  (channel list {cold_queries[0]:.2f}s)")
+    print(f"cold page         {cold:.2f}s")
+    print(f"warm page         {warm:.2f}s  ({len(athena.query_times) - len(cold_queries)} queries re-run)")
+    print(f"connections       {athena.connections}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# Compare the job's schema-compiled flatten_payload with the original transform_flattened_row,
+# kept below as the reference implementation, on synthetic Calendly invitee.created payloads.
+#
+#   pip install pyspark boto3
+#   python benchmarks/bench_flattener.py --events 100000
+#
+# Reports events/sec and the memory held by the flattened rows (bytes and allocated blocks
+# per event), and checks that both produce the same values for every schema column.
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "glue_jobs"))
+sys.path.insert(0, os.path.join(ROOT, "shared", "python"))
+
+import CalendlyDailyEventJob as job  # noqa: E402
+from synthetic_data import synthetic_payload  # noqa: E402
+
+
+# Reference implementation: the job's original per-row flattener, kept here to check
+# flatten_payload against. Recursive flatten dict, preserve lists as-is
+def flatten_dict(d, parent_key='', sep='_'):
+    items = []
+    for k, v in d.items():
+        new_key = f"{parent_key}{sep}{k}" if parent_key else k
+        if isinstance(v, dict):
+            items.extend(flatten_dict(v, new_key, sep=sep).items())
+        elif isinstance(v, list):
+            items.append((new_key, v))
+        else:
+            items.append((new_key, v))
+    return dict(items)
+
+
+# Helper to extract nested fields flattened
+def transform_flattened_row(row):
+    flat = flatten_dict(row)
+
+    se = row.get("scheduled_event", {})
+    if se:
+        flat["scheduled_event_created_at"] = se.get("created_at")
+        flat["scheduled_event_end_time"] = se.get("end_time")
+        flat["scheduled_event_event_guests"] = se.get("event_guests", [])
+        flat["scheduled_event_event_memberships"] = se.get("event_memberships", [])
+        flat["scheduled_event_event_type"] = se.get("event_type")
+        ic = se.get("invitees_counter", {})
+        flat["scheduled_event_invitees_counter_total"] = ic.get("total")
+        flat["scheduled_event_invitees_counter_active"] = ic.get("active")
+        flat["scheduled_event_invitees_counter_limit"] = ic.get("limit")
+        loc = se.get("location", {})
+        flat["scheduled_event_location_location"] = loc.get("location")
+        flat["scheduled_event_location_type"] = loc.get("type")
+        flat["scheduled_event_meeting_notes_html"] = se.get("meeting_notes_html")
+        flat["scheduled_event_meeting_notes_plain"] = se.get("meeting_notes_plain")
+        flat["scheduled_event_name"] = se.get("name")
+        flat["scheduled_event_start_time"] = se.get("start_time")
+        flat["scheduled_event_status"] = se.get("status")
+        flat["scheduled_event_updated_at"] = se.get("updated_at")
+        flat["scheduled_event_uri"] = se.get("uri")
+
+    tracking = row.get("tracking", {})
+    flat["tracking_utm_campaign"] = tracking.get("utm_campaign")
+    flat["tracking_utm_source"] = tracking.get("utm_source")
+    flat["tracking_utm_medium"] = tracking.get("utm_medium")
+    flat["tracking_utm_content"] = tracking.get("utm_content")
+    flat["tracking_utm_term"] = tracking.get("utm_term")
+    flat["tracking_salesforce_uuid"] = tracking.get("salesforce_uuid")
+
+    return flat
+
+
+def original(payload, event_date):
+    row = transform_flattened_row(payload)
+    row["event_date"] = event_date
+    return row
+
+
+def measure(label, fn, payloads):
+    gc.collect()
+    started = time.perf_counter()
+    for p in payloads:
+        fn(p, "2024-01-01")
+    elapsed = time.perf_counter() - started
+
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    tracemalloc.start()
+    rows = [fn(p, "2024-01-01") for p in payloads]
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sys.getallocatedblocks() - blocks_before
+    n = len(payloads)
+    print(f"{label:>24}: {n / elapsed:>10.0f} events/sec | {held / n:>7.0f} B/event held | "
+          f"{peak / n:>7.0f} B/event peak | {blocks / n:>5.1f} blocks/event")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    payloads = [synthetic_payload(rng) for _ in range(args.events)]
+
+    names = [f.name for f in job.schema.fields]
+    for p in payloads[:1000]:
+        expected = original(p, "2024-01-01")
+        assert tuple(expected.get(n) for n in names) == job.flatten_payload(p, "2024-01-01")
+
+    measure("transform_flattened_row", original, payloads)
+    measure("flatten_payload", job.flatten_payload, payloads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,792 @@
+# End-to-end pipeline benchmark on synthetic data, against local stand-ins for AWS.
+#
+#   pip install "moto[s3,sqs]" boto3 pyspark duckdb streamlit pandas altair
+#   python benchmarks/bench_pipeline.py --scales 10000,100000,1000000 --output results.json
+#   python benchmarks/bench_pipeline.py --scales 10000 --compare results.json
+#
+# Each scale runs in its own process through these stages:
+#   webhook    calendly_webhook.lambda_handler on every generated delivery (S3: moto); with
+#              --ack-mode queue it enqueues to a moto SQS queue, which the worker then drains
+#              into segments in batches of 100
+#   spend      calendlySpendData.lambda_handler in backfill mode, fetching spend_data_*.json
+#              from a local HTTP server standing in for the upstream bucket, once per
+#              --spend-formats entry (spend_json, spend_parquet), then the dashboard's spend
+#              aggregation over each output in DuckDB (spend_scan_*: query time and bytes scanned)
+#   glue_*     CalendlyDailyEventJob listing and fetch/flatten of raw/ (driver mode), then the
+#              job's prepare_events/write_events in append mode, the same batch again in upsert
+#              mode with --upsert-ratio of it updated (glue_upsert), and the rollup build, in
+#              local-mode Spark on local folders in place of processed/ (the manifests and Athena
+#              DDL are skipped)
+#   attribution_check  the dashboard's SPEND_ATTRIBUTION layer run on DuckDB against a pandas
+#              reference built from the processed events and the generated spend files; fails
+#              the run on any difference (needs the spend and glue stages)
+#   employee_parity  the dashboard's employee panel on rollup_employee_meetings against the
+#              pre-rollup query over stand-in calendly_events/event_memberships/employees views
+#              built with the rollup's own definitions (needs glue). It checks the aggregation,
+#              not that those definitions match the production views.
+#   dashboard  streamlit_dashboard.py (AppTest) in both aggregation modes, with DuckDB over the
+#              rollups and the first --spend-formats output in place of Athena
+# and reports per-stage throughput, latency percentiles (where a stage has per-item calls) and
+# peak RSS of the Python process (Spark's JVM is not included), plus the components' own
+# per-stage metrics (shared/python/instrumentation.py, collected from a metrics file) under
+# "instrumentation". Results are written as JSON, keyed by scale and stage, so runs from two commits can
+# be diffed or passed to --compare. Set AWS_ENDPOINT_URL_S3 (e.g. http://localhost:9000 for
+# MinIO) to use a real S3-compatible server instead of moto; 1M events need several GB of
+# memory with moto.
+import argparse
+import ast
+import datetime
+import gc
+import http.client
+import importlib.util
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEBHOOK_APP = os.path.join(ROOT, "lambda_functions", "calendly_webhook", "app.py")
+SPEND_APP = os.path.join(ROOT, "lambda_functions", "calendlySpendData", "app.py")
+GLUE_JOB = os.path.join(ROOT, "glue_jobs", "CalendlyDailyEventJob.py")
+DASHBOARD = os.path.join(ROOT, "streamlit_dashboard", "streamlit_dashboard.py")
+STAGES = ("webhook", "spend", "glue", "dashboard")
+# The Lambdas get shared/ as a layer and the Glue job through --extra-py-files
+sys.path.insert(0, os.path.join(ROOT, "shared", "python"))
+
+from synthetic_data import CHANNELS, spend_files, webhook_bodies  # noqa: E402
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# --- Measurement ---
+
+def reset_peak_rss():
+    # Linux: writing 5 to clear_refs resets VmHWM, so each stage reports its own peak
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Process-lifetime peak (kB on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(sorted_samples, q):
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * q))]
+
+
+# fn returns {"items": n, ...}; optional "latencies" (seconds per call) and "busy_seconds"
+# (time spent in the code under test, when the stage also spends time generating input)
+def run_stage(name, fn):
+    gc.collect()
+    reset_peak_rss()
+    started = time.perf_counter()
+    outcome = fn()
+    wall = time.perf_counter() - started
+    latencies = sorted(outcome.pop("latencies", []))
+    seconds = outcome.pop("busy_seconds", wall)
+    result = {
+        "items": outcome.pop("items"),
+        "seconds": round(seconds, 4),
+        "wall_seconds": round(wall, 4),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    result["items_per_sec"] = round(result["items"] / seconds, 1) if seconds else None
+    if latencies:
+        result["latency_ms"] = {
+            label: round(percentile(latencies, q) * 1000, 3)
+            for label, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1.0))
+        }
+    result.update(outcome)
+    latency = result.get("latency_ms", {})
+    print(f"  {name:<18} {result['items']:>9} items  {result['seconds']:>9.2f}s  "
+          f"{result['items_per_sec'] or 0:>11.1f}/s  p50 {latency.get('p50', 0):>8.2f}ms  "
+          f"p99 {latency.get('p99', 0):>8.2f}ms  peak {result['peak_rss_mb']:>8.1f} MB", flush=True)
+    return result
+
+
+# --- Stages ---
+
+def webhook_stage(webhook, bodies):
+    latencies = []
+    accepted = 0
+    for body in bodies:
+        started = time.perf_counter()
+        response = webhook.lambda_handler({"body": body}, None)
+        latencies.append(time.perf_counter() - started)
+        if response["statusCode"] != 200:
+            raise RuntimeError(f"webhook returned {response}")
+        accepted += json.loads(response["body"])["message"] == "Webhook received successfully"
+    outcome = {"items": len(latencies), "latencies": latencies, "busy_seconds": sum(latencies), "accepted": accepted}
+    if webhook.ACK_MODE == "queue":
+        outcome["persisted"] = drain_queue(webhook)
+    return outcome
+
+
+# Feed the queued webhooks to the worker in SQS-sized batches of up to 100 records
+def drain_queue(webhook, batch_size=100):
+    sqs = webhook.get_sqs()
+    persisted = 0
+    while True:
+        records = []
+        while len(records) < batch_size:
+            messages = sqs.receive_message(QueueUrl=webhook.QUEUE_URL, MaxNumberOfMessages=10).get("Messages", [])
+            if not messages:
+                break
+            records += [{"messageId": m["MessageId"], "body": m["Body"]} for m in messages]
+            sqs.delete_message_batch(QueueUrl=webhook.QUEUE_URL, Entries=[
+                {"Id": str(i), "ReceiptHandle": m["ReceiptHandle"]} for i, m in enumerate(messages)])
+        if not records:
+            return persisted
+        persisted += webhook.queue_worker_handler({"Records": records}, None)["persisted"]
+
+
+def serve_spend_files(files):
+    class SpendHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, as the spend Lambda expects
+
+        def do_GET(self):
+            body = files.get(self.path.rsplit("/", 1)[-1])
+            data = body.encode("utf-8") if body is not None else b""
+            self.send_response(200 if body is not None else 404)
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("ETag", f'"{hash(body) & 0xffffffff:08x}"')
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SpendHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def spend_stage(spend, files):
+    server = serve_spend_files(files)
+    port = server.server_address[1]
+
+    # Plain HTTP to the local server instead of HTTPS to the upstream bucket
+    def local_connection():
+        conn = getattr(spend._connections, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            spend._connections.conn = conn
+        return conn
+
+    latencies = []
+    process_spend_file = spend.process_spend_file
+
+    def timed_process_spend_file(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return process_spend_file(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    spend.get_connection = local_connection
+    spend.process_spend_file = timed_process_spend_file
+    try:
+        response = spend.lambda_handler({"mode": "backfill"}, None)
+    finally:
+        server.shutdown()
+    body = json.loads(response["body"])
+    return {"items": len(body["written"]), "latencies": latencies, "records": body["records_count"]}
+
+
+# The catalog's event_type_channels lookup for the generated event types
+def event_type_channels(event_types):
+    return [(event_type, CHANNELS[i % len(CHANNELS)]) for i, event_type in enumerate(event_types)]
+
+
+def glue_stages(job, spark, workdir, event_types, upsert_ratio):
+    from pyspark.sql.functions import col, crc32, expr, when
+
+    results = {}
+    state = {}
+
+    def list_stage():
+        state["pending"] = job.list_pending_files()
+        return {"items": sum(len(keys) for keys in state["pending"].values())}
+
+    def fetch_stage():
+        keys = [key for keys in state["pending"].values() for key in keys]
+        state["rows"], fetched = job.read_raw_events_on_driver(keys)
+        return {"items": len(state["rows"]), "files": sum(len(k) for k in fetched.values())}
+
+    events_dir = os.path.join(workdir, "processed", "events")
+    output_path = events_dir + "/"
+
+    # The job lists processed/ on S3; here the table is a local folder, keyed the same way
+    def local_partitions(first=None, last=None):
+        partitions = {}
+        for folder in sorted(os.listdir(events_dir)) if os.path.isdir(events_dir) else []:
+            date_part = folder.split("=", 1)[-1]
+            if not folder.startswith("event_date=") or (first and date_part < first) or (last and date_part > last):
+                continue
+            for name in sorted(os.listdir(os.path.join(events_dir, folder))):
+                if not name.startswith(("_", ".")):
+                    partitions.setdefault(folder.split("=", 1)[1], []).append(
+                        (f"{job.processed_prefix}{folder}/{name}", os.path.getsize(os.path.join(events_dir, folder, name))))
+        return partitions
+
+    job.list_processed_partitions = local_partitions
+    job.partition_files = lambda date_part: sorted(key for key, _ in local_partitions().get(date_part, []))
+
+    # process_raw_folders' prepare + write, in append mode
+    def write_stage():
+        job.write_mode = "append"
+        df = job.prepare_events(spark.createDataFrame(state["rows"], schema=job.schema))
+        dates = sorted(r.event_date for r in df.select("event_date").distinct().collect())
+        written = job.write_events(spark, df, output_path, dates)
+        df.unpersist()
+        return {"items": len(state["rows"]), "partitions": len(written)}
+
+    # The same deliveries again in upsert mode, with an upsert_ratio share carrying a newer
+    # updated_at: builds the key indexes of the append-written partitions, then merges
+    def upsert_stage():
+        job.write_mode = "upsert"
+        df = job.prepare_events(spark.createDataFrame(state["rows"], schema=job.schema))
+        newer = crc32(job.event_key()) % 1000 < int(upsert_ratio * 1000)
+        df = df.withColumn("updated_at", when(newer, expr("updated_at + INTERVAL 1 HOUR")).otherwise(col("updated_at")))
+        dates = sorted(r.event_date for r in df.select("event_date").distinct().collect())
+        written = job.write_events(spark, df, output_path, dates)
+        df.unpersist()
+        return {"items": len(state["rows"]), "partitions": len(written)}
+
+    def rollup_stage():
+        spark.sql(f"CREATE DATABASE IF NOT EXISTS {job.athena_db}")
+        (spark.createDataFrame(event_type_channels(event_types), "event_type string, channel_name string")
+         .write.mode("overwrite").saveAsTable(f"{job.athena_db}.event_type_channels"))
+        events = spark.read.schema(job.schema_with_timestamps()).parquet(events_dir)
+        rollup_rows = 0
+        for table, rollup in job.build_rollups(spark, events).items():
+            rollup = rollup.localCheckpoint()
+            rollup_rows += rollup.count()
+            rollup.coalesce(1).write.partitionBy("event_date").mode("overwrite").parquet(
+                os.path.join(workdir, "processed", "rollups", table))
+        return {"items": len(state["rows"]), "rollup_rows": rollup_rows}
+
+    results["glue_list"] = run_stage("glue_list", list_stage)
+    results["glue_fetch_flatten"] = run_stage("glue_fetch_flatten", fetch_stage)
+    results["glue_spark_write"] = run_stage("glue_spark_write", write_stage)
+    results["glue_upsert"] = run_stage("glue_upsert", upsert_stage)
+    state.pop("pending")
+    results["glue_rollups"] = run_stage("glue_rollups", rollup_stage)
+    return results
+
+
+# Sum the EMF lines the components wrote during the run per Component/Stage
+def instrumentation_summary(metrics_path):
+    summary = {}
+    if not os.path.exists(metrics_path):
+        return summary
+    with open(metrics_path) as f:
+        for line in f:
+            record = json.loads(line)
+            entry = summary.setdefault(f"{record['Component']}/{record['Stage']}", {"calls": 0})
+            entry["calls"] += 1
+            for metric in record["_aws"]["CloudWatchMetrics"][0]["Metrics"]:
+                name = metric["Name"]
+                entry[name] = round(entry.get(name, 0) + record[name], 3)
+    return summary
+
+
+# --- Dashboard on DuckDB ---
+
+def sql_literal(value):
+    if isinstance(value, (list, tuple)):
+        return "(" + ", ".join(sql_literal(v) for v in value) + ")"
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+
+class DuckDBAthena:
+    """pyathena.connect stand-in: every cursor runs on its own DuckDB cursor of one database."""
+
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.Lock()
+        self.query_seconds = []
+        self.rows_returned = 0
+
+    def connect(self, **kwargs):
+        return self
+
+    def cursor(self):
+        return DuckDBCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class DuckDBCursor:
+    def __init__(self, athena):
+        self.athena = athena
+        self.cursor = athena.db.cursor()
+        self.description = None
+        self.rows = []
+
+    def execute(self, sql, *args):
+        if args and args[0]:
+            sql = sql % {name: sql_literal(value) for name, value in args[0].items()}
+        started = time.perf_counter()
+        self.cursor.execute(sql)
+        self.description = self.cursor.description
+        self.rows = self.cursor.fetchall()
+        with self.athena.lock:
+            self.athena.query_seconds.append(time.perf_counter() - started)
+            self.athena.rows_returned += len(self.rows)
+        return self
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        self.cursor.close()
+
+
+# Athena table the crawler creates over a spend module's output prefix
+def spend_table(spend):
+    return spend.spend_prefix.strip("/")
+
+
+# Copy a spend module's output out of S3 with its file_date= layout; returns the local folder
+def download_spend_output(workdir, spend, s3, bucket):
+    spend_dir = os.path.join(workdir, spend_table(spend))
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=spend.spend_prefix):
+        for obj in page.get("Contents", []):
+            path = os.path.join(spend_dir, obj["Key"][len(spend.spend_prefix):])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            s3.download_file(bucket, obj["Key"], path)
+    return spend_dir
+
+
+# One view per spend output (daily_spends, daily_spends_parquet) next to the rollup views
+def duckdb_catalog(workdir, spends, s3, bucket, event_types):
+    import duckdb
+
+    db = duckdb.connect(os.path.join(workdir, "athena.duckdb"))
+    db.execute("CREATE SCHEMA IF NOT EXISTS calendly_project")
+    # Presto functions the dashboard uses (format_datetime is only called with 'EEEE')
+    db.execute("CREATE OR REPLACE MACRO format_datetime(ts, fmt) AS dayname(ts)")
+    db.execute("CREATE OR REPLACE MACRO day_of_week(d) AS isodow(d)")
+    for table in ("rollup_channel_bookings", "rollup_channel_meetings", "rollup_employee_meetings"):
+        path = os.path.join(workdir, "processed", "rollups", table, "*", "*.parquet")
+        db.execute(f"CREATE OR REPLACE VIEW calendly_project.{table} AS "
+                   f"SELECT * FROM read_parquet('{path}', hive_partitioning = true, hive_types_autocast = false)")
+    db.execute("CREATE OR REPLACE TABLE calendly_project.event_type_channels (event_type VARCHAR, channel_name VARCHAR)")
+    db.executemany("INSERT INTO calendly_project.event_type_channels VALUES (?, ?)", event_type_channels(event_types))
+    for spend in spends.values():
+        spend_glob = os.path.join(download_spend_output(workdir, spend, s3, bucket), "*", "*")
+        reader = (f"read_parquet('{spend_glob}', hive_partitioning = true, hive_types_autocast = false)"
+                  if spend.OUTPUT_FORMAT == "parquet" else
+                  f"read_json('{spend_glob}', format = 'newline_delimited', hive_partitioning = true, "
+                  f"hive_types_autocast = false)")
+        db.execute(f"CREATE OR REPLACE VIEW calendly_project.{spend_table(spend)} AS SELECT * FROM {reader}")
+    return db
+
+
+# Bytes a columnar engine reads for these columns: the whole object for JSON, the compressed
+# column chunks for Parquet (what Athena bills as data scanned)
+def bytes_scanned(path, columns):
+    if not path.endswith(".parquet"):
+        return os.path.getsize(path)
+    import pyarrow.parquet as pq
+    metadata = pq.ParquetFile(path).metadata
+    return sum(
+        metadata.row_group(g).column(c).total_compressed_size
+        for g in range(metadata.num_row_groups)
+        for c in range(metadata.num_columns)
+        if metadata.row_group(g).column(c).path_in_schema in columns
+    )
+
+
+# The dashboard's spend aggregation (SPEND_ATTRIBUTION's spend CTE) over one spend output
+def spend_scan_stage(db, workdir, spend, start, end, runs=20):
+    table = spend_table(spend)
+    sql = (f"SELECT channel, CAST(date AS DATE) AS day, SUM(spend) AS spend "
+           f"FROM calendly_project.{table} WHERE file_date BETWEEN '{start}' AND '{end}' GROUP BY 1, 2")
+    latencies = []
+    cursor = db.cursor()
+    for _ in range(runs):
+        started = time.perf_counter()
+        rows = cursor.execute(sql).fetchall()
+        latencies.append(time.perf_counter() - started)
+    cursor.close()
+    scanned = 0
+    for folder in os.listdir(os.path.join(workdir, table)):
+        if start <= folder.split("=", 1)[1] <= end:
+            for name in os.listdir(os.path.join(workdir, table, folder)):
+                scanned += bytes_scanned(os.path.join(workdir, table, folder, name), {"date", "channel", "spend"})
+    return {"items": runs, "latencies": latencies, "busy_seconds": sum(latencies),
+            "rows_returned": len(rows), "bytes_scanned": scanned}
+
+
+def dashboard_stages(athena, spend_table_name):
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    sys.modules["pyathena"] = types.SimpleNamespace(connect=athena.connect)
+    results = {}
+    for mode in ("athena", "local"):
+        def page_stage():
+            st.cache_data.clear()
+            st.cache_resource.clear()
+            athena.query_seconds = []
+            athena.rows_returned = 0
+            page_seconds = []
+            for _ in range(2):  # cold, then warm (cached)
+                app = AppTest.from_file(DASHBOARD, default_timeout=600)
+                app.secrets["s3_staging_dir"] = "s3://bench/athena/"
+                app.secrets["aws_region"] = "us-east-1"
+                app.secrets["aws_access_key_id"] = "bench"
+                app.secrets["aws_secret_access_key"] = "bench"
+                app.secrets["aggregation_mode"] = mode
+                app.secrets["spend_table"] = f"calendly_project.{spend_table_name}"
+                started = time.perf_counter()
+                app.run()
+                page_seconds.append(time.perf_counter() - started)
+                if app.exception:
+                    raise RuntimeError(app.exception[0].message)
+            return {
+                "items": len(athena.query_seconds),
+                "rows_returned": athena.rows_returned,
+                "latencies": list(athena.query_seconds),
+                "busy_seconds": page_seconds[0],
+                "cold_page_seconds": round(page_seconds[0], 4),
+                "warm_page_seconds": round(page_seconds[1], 4),
+            }
+
+        results[f"dashboard_{mode}"] = run_stage(f"dashboard_{mode}", page_stage)
+    return results
+
+
+# --- Spend attribution check ---
+
+# A top-level SQL string of the dashboard (an f-string over SPEND_TABLE), taken from its source
+# so the check runs the exact text the panels use
+def dashboard_sql(name, spend_table_name):
+    with open(DASHBOARD) as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == name for t in node.targets):
+            expression = compile(ast.Expression(node.value), DASHBOARD, "eval")
+            return eval(expression, {"SPEND_TABLE": spend_table_name})
+    raise KeyError(f"{name} not found in {DASHBOARD}")
+
+
+# channel_day recomputed in pandas from the processed events and the generated spend files:
+# bookings per (channel, created_at date) and spend per (channel, date), outer-joined
+def attribution_reference(workdir, event_types, files, start, end, channels):
+    import pandas as pd
+
+    events = pd.read_parquet(
+        os.path.join(workdir, "processed", "events"),
+        columns=["event_date", "event", "uri", "created_at", "scheduled_event_event_type"],
+    )
+    mapping = dict(event_type_channels(event_types))
+    events = events.assign(
+        channel=events["scheduled_event_event_type"].map(mapping),
+        day=pd.to_datetime(events["created_at"]).dt.date,
+        key=events["event"].fillna(events["uri"]),
+    )
+    # Bookings made in the range, whatever day they were ingested
+    events = events[events["day"].between(datetime.date.fromisoformat(start), datetime.date.fromisoformat(end))]
+    events = events[events["channel"].isin(channels)]
+    bookings = events.groupby(["channel", "day"])["key"].count().rename("bookings")
+
+    # The spend Lambda keeps the rows dated on the file's own date
+    rows = []
+    for name, text in files.items():
+        file_date = name[len("spend_data_"):-len(".json")]
+        if name.startswith("spend_data_") and start <= file_date <= end:
+            rows += [r for r in json.loads(text) if r["date"] == file_date and r["channel"] in channels]
+    spend = pd.DataFrame(rows, columns=["date", "channel", "spend"])
+    spend = spend.assign(day=pd.to_datetime(spend["date"]).dt.date).groupby(["channel", "day"])["spend"].sum()
+
+    reference = pd.concat([bookings, spend], axis=1).fillna(0).reset_index()
+    return reference.astype({"bookings": "int64"})
+
+
+# SPEND_ATTRIBUTION's channel_day on DuckDB against the pandas reference, over the whole
+# generated range and a narrower range with one channel left out
+def attribution_check(athena, spend_table_name, workdir, event_types, files, start, end):
+    import pandas as pd
+
+    sql = dashboard_sql("SPEND_ATTRIBUTION", f"calendly_project.{spend_table_name}") + """
+        SELECT channel, day, bookings, spend FROM channel_day
+    """
+    middle = (datetime.date.fromisoformat(start) + (datetime.date.fromisoformat(end)
+                                                    - datetime.date.fromisoformat(start)) / 2).isoformat()
+    cases = [(start, end, list(CHANNELS)), (middle, end, list(CHANNELS[1:]))]
+    compared = 0
+    for case_start, case_end, channels in cases:
+        cursor = athena.cursor().execute(sql, {"start": case_start, "end": case_end, "channels": channels})
+        got = pd.DataFrame(cursor.fetchall(), columns=[d[0] for d in cursor.description])
+        got = got.assign(day=pd.to_datetime(got["day"]).dt.date).astype({"bookings": "int64"})
+        expected = attribution_reference(workdir, event_types, files, case_start, case_end, channels)
+        got, expected = (df.sort_values(["channel", "day"]).reset_index(drop=True)[["channel", "day", "bookings", "spend"]]
+                         for df in (got, expected))
+        pd.testing.assert_frame_equal(got, expected, check_dtype=False, rtol=1e-9)
+        compared += len(got)
+    return {"items": compared}
+
+
+# --- Employee panel parity ---
+
+# The employee panel before the rollups, over the hand-made Athena views (not in the repo)
+LEGACY_EMPLOYEE_SQL = """
+    SELECT
+    employee_name,
+    count(DISTINCT event_id)/count(DISTINCT(DATE(event_datetime))) AS meetings_per_day
+    FROM calendly_project.calendly_events
+    INNER JOIN calendly_project.event_memberships  USING (event_id)
+    INNER JOIN calendly_project.employees USING(employee_id)
+    GROUP BY 1
+    ORDER BY 2 DESC
+"""
+
+
+# The SQL string a dashboard query function passes to query_athena
+def dashboard_query(function_name):
+    with open(DASHBOARD) as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == function_name:
+            for call in ast.walk(node):
+                if isinstance(call, ast.Call) and getattr(call.func, "id", None) == "query_athena":
+                    return ast.literal_eval(call.args[0])
+    raise KeyError(f"{function_name} not found in {DASHBOARD}")
+
+
+# rollup_employee_meetings against the legacy query on views built the way the rollup reads the
+# processed table: event_id is the upsert key, event_datetime the meeting start, and
+# employees/event_memberships come from the membership user URI and user_name. Both sides share
+# those definitions, so this shows the rollup aggregates like the old query, not that it
+# matches the production views.
+def employee_parity_check(athena, workdir, start, end):
+    import pandas as pd
+
+    events = os.path.join(workdir, "processed", "events", "*", "*.parquet")
+    source = f"read_parquet('{events}', hive_partitioning = true, hive_types_autocast = false)"
+    memberships = (f"(SELECT COALESCE(event, uri) AS event_id, "
+                   f"UNNEST(scheduled_event_event_memberships) AS m FROM {source})")
+    db = athena.db
+    db.execute("CREATE OR REPLACE MACRO date(ts) AS CAST(ts AS DATE)")
+    db.execute(f"CREATE OR REPLACE VIEW calendly_project.calendly_events AS "
+               f"SELECT COALESCE(event, uri) AS event_id, scheduled_event_start_time AS event_datetime "
+               f"FROM {source} WHERE event_date BETWEEN '{start}' AND '{end}' "
+               f"AND CAST(scheduled_event_start_time AS DATE) BETWEEN '{start}' AND '{end}'")
+    db.execute(f"CREATE OR REPLACE VIEW calendly_project.event_memberships AS "
+               f"SELECT event_id, m.\"user\" AS employee_id FROM {memberships}")
+    db.execute(f"CREATE OR REPLACE VIEW calendly_project.employees AS "
+               f"SELECT DISTINCT m.\"user\" AS employee_id, m.user_name AS employee_name FROM {memberships}")
+
+    frames = []
+    for sql, params in ((LEGACY_EMPLOYEE_SQL, None),
+                        (dashboard_query("get_meetings_by_employee_per_day"), {"start": start, "end": end})):
+        cursor = athena.cursor().execute(sql, params)
+        frame = pd.DataFrame(cursor.fetchall(), columns=[d[0] for d in cursor.description])
+        frames.append(frame.sort_values("employee_name").reset_index(drop=True))
+    pd.testing.assert_frame_equal(frames[1], frames[0], check_dtype=False, rtol=1e-9)
+    return {"items": len(frames[0])}
+
+
+# --- One scale ---
+
+def run_scale(events, args):
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    os.environ["ACK_MODE"] = args.ack_mode
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if not os.environ.get("AWS_ENDPOINT_URL_S3"):
+        from moto import mock_aws
+        mock_aws().start()
+
+    import boto3
+    stages = args.stages.split(",")
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    metrics_path = os.path.join(workdir, "metrics.jsonl")
+    # Read when each component creates its Metrics, i.e. on import
+    os.environ["METRICS_SINK"] = f"file:{metrics_path}"
+    rng = random.Random(args.seed)
+    end_date = datetime.date.today()
+
+    if args.ack_mode == "queue":
+        # Read by the webhook on import; the worker stage drains this queue into segments
+        os.environ["QUEUE_URL"] = boto3.client("sqs").create_queue(QueueName="calendly-webhooks")["QueueUrl"]
+    webhook = load_module("calendly_webhook_app", WEBHOOK_APP)
+    # One spend module per output format; OUTPUT_FORMAT is read on import
+    spends = {}
+    for fmt in args.spend_formats.split(","):
+        os.environ["OUTPUT_FORMAT"] = fmt
+        spends[fmt] = load_module(f"calendly_spend_app_{fmt}", SPEND_APP)
+    s3 = boto3.client("s3")
+    try:
+        s3.create_bucket(Bucket=webhook.BUCKET_NAME)
+    except s3.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    event_types = sorted(webhook.ALLOWED_EVENT_TYPES)
+
+    print(f"{events} events over {args.days} days ({workdir})", flush=True)
+    results = {}
+    if "webhook" in stages:
+        bodies = webhook_bodies(rng, events, event_types, args.days, end_date, args.reject_ratio)
+        results["webhook"] = run_stage("webhook", lambda: webhook_stage(webhook, bodies))
+    if "spend" in stages:
+        files = spend_files(rng, args.days, end_date, rows_per_channel=args.spend_rows)
+        for fmt, spend in spends.items():
+            results[f"spend_{fmt}"] = run_stage(f"spend_{fmt}", lambda: spend_stage(spend, files))
+    if "glue" in stages:
+        sys.argv = [sys.argv[0], "--FETCH_WORKERS", str(args.fetch_workers)]
+        job = load_module("CalendlyDailyEventJob", GLUE_JOB)
+        from pyspark.sql import SparkSession
+        spark = (
+            SparkSession.builder.master("local[*]")
+            .config("spark.ui.enabled", "false")
+            .config("spark.sql.shuffle.partitions", "8")
+            .config("spark.sql.session.timeZone", "UTC")
+            .config("spark.sql.warehouse.dir", os.path.join(workdir, "warehouse"))
+            .getOrCreate()
+        )
+        results.update(glue_stages(job, spark, workdir, event_types, args.upsert_ratio))
+        spark.stop()
+    if "dashboard" in stages:
+        db = duckdb_catalog(workdir, spends, s3, webhook.BUCKET_NAME, event_types)
+        start = (end_date - datetime.timedelta(days=args.days - 1)).isoformat()
+        if "spend" in stages:
+            for fmt, spend in spends.items():
+                results[f"spend_scan_{fmt}"] = run_stage(
+                    f"spend_scan_{fmt}", lambda: spend_scan_stage(db, workdir, spend, start, end_date.isoformat()))
+                print(f"  {'':<18} {results[f'spend_scan_{fmt}']['bytes_scanned']:>9} bytes scanned", flush=True)
+        athena = DuckDBAthena(db)
+        first = next(iter(spends.values()))
+        if "spend" in stages and "glue" in stages:
+            results["attribution_check"] = run_stage("attribution_check", lambda: attribution_check(
+                athena, spend_table(first), workdir, event_types, files, start, end_date.isoformat()))
+        if "glue" in stages:
+            results["employee_parity"] = run_stage(
+                "employee_parity", lambda: employee_parity_check(athena, workdir, start, end_date.isoformat()))
+        results.update(dashboard_stages(athena, spend_table(first)))
+    results["instrumentation"] = instrumentation_summary(metrics_path)
+    return results
+
+
+# --- Driver ---
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True)
+        dirty = subprocess.run(["git", "status", "--porcelain"], cwd=ROOT, capture_output=True, text=True, check=True)
+        return commit.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nitems/sec vs {baseline_path} ({baseline.get('commit')}):")
+    for scale, stages in results["runs"].items():
+        for stage, current in stages.items():
+            before = baseline.get("runs", {}).get(scale, {}).get(stage)
+            if not before or not before.get("items_per_sec") or not current.get("items_per_sec"):
+                continue
+            ratio = current["items_per_sec"] / before["items_per_sec"]
+            print(f"  {scale:>8} {stage:<20} {before['items_per_sec']:>11.1f} -> "
+                  f"{current['items_per_sec']:>11.1f}/s  ({ratio:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", default="10000", help="comma-separated event counts")
+    parser.add_argument("--days", type=int, default=30, help="days of bookings and spend files")
+    parser.add_argument("--spend-rows", type=int, default=100, help="rows per channel in each spend file")
+    parser.add_argument("--spend-formats", default="json,parquet",
+                        help="spend OUTPUT_FORMATs to run and scan; the first one feeds the dashboard")
+    parser.add_argument("--reject-ratio", type=float, default=0.1, help="share of deliveries with untracked event types")
+    parser.add_argument("--upsert-ratio", type=float, default=0.1,
+                        help="share of events redelivered with a newer updated_at in the glue_upsert stage")
+    parser.add_argument("--ack-mode", choices=["sync", "queue"], default="sync",
+                        help="queue: enqueue to SQS and persist through the worker's gzip NDJSON segments")
+    parser.add_argument("--fetch-workers", type=int, default=32)
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"subset of {','.join(STAGES)}")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default="bench_pipeline_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare items/sec against")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        with open(args.output, "w") as f:
+            json.dump(run_scale(args.single, args), f)
+        return
+
+    results = {
+        "commit": git_commit(),
+        "created_at": datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "single")},
+        "runs": {},
+    }
+    for events in (int(n) for n in args.scales.split(",")):
+        # A fresh process per scale keeps S3 state and peak memory from carrying over
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+            scale_output = tmp.name
+        command = [
+            sys.executable, os.path.abspath(__file__), "--single", str(events), "--output", scale_output,
+            "--days", str(args.days), "--spend-rows", str(args.spend_rows),
+            "--spend-formats", args.spend_formats,
+            "--reject-ratio", str(args.reject_ratio),
+            "--upsert-ratio", str(args.upsert_ratio), "--ack-mode", args.ack_mode,
+            "--fetch-workers", str(args.fetch_workers), "--stages", args.stages, "--seed", str(args.seed),
+        ]
+        subprocess.run(command, check=True)
+        with open(scale_output) as f:
+            results["runs"][str(events)] = json.load(f)
+        os.remove(scale_output)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
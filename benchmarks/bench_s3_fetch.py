@@ -0,0 +1,80 @@
+# Compare serial vs pooled raw-file fetching in CalendlyDailyEventJob against a local S3 stand-in.
+#
+#   pip install "moto[s3]" pyspark boto3
+#   python benchmarks/bench_s3_fetch.py --files 2000 --workers 32
+#
+# Set AWS_ENDPOINT_URL_S3 (e.g. http://localhost:9000 for MinIO) to benchmark a real S3-compatible
+# server instead of the in-process moto mock.
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "glue_jobs"))
+sys.path.insert(0, os.path.join(ROOT, "shared", "python"))
+
+
+def load_job(workers, endpoint_url):
+    sys.argv = [sys.argv[0], "--FETCH_WORKERS", str(workers)]
+    job = importlib.import_module("CalendlyDailyEventJob")
+    if endpoint_url:
+        import boto3
+        from botocore.config import Config
+        job.s3 = boto3.client("s3", endpoint_url=endpoint_url, config=Config(
+            max_pool_connections=workers,
+            retries={"max_attempts": 10, "mode": "adaptive"}
+        ))
+    return job
+
+
+def seed(job, n_files):
+    try:
+        job.s3.create_bucket(Bucket=job.raw_bucket)
+    except job.s3.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    keys = []
+    body = json.dumps({"event": "invitee.created", "payload": {"uri": "x", "tracking": {}}})
+    for i in range(n_files):
+        key = f"{job.raw_prefix}2099-01-01/{i:08d}_{uuid.uuid4()}.json"
+        job.s3.put_object(Bucket=job.raw_bucket, Key=key, Body=body)
+        keys.append(key)
+    return keys
+
+
+def run(label, fetch, keys):
+    started = time.perf_counter()
+    ok = sum(1 for _ in fetch(keys))
+    elapsed = time.perf_counter() - started
+    print(f"{label:>8}: {ok} files in {elapsed:.2f}s -> {ok / elapsed:.1f} files/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=32)
+    args = parser.parse_args()
+
+    endpoint_url = os.environ.get("AWS_ENDPOINT_URL_S3")
+    if endpoint_url:
+        job = load_job(args.workers, endpoint_url)
+        keys = seed(job, args.files)
+    else:
+        from moto import mock_aws
+        os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+        mock = mock_aws()
+        mock.start()
+        job = load_job(args.workers, None)
+        keys = seed(job, args.files)
+
+    run("serial", lambda ks: (job.fetch_raw_object(k) for k in ks), keys)
+    run("pooled", job.fetch_raw_objects, keys)
+
+
+if __name__ == "__main__":
+    main()
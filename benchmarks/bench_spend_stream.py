@@ -0,0 +1,144 @@
+# Memory benchmark for the calendlySpendData streaming path on a multi-GB spend file.
+#
+#   python benchmarks/bench_spend_stream.py --size-gb 2 [--match-ratio 0.5] [--format parquet]
+#
+# Serves a generated JSON array of --size-gb from a local HTTP server (one repeated block of
+# rows, so the server holds about one block) and runs process_spend_file on it, with S3 replaced
+# by an in-process stand-in that counts and discards the uploaded parts. Reports throughput,
+# records kept and the process's peak RSS (VmHWM) before and after, which should stay flat as
+# --size-gb grows: the array is parsed in STREAM_CHUNK_SIZE chunks and uploaded in
+# UPLOAD_PART_SIZE parts (Parquet row groups of PARQUET_BATCH_ROWS go to /tmp instead).
+import argparse
+import http.client
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPEND_APP = os.path.join(ROOT, "lambda_functions", "calendlySpendData", "app.py")
+FILE_DATE = "2024-05-01"
+BLOCK_ROWS = 10000
+
+from bench_pipeline import load_module, peak_rss_mb, reset_peak_rss  # noqa: E402
+
+
+# BLOCK_ROWS comma-separated rows; a match_ratio share carries the file's date, the rest the day before
+def row_block(match_ratio):
+    rows = []
+    matching = 0
+    for i in range(BLOCK_ROWS):
+        keep = (i + 1) * match_ratio >= matching + 1
+        matching += keep
+        rows.append(json.dumps({
+            "date": FILE_DATE if keep else "2024-04-30",
+            "channel": ("youtube", "facebook", "tiktok")[i % 3],
+            "spend": round(50 + (i * 7919) % 45000 / 100, 2),
+            "campaign_id": f"cmp-{i:06d}",
+        }))
+    return ",\n".join(rows).encode("utf-8"), matching
+
+
+def serve_array(block, n_blocks):
+    length = 2 + n_blocks * len(block) + (n_blocks - 1) * 2
+
+    class ArrayHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(length))
+            self.send_header("ETag", '"bench"')
+            self.end_headers()
+            self.wfile.write(b"[")
+            for i in range(n_blocks):
+                self.wfile.write(block if i == 0 else b",\n" + block)
+            self.wfile.write(b"]")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ArrayHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, length
+
+
+class DiscardingS3:
+    # The multipart/put/upload_file calls the spend sinks make, counting bytes instead of storing them
+    def __init__(self):
+        self.bytes = 0
+        self.parts = 0
+
+    def create_multipart_upload(self, **kwargs):
+        return {"UploadId": "bench"}
+
+    def upload_part(self, Body, **kwargs):
+        self.bytes += len(Body)
+        self.parts += 1
+        return {"ETag": f'"{self.parts}"'}
+
+    def complete_multipart_upload(self, **kwargs):
+        return {}
+
+    def abort_multipart_upload(self, **kwargs):
+        return {}
+
+    def put_object(self, Body, **kwargs):
+        self.bytes += len(Body)
+        return {}
+
+    def upload_file(self, path, *args, **kwargs):
+        self.bytes += os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-gb", type=float, default=2.0, help="size of the served JSON array")
+    parser.add_argument("--match-ratio", type=float, default=1.0, help="share of rows dated on the file's date")
+    parser.add_argument("--format", choices=["json", "parquet"], default="json", help="spend OUTPUT_FORMAT")
+    args = parser.parse_args()
+
+    os.environ["OUTPUT_FORMAT"] = args.format
+    os.environ.setdefault("METRICS_SINK", "off")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    spend = load_module("calendly_spend_app", SPEND_APP)
+    discard = DiscardingS3()
+    spend.s3 = discard
+
+    block, matching = row_block(args.match_ratio)
+    n_blocks = max(1, int(args.size_gb * 1024 ** 3 / (len(block) + 2)))
+    server, length = serve_array(block, n_blocks)
+    port = server.server_address[1]
+
+    # Plain HTTP to the local server instead of HTTPS to the upstream bucket
+    def local_connection():
+        conn = getattr(spend._connections, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            spend._connections.conn = conn
+        return conn
+
+    spend.get_connection = local_connection
+    reset_peak_rss()
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    try:
+        _, records_count, _ = spend.process_spend_file(f"spend_data_{FILE_DATE}.json")
+    finally:
+        server.shutdown()
+    elapsed = time.perf_counter() - started
+    peak = peak_rss_mb()
+
+    expected = matching * n_blocks
+    if records_count != expected:
+        raise RuntimeError(f"kept {records_count} records, expected {expected}")
+    print(f"served            {length / 1024 ** 3:.2f} GiB, {BLOCK_ROWS * n_blocks} rows")
+    print(f"kept              {records_count} rows ({args.format}), uploaded {discard.bytes / 1024 ** 2:.1f} MiB "
+          f"in {discard.parts or 1} parts")
+    print(f"elapsed           {elapsed:.1f}s, {length / 1024 ** 2 / elapsed:.1f} MiB/s")
+    print(f"peak RSS (VmHWM)  {baseline:.1f} MB before, {peak:.1f} MB after")
+
+
+if __name__ == "__main__":
+    main()
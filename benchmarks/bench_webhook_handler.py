@@ -0,0 +1,93 @@
+# Local latency benchmark for the calendly_webhook Lambda handler.
+#
+#   python benchmarks/bench_webhook_handler.py --requests 5000
+#
+# Reports p50/p99 handler latency for accepted and rejected events (uploads go to an
+# in-process stand-in for the S3 client) and the cold-start import time of app.py.
+# Per-request metric lines are off unless METRICS_SINK is set (e.g. stdout, to include
+# their cost in the accepted-event latency).
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT, "lambda_functions", "calendly_webhook")
+SHARED_DIR = os.path.join(ROOT, "shared", "python")
+sys.path[:0] = [APP_DIR, SHARED_DIR]
+os.environ.setdefault("METRICS_SINK", "off")
+
+import app  # noqa: E402
+
+
+class DiscardingS3:
+    def put_object(self, **kwargs):
+        return {}
+
+
+def webhook_event(event_type):
+    body = {
+        "created_at": "2024-05-01T10:00:00.000000Z",
+        "event": "invitee.created",
+        "payload": {
+            "email": "lead@example.com",
+            "name": "Test Lead",
+            "questions_and_answers": [{"answer": "x" * 200, "position": 0, "question": "Notes"}],
+            "scheduled_event": {
+                "event_type": event_type,
+                "event_memberships": [{"user": "https://api.calendly.com/users/1", "user_name": "Rep"}],
+                "start_time": "2024-05-02T10:00:00.000000Z",
+                "uri": f"https://api.calendly.com/scheduled_events/{uuid.uuid4()}",
+            },
+            "tracking": {"utm_source": "youtube"},
+            "uri": f"https://api.calendly.com/scheduled_events/x/invitees/{uuid.uuid4()}",
+        },
+    }
+    return {"body": json.dumps(body)}
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+
+def bench(label, event, n):
+    samples = []
+    for _ in range(n):
+        started = time.perf_counter()
+        response = app.lambda_handler(event, None)
+        samples.append((time.perf_counter() - started) * 1e6)
+    assert response["statusCode"] == 200, response
+    p50, p99 = percentiles(samples)
+    print(f"{label:>9}: p50 {p50:8.1f} µs | p99 {p99:8.1f} µs")
+
+
+def cold_start(runs):
+    code = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+    times = []
+    for _ in range(runs):
+        env = dict(os.environ, PYTHONPATH=SHARED_DIR)
+        out = subprocess.run([sys.executable, "-c", code], cwd=APP_DIR, env=env, capture_output=True, text=True, check=True)
+        times.append(float(out.stdout.strip()) * 1000)
+    print(f"cold import: median {statistics.median(times):.1f} ms over {runs} runs")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--cold-runs", type=int, default=5)
+    args = parser.parse_args()
+
+    app._s3 = DiscardingS3()
+    allowed = sorted(app.ALLOWED_EVENT_TYPES)[0]
+    bench("accepted", webhook_event(allowed), args.requests)
+    bench("rejected", webhook_event("https://api.calendly.com/event_types/not-tracked"), args.requests)
+    cold_start(args.cold_runs)
+
+
+if __name__ == "__main__":
+    main()
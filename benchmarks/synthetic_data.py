@@ -0,0 +1,124 @@
+# Synthetic Calendly webhook deliveries and upstream spend files for the benchmarks.
+#
+# Payloads carry every field transform_flattened_row / flatten_payload read, with the shapes
+# Calendly sends (nested scheduled_event, event_memberships, tracking). Everything is drawn
+# from the rng passed in, so a seed reproduces the same data.
+import datetime
+import json
+import uuid
+
+CHANNELS = ("youtube", "facebook", "tiktok")
+CALENDLY_TS = "%Y-%m-%dT%H:%M:%S.000000Z"
+
+
+def rng_uuid(rng):
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def random_created(rng):
+    return f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00.000000Z"
+
+
+# created/start_time are Calendly timestamp strings (random 2024 dates by default, meeting
+# at booking time); event_type defaults to one of three placeholder event types
+def synthetic_payload(rng, created=None, start_time=None, event_type=None):
+    created = created or random_created(rng)
+    start_time = start_time or created
+    event_uri = f"https://api.calendly.com/scheduled_events/{rng_uuid(rng)}"
+    rep = rng.randint(1, 20)
+    return {
+        "cancel_url": f"https://calendly.com/cancellations/{rng_uuid(rng)}",
+        "created_at": created,
+        "email": f"lead{rng.randint(0, 10**6)}@example.com",
+        "event": event_uri,
+        "first_name": None,
+        "invitee_scheduled_by": None,
+        "last_name": None,
+        "name": "Test Lead",
+        "new_invitee": None,
+        "no_show": None,
+        "old_invitee": None,
+        "payment": None,
+        "questions_and_answers": [{"answer": "Yes", "position": 0, "question": "Interested?"}],
+        "reconfirmation": None,
+        "reschedule_url": f"https://calendly.com/reschedulings/{rng_uuid(rng)}",
+        "rescheduled": False,
+        "routing_form_submission": None,
+        "scheduled_event": {
+            "created_at": created,
+            "end_time": start_time,
+            "event_guests": [],
+            "event_memberships": [{
+                "buffered_end_time": start_time,
+                "buffered_start_time": start_time,
+                "user": f"https://api.calendly.com/users/{rep}",
+                "user_email": f"rep{rep}@example.com",
+                "user_name": f"Rep {rep}",
+            }],
+            "event_type": event_type or f"https://api.calendly.com/event_types/{rng.randint(1, 3)}",
+            "invitees_counter": {"active": 1, "limit": 1, "total": 1},
+            "location": {"join_url": "https://zoom.us/j/1", "status": "pushed", "type": "zoom"},
+            "meeting_notes_html": None,
+            "meeting_notes_plain": None,
+            "name": "Discovery Call",
+            "start_time": start_time,
+            "status": "active",
+            "updated_at": created,
+            "uri": event_uri,
+        },
+        "scheduling_method": None,
+        "status": "active",
+        "text_reminder_number": None,
+        "timezone": "America/New_York",
+        "tracking": {
+            "utm_campaign": None,
+            "utm_source": rng.choice(CHANNELS),
+            "utm_medium": None,
+            "utm_content": None,
+            "utm_term": None,
+            "salesforce_uuid": None,
+        },
+        "updated_at": created,
+        "uri": f"{event_uri}/invitees/{rng_uuid(rng)}",
+    }
+
+
+# Yield n webhook request bodies (JSON strings, as API Gateway passes them) for invitee.created
+# deliveries booked over the `days` days ending at end_date, with meetings up to a week later.
+# A reject_ratio share uses an event type outside event_types, which the webhook should drop.
+def webhook_bodies(rng, n, event_types, days, end_date, reject_ratio=0.0):
+    first = datetime.datetime.combine(end_date - datetime.timedelta(days=days - 1), datetime.time())
+    span_seconds = days * 86400
+    for _ in range(n):
+        booked = first + datetime.timedelta(seconds=rng.randrange(span_seconds))
+        meeting = booked + datetime.timedelta(minutes=rng.randrange(30, 7 * 24 * 60))
+        if rng.random() < reject_ratio:
+            event_type = f"https://api.calendly.com/event_types/{rng_uuid(rng)}"
+        else:
+            event_type = rng.choice(event_types)
+        created = booked.strftime(CALENDLY_TS)
+        yield json.dumps({
+            "created_at": created,
+            "created_by": "https://api.calendly.com/users/owner",
+            "event": "invitee.created",
+            "payload": synthetic_payload(rng, created, meeting.strftime(CALENDLY_TS), event_type),
+        })
+
+
+# Upstream spend files for the `days` days ending at end_date, as {file name: JSON array text},
+# plus the file_index.json listing them. Each file holds rows_per_channel rows per channel for
+# its own date and a few rows for the previous day, which the spend Lambda filters out.
+def spend_files(rng, days, end_date, channels=CHANNELS, rows_per_channel=1):
+    files = {}
+    for offset in range(days - 1, -1, -1):
+        day = end_date - datetime.timedelta(days=offset)
+        previous = (day - datetime.timedelta(days=1)).isoformat()
+        records = [
+            {"date": day.isoformat(), "channel": channel, "spend": round(rng.uniform(50, 500), 2)}
+            for channel in channels for _ in range(rows_per_channel)
+        ]
+        records += [{"date": previous, "channel": channel, "spend": 0.0} for channel in channels]
+        rng.shuffle(records)
+        files[f"spend_data_{day.isoformat()}.json"] = json.dumps(records)
+    files["file_index.json"] = json.dumps({"files": sorted(files)})
+    return files
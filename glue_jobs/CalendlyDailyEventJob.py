@@ -1,222 +1,1160 @@
-import sys
-import boto3
-import json
-from pyspark.context import SparkContext
-from awsglue.context import GlueContext
-from pyspark.sql import Row
-from pyspark.sql.functions import lit, to_timestamp, col
-from pyspark.sql.types import (
-    StructType, StructField, StringType, IntegerType, BooleanType, ArrayType, StructType
-)
-
-# Initialize Spark and Glue context
-sc = SparkContext()
-glueContext = GlueContext(sc)
-spark = glueContext.spark_session
-
-# AWS clients
-s3 = boto3.client('s3')
-athena = boto3.client('athena')
-
-# Config
-raw_bucket = "de-calendly-project-bucket"
-raw_prefix = "raw/"
-processed_prefix = "processed/events/"
-athena_output = f"s3://{raw_bucket}/athena-results/"
-athena_db = "calendly_project"
-athena_table = "events_raw"
-
-# Recursive flatten dict, preserve lists as-is
-def flatten_dict(d, parent_key='', sep='_'):
-    items = []
-    for k, v in d.items():
-        new_key = f"{parent_key}{sep}{k}" if parent_key else k
-        if isinstance(v, dict):
-            items.extend(flatten_dict(v, new_key, sep=sep).items())
-        elif isinstance(v, list):
-            items.append((new_key, v))
-        else:
-            items.append((new_key, v))
-    return dict(items)
-
-# Schema with timestamp fields as StringType initially
-schema = StructType([
-    StructField("cancel_url", StringType(), True),
-    StructField("created_at", StringType(), True),  # STRING for now
-    StructField("email", StringType(), True),
-    StructField("event", StringType(), True),
-    StructField("first_name", StringType(), True),
-    StructField("invitee_scheduled_by", StringType(), True),
-    StructField("last_name", StringType(), True),
-    StructField("name", StringType(), True),
-    StructField("new_invitee", StringType(), True),
-    StructField("no_show", StringType(), True),
-    StructField("old_invitee", StringType(), True),
-    StructField("payment", StringType(), True),
-    StructField("questions_and_answers", ArrayType(StructType([
-        StructField("answer", StringType(), True),
-        StructField("position", IntegerType(), True),
-        StructField("question", StringType(), True)
-    ])), True),
-    StructField("reconfirmation", StringType(), True),
-    StructField("reschedule_url", StringType(), True),
-    StructField("rescheduled", BooleanType(), True),
-    StructField("routing_form_submission", StringType(), True),
-    StructField("scheduled_event_created_at", StringType(), True),
-    StructField("scheduled_event_end_time", StringType(), True),
-    StructField("scheduled_event_event_guests", ArrayType(StringType()), True),
-    StructField("scheduled_event_event_memberships", ArrayType(StructType([
-        StructField("user", StringType(), True),
-        StructField("user_email", StringType(), True),
-        StructField("user_name", StringType(), True)
-    ])), True),
-    StructField("scheduled_event_event_type", StringType(), True),
-    StructField("scheduled_event_invitees_counter_total", IntegerType(), True),
-    StructField("scheduled_event_invitees_counter_active", IntegerType(), True),
-    StructField("scheduled_event_invitees_counter_limit", IntegerType(), True),
-    StructField("scheduled_event_location_location", StringType(), True),
-    StructField("scheduled_event_location_type", StringType(), True),
-    StructField("scheduled_event_meeting_notes_html", StringType(), True),
-    StructField("scheduled_event_meeting_notes_plain", StringType(), True),
-    StructField("scheduled_event_name", StringType(), True),
-    StructField("scheduled_event_start_time", StringType(), True),
-    StructField("scheduled_event_status", StringType(), True),
-    StructField("scheduled_event_updated_at", StringType(), True),
-    StructField("scheduled_event_uri", StringType(), True),
-    StructField("scheduling_method", StringType(), True),
-    StructField("status", StringType(), True),
-    StructField("text_reminder_number", StringType(), True),
-    StructField("timezone", StringType(), True),
-    StructField("tracking_utm_campaign", StringType(), True),
-    StructField("tracking_utm_source", StringType(), True),
-    StructField("tracking_utm_medium", StringType(), True),
-    StructField("tracking_utm_content", StringType(), True),
-    StructField("tracking_utm_term", StringType(), True),
-    StructField("tracking_salesforce_uuid", StringType(), True),
-    StructField("updated_at", StringType(), True),
-    StructField("uri", StringType(), True),
-
-    StructField("event_date", StringType(), True)  # partition column
-])
-
-# Helper to extract nested fields flattened
-def transform_flattened_row(row):
-    flat = flatten_dict(row)
-
-    se = row.get("scheduled_event", {})
-    if se:
-        flat["scheduled_event_created_at"] = se.get("created_at")
-        flat["scheduled_event_end_time"] = se.get("end_time")
-        flat["scheduled_event_event_guests"] = se.get("event_guests", [])
-        flat["scheduled_event_event_memberships"] = se.get("event_memberships", [])
-        flat["scheduled_event_event_type"] = se.get("event_type")
-        ic = se.get("invitees_counter", {})
-        flat["scheduled_event_invitees_counter_total"] = ic.get("total")
-        flat["scheduled_event_invitees_counter_active"] = ic.get("active")
-        flat["scheduled_event_invitees_counter_limit"] = ic.get("limit")
-        loc = se.get("location", {})
-        flat["scheduled_event_location_location"] = loc.get("location")
-        flat["scheduled_event_location_type"] = loc.get("type")
-        flat["scheduled_event_meeting_notes_html"] = se.get("meeting_notes_html")
-        flat["scheduled_event_meeting_notes_plain"] = se.get("meeting_notes_plain")
-        flat["scheduled_event_name"] = se.get("name")
-        flat["scheduled_event_start_time"] = se.get("start_time")
-        flat["scheduled_event_status"] = se.get("status")
-        flat["scheduled_event_updated_at"] = se.get("updated_at")
-        flat["scheduled_event_uri"] = se.get("uri")
-
-    tracking = row.get("tracking", {})
-    flat["tracking_utm_campaign"] = tracking.get("utm_campaign")
-    flat["tracking_utm_source"] = tracking.get("utm_source")
-    flat["tracking_utm_medium"] = tracking.get("utm_medium")
-    flat["tracking_utm_content"] = tracking.get("utm_content")
-    flat["tracking_utm_term"] = tracking.get("utm_term")
-    flat["tracking_salesforce_uuid"] = tracking.get("salesforce_uuid")
-
-    return flat
-
-
-# List date folders under raw/
-response = s3.list_objects_v2(Bucket=raw_bucket, Prefix=raw_prefix, Delimiter='/')
-date_folders = [prefix['Prefix'] for prefix in response.get('CommonPrefixes', [])]
-
-for folder_path in date_folders:
-    date_part = folder_path.rstrip('/').split('/')[-1]  # get 'YYYY-MM-DD' from 'raw/YYYY-MM-DD/'
-    print(f"📂 Processing folder: {folder_path}")
-
-    # List JSON files in the folder
-    response = s3.list_objects_v2(Bucket=raw_bucket, Prefix=folder_path)
-    json_files = [obj['Key'] for obj in response.get('Contents', []) if obj['Key'].endswith(".json")]
-
-    if not json_files:
-        print(f"🚫 No JSON files found in {folder_path}, skipping.")
-        continue
-
-    # Read and transform all JSON files
-    flattened_rows = []
-    for key in json_files:
-        file_obj = s3.get_object(Bucket=raw_bucket, Key=key)
-        raw_content = file_obj['Body'].read().decode('utf-8')
-
-        try:
-            data = json.loads(raw_content)
-            payload = data.get("payload", {})
-            transformed = transform_flattened_row(payload)
-            flattened_rows.append(transformed)
-        except Exception as e:
-            print(f"⚠️ Failed to parse {key}: {e}")
-
-    if not flattened_rows:
-        print(f"🚫 No valid events found in {folder_path}, skipping.")
-        continue
-
-    # Create DataFrame with schema (timestamps as strings)
-    df = spark.createDataFrame(flattened_rows, schema=schema)
-
-    # Add partition column
-    df = df.withColumn("event_date", lit(date_part))
-
-    # Convert timestamp strings to actual TimestampType
-    timestamp_cols = [
-        "created_at",
-        "scheduled_event_created_at",
-        "scheduled_event_end_time",
-        "scheduled_event_start_time",
-        "scheduled_event_updated_at",
-        "updated_at"
-    ]
-    timestamp_format = "yyyy-MM-dd'T'HH:mm:ss.SSSSSS'Z'"
-
-    for c in timestamp_cols:
-        df = df.withColumn(c, to_timestamp(col(c), timestamp_format))
-
-    df = df.dropDuplicates(["event"])
-
-    # Write to Parquet partition folder
-    output_path = f"s3://{raw_bucket}/{processed_prefix}event_date={date_part}/"
-    df.write.mode("append").parquet(output_path)
-    print(f"✅ Wrote processed data to {output_path}")
-
-    # Add partition to Athena
-    partition_sql = f"""
-        ALTER TABLE {athena_table}
-        ADD IF NOT EXISTS
-        PARTITION (event_date = '{date_part}')
-        LOCATION 's3://{raw_bucket}/{processed_prefix}event_date={date_part}/'
-    """
-    athena.start_query_execution(
-        QueryString=partition_sql,
-        QueryExecutionContext={'Database': athena_db},
-        ResultConfiguration={'OutputLocation': athena_output}
-    )
-    print(f"📌 Added partition to Athena for event_date={date_part}")
-
-    # Delete raw JSON files in folder
-    delete_objs = [{'Key': key} for key in json_files]
-    if delete_objs:
-        s3.delete_objects(Bucket=raw_bucket, Delete={'Objects': delete_objs})
-        print(f"🗑️ Deleted raw files in folder {folder_path}")
-
-sc.stop()
-print("Glue job finished.")
-
+import sys
+import gzip
+import math
+import time
+import datetime
+import itertools
+import boto3
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from botocore.config import Config
+from pyspark.context import SparkContext
+from pyspark.sql import Row, Window
+from pyspark.sql.functions import (
+    lit, to_timestamp, col, when, input_file_name, regexp_extract, coalesce, row_number, broadcast,
+    to_date, hour, count, countDistinct, explode_outer, from_json, array, size, map_keys, array_contains,
+    date_sub, date_format
+)
+from pyspark.sql.types import (
+    StructType, StructField, StringType, IntegerType, BooleanType, ArrayType, StructType, TimestampType,
+    MapType
+)
+# shared/python/instrumentation.py, shipped to Glue with --extra-py-files
+from instrumentation import Metrics
+
+# Optional job arguments (--NAME value); getResolvedOptions only handles required ones
+def get_job_arg(name, default):
+    flag = f"--{name}"
+    if flag in sys.argv:
+        idx = sys.argv.index(flag)
+        if idx + 1 < len(sys.argv):
+            return sys.argv[idx + 1]
+    return default
+
+# Config
+raw_bucket = "de-calendly-project-bucket"
+raw_prefix = "raw/"
+processed_prefix = "processed/events/"
+# Root of the bucket as Spark and Athena address it; every table path is built from it
+bucket_url = f"s3://{raw_bucket}/"
+athena_output = f"{bucket_url}athena-results/"
+athena_db = "calendly_project"
+athena_table = "events_raw"
+# Longest wait for one Athena statement; a query still running then is stopped and the run fails
+athena_timeout_seconds = int(get_job_arg("ATHENA_TIMEOUT_SECONDS", "600"))
+# Single-event JSON files, and gzip NDJSON segments from the webhook's segment mode
+raw_suffixes = (".json", ".json.gz")
+fetch_workers = int(get_job_arg("FETCH_WORKERS", "32"))
+# "driver": fetch + flatten in Python on the driver; "spark": executors read and flatten raw/ themselves
+ingest_mode = get_job_arg("INGEST_MODE", "driver")
+# Run state: per-date manifests of processed raw keys, the listing watermark and the in-flight commit marker
+state_prefix = "state/calendly_daily_event_job/"
+manifest_prefix = f"{state_prefix}manifests/"
+watermark_key = f"{state_prefix}watermark.json"
+pending_commit_key = f"{state_prefix}pending_commit.json"
+# Raw files are kept after processing when false (needed to reprocess dates later)
+delete_raw = get_job_arg("DELETE_RAW", "true").lower() == "true"
+# "YYYY-MM-DD" or "YYYY-MM-DD:YYYY-MM-DD": rebuild just these partitions from raw/, ignoring manifests
+reprocess_dates = get_job_arg("REPROCESS_DATES", "")
+# "append": add each run's rows to its partitions; "upsert": merge on the event key, keeping the latest updated_at
+write_mode = get_job_arg("WRITE_MODE", "append")
+# Per-partition sidecar of {event key: updated_at}, used by upsert to route keys to the partition holding them
+key_index_prefix = f"{state_prefix}key_index/"
+# Partitions an upsert rewrote that still need Athena registration and a rollup rebuild. A rerun
+# finds their events already up to date and touches nothing, so main() publishes them from here.
+upsert_pending_key = f"{state_prefix}upsert_pending.json"
+# "ingest": process raw/; "compact": rewrite processed/events partitions into fewer, larger files;
+# "rollup": rebuild the dashboard rollups
+job_mode = get_job_arg("JOB_MODE", "ingest")
+compact_target_mb = int(get_job_arg("COMPACT_TARGET_MB", "128"))
+# Optional "YYYY-MM-DD[:YYYY-MM-DD]" to limit compaction; otherwise every partition with more than one file
+compact_dates = get_job_arg("COMPACT_DATES", "")
+compaction_staging_prefix = "processed/_compaction/"
+compaction_marker_key = f"{state_prefix}compaction_in_progress.json"
+compaction_report_prefix = f"{state_prefix}compaction_reports/"
+# Dashboard rollups, rebuilt from processed/events for every event_date partition a run writes.
+# Spend stays in daily_spends, already one row per channel and day, so late spend files show up
+# without a rebuild. JOB_MODE=rollup rebuilds ROLLUP_DATES (default: every processed partition).
+rollup_prefix = "processed/rollups/"
+rollup_tables = {
+    "rollup_channel_bookings": "channel string, booking_date date, booking_hour int, bookings bigint",
+    "rollup_channel_meetings": "channel string, meeting_date date, meeting_hour int, meetings bigint",
+    "rollup_employee_meetings": "employee_name string, meeting_date date, meetings bigint",
+}
+rollup_dates = get_job_arg("ROLLUP_DATES", "")
+# Per-stage metrics. Glue doesn't turn EMF lines on stdout into metrics the way Lambda does, so
+# they are published with PutMetricData (and still logged) unless --METRICS_SINK or the
+# METRICS_SINK environment says otherwise; --PROFILE_STAGES fetch_parse,write runs those stages under cProfile
+metrics = Metrics(
+    "CalendlyDailyEventJob",
+    sink=get_job_arg("METRICS_SINK", os.environ.get("METRICS_SINK", "cloudwatch")),
+    profile_stages=get_job_arg("PROFILE_STAGES", None),
+)
+
+# AWS clients
+# The S3 pool matches the fetch workers so concurrent GETs don't queue on connections,
+# and adaptive retries back off client-side when S3 answers with SlowDown/503
+s3 = boto3.client('s3', config=Config(
+    max_pool_connections=fetch_workers,
+    retries={'max_attempts': 10, 'mode': 'adaptive'}
+))
+athena = boto3.client('athena')
+glue = boto3.client('glue')
+
+# Schema with timestamp fields as StringType initially
+schema = StructType([
+    StructField("cancel_url", StringType(), True),
+    StructField("created_at", StringType(), True),  # STRING for now
+    StructField("email", StringType(), True),
+    StructField("event", StringType(), True),
+    StructField("first_name", StringType(), True),
+    StructField("invitee_scheduled_by", StringType(), True),
+    StructField("last_name", StringType(), True),
+    StructField("name", StringType(), True),
+    StructField("new_invitee", StringType(), True),
+    StructField("no_show", StringType(), True),
+    StructField("old_invitee", StringType(), True),
+    StructField("payment", StringType(), True),
+    StructField("questions_and_answers", ArrayType(StructType([
+        StructField("answer", StringType(), True),
+        StructField("position", IntegerType(), True),
+        StructField("question", StringType(), True)
+    ])), True),
+    StructField("reconfirmation", StringType(), True),
+    StructField("reschedule_url", StringType(), True),
+    StructField("rescheduled", BooleanType(), True),
+    StructField("routing_form_submission", StringType(), True),
+    StructField("scheduled_event_created_at", StringType(), True),
+    StructField("scheduled_event_end_time", StringType(), True),
+    StructField("scheduled_event_event_guests", ArrayType(StringType()), True),
+    StructField("scheduled_event_event_memberships", ArrayType(StructType([
+        StructField("user", StringType(), True),
+        StructField("user_email", StringType(), True),
+        StructField("user_name", StringType(), True)
+    ])), True),
+    StructField("scheduled_event_event_type", StringType(), True),
+    StructField("scheduled_event_invitees_counter_total", IntegerType(), True),
+    StructField("scheduled_event_invitees_counter_active", IntegerType(), True),
+    StructField("scheduled_event_invitees_counter_limit", IntegerType(), True),
+    StructField("scheduled_event_location_location", StringType(), True),
+    StructField("scheduled_event_location_type", StringType(), True),
+    StructField("scheduled_event_meeting_notes_html", StringType(), True),
+    StructField("scheduled_event_meeting_notes_plain", StringType(), True),
+    StructField("scheduled_event_name", StringType(), True),
+    StructField("scheduled_event_start_time", StringType(), True),
+    StructField("scheduled_event_status", StringType(), True),
+    StructField("scheduled_event_updated_at", StringType(), True),
+    StructField("scheduled_event_uri", StringType(), True),
+    StructField("scheduling_method", StringType(), True),
+    StructField("status", StringType(), True),
+    StructField("text_reminder_number", StringType(), True),
+    StructField("timezone", StringType(), True),
+    StructField("tracking_utm_campaign", StringType(), True),
+    StructField("tracking_utm_source", StringType(), True),
+    StructField("tracking_utm_medium", StringType(), True),
+    StructField("tracking_utm_content", StringType(), True),
+    StructField("tracking_utm_term", StringType(), True),
+    StructField("tracking_salesforce_uuid", StringType(), True),
+    StructField("updated_at", StringType(), True),
+    StructField("uri", StringType(), True),
+
+    StructField("event_date", StringType(), True)  # partition column
+])
+
+# Raw webhook payload as Calendly sends it, used when Spark parses raw/ on the executors.
+# Every leaf maps to the schema column named by joining its path with '_'.
+payload_schema = StructType([
+    StructField("cancel_url", StringType(), True),
+    StructField("created_at", StringType(), True),
+    StructField("email", StringType(), True),
+    StructField("event", StringType(), True),
+    StructField("first_name", StringType(), True),
+    StructField("invitee_scheduled_by", StringType(), True),
+    StructField("last_name", StringType(), True),
+    StructField("name", StringType(), True),
+    StructField("new_invitee", StringType(), True),
+    StructField("no_show", StringType(), True),
+    StructField("old_invitee", StringType(), True),
+    StructField("payment", StringType(), True),
+    StructField("questions_and_answers", ArrayType(StructType([
+        StructField("answer", StringType(), True),
+        StructField("position", IntegerType(), True),
+        StructField("question", StringType(), True)
+    ])), True),
+    StructField("reconfirmation", StringType(), True),
+    StructField("reschedule_url", StringType(), True),
+    StructField("rescheduled", BooleanType(), True),
+    StructField("routing_form_submission", StringType(), True),
+    StructField("scheduled_event", StructType([
+        StructField("created_at", StringType(), True),
+        StructField("end_time", StringType(), True),
+        StructField("event_guests", ArrayType(StringType()), True),
+        StructField("event_memberships", ArrayType(StructType([
+            StructField("user", StringType(), True),
+            StructField("user_email", StringType(), True),
+            StructField("user_name", StringType(), True)
+        ])), True),
+        StructField("event_type", StringType(), True),
+        StructField("invitees_counter", StructType([
+            StructField("total", IntegerType(), True),
+            StructField("active", IntegerType(), True),
+            StructField("limit", IntegerType(), True)
+        ]), True),
+        StructField("location", StructType([
+            StructField("location", StringType(), True),
+            StructField("type", StringType(), True)
+        ]), True),
+        StructField("meeting_notes_html", StringType(), True),
+        StructField("meeting_notes_plain", StringType(), True),
+        StructField("name", StringType(), True),
+        StructField("start_time", StringType(), True),
+        StructField("status", StringType(), True),
+        StructField("updated_at", StringType(), True),
+        StructField("uri", StringType(), True)
+    ]), True),
+    StructField("scheduling_method", StringType(), True),
+    StructField("status", StringType(), True),
+    StructField("text_reminder_number", StringType(), True),
+    StructField("timezone", StringType(), True),
+    StructField("tracking", StructType([
+        StructField("utm_campaign", StringType(), True),
+        StructField("utm_source", StringType(), True),
+        StructField("utm_medium", StringType(), True),
+        StructField("utm_content", StringType(), True),
+        StructField("utm_term", StringType(), True),
+        StructField("salesforce_uuid", StringType(), True)
+    ]), True),
+    StructField("updated_at", StringType(), True),
+    StructField("uri", StringType(), True)
+])
+raw_event_schema = StructType([StructField("payload", payload_schema, True)])
+
+# String columns converted to TimestampType before writing
+timestamp_cols = [
+    "created_at",
+    "scheduled_event_created_at",
+    "scheduled_event_end_time",
+    "scheduled_event_start_time",
+    "scheduled_event_updated_at",
+    "updated_at"
+]
+timestamp_format = "yyyy-MM-dd'T'HH:mm:ss.SSSSSS'Z'"
+
+
+# Map each flattened column name to its path inside the payload
+def schema_field_paths(struct, parent=()):
+    paths = {}
+    for field in struct.fields:
+        path = parent + (field.name,)
+        if isinstance(field.dataType, StructType):
+            paths.update(schema_field_paths(field.dataType, path))
+        else:
+            paths["_".join(path)] = path
+    return paths
+
+
+# Top-level payload fields parsed a second time as maps, from the same line. A non-null map means
+# the value is a JSON object (a string never parses as one), and its keys tell a missing key from
+# an explicit null. Covers the top-level string columns and the parents of flattener_defaults.
+def object_probe_schema():
+    paths = schema_field_paths(payload_schema)
+    probed = {f.name for f in schema.fields if f.name in paths and len(paths[f.name]) == 1
+              and isinstance(f.dataType, StringType)}
+    probed |= {paths[name][0] for name in flattener_defaults}
+    return StructType([StructField("payload", StructType([
+        StructField(name, MapType(StringType(), StringType()), True) for name in sorted(probed)
+    ]), True)])
+
+
+# Column expressions that turn a row of `payload` (raw_event_schema) and `objects`
+# (object_probe_schema) into the flattened `schema`, matching flatten_payload:
+# - a top-level string column whose value is a JSON object is null (its keys become other columns)
+# - a flattener_defaults column is the default when its parent object is non-empty but lacks
+#   the key, and null when the parent is missing, empty or not an object
+def flattened_columns():
+    paths = schema_field_paths(payload_schema)
+    columns = []
+    for field in schema.fields:
+        if field.name == "event_date":
+            continue
+        path = paths.get(field.name)
+        if path is None:
+            columns.append(lit(None).cast(field.dataType).alias(field.name))
+            continue
+        c = col("payload." + ".".join(f"`{p}`" for p in path))
+        if len(path) == 1 and isinstance(field.dataType, StringType):
+            c = when(col(f"objects.`{path[0]}`").isNull(), c)
+        elif field.name in flattener_defaults:
+            parent = col(f"objects.`{path[0]}`")
+            # Every default is an empty list
+            default = array().cast(field.dataType)
+            c = when(size(parent) > 0, when(array_contains(map_keys(parent), path[-1]), c).otherwise(default))
+        columns.append(c.alias(field.name))
+    return columns
+
+
+# Get 'YYYY-MM-DD' from a 'raw/YYYY-MM-DD/...' key or folder
+def date_from_key(key):
+    return key[len(raw_prefix):].split('/', 1)[0]
+
+
+# Read raw webhook files with Spark and flatten them as column expressions. Line-delimited
+# reading covers both single-event files and gzip NDJSON segments (decompressed by extension).
+# Only the key list lives on the driver; lines that aren't JSON objects are dropped like
+# "Failed to parse" ones. event_date comes from each object's raw/YYYY-MM-DD/ folder.
+def read_raw_events(spark, keys):
+    lines = spark.read.text([f"{bucket_url}{key}" for key in keys])
+    event_date = regexp_extract(input_file_name(), f"/{raw_prefix}(\\d{{4}}-\\d{{2}}-\\d{{2}})/", 1)
+    df = lines.select(
+        from_json("value", raw_event_schema).payload.alias("payload"),
+        from_json("value", object_probe_schema()).payload.alias("objects"),
+        event_date.alias("event_date"),
+    )
+    return df.where(col("payload").isNotNull()).select(*flattened_columns(), "event_date")
+
+
+# Defaults for keys missing from a present parent object, as the original row transform applied them
+flattener_defaults = {
+    "scheduled_event_event_guests": [],
+    "scheduled_event_event_memberships": [],
+}
+
+
+# Generate a single-pass flattener from payload_schema and `schema`: one fixed lookup per
+# output column, returning a tuple in schema order with event_date last. Each nested object
+# is fetched once into a local. Output matches the reference flattener in
+# benchmarks/bench_flattener.py for the schema's columns.
+def compile_flattener():
+    paths = schema_field_paths(payload_schema)
+    body = []
+    struct_vars = {(): "p"}
+
+    def struct_var(path):
+        if path not in struct_vars:
+            parent = struct_var(path[:-1])
+            name = f"s{len(struct_vars)}"
+            body.append(f"    {name} = {parent}.get({path[-1]!r})")
+            body.append(f"    if {name}.__class__ is not dict: {name} = _EMPTY")
+            struct_vars[path] = name
+        return struct_vars[path]
+
+    values = []
+    for field in schema.fields:
+        path = paths.get(field.name)
+        if field.name == "event_date":
+            values.append("event_date")
+        elif path is None:
+            values.append("None")
+        elif len(path) == 1:
+            lookup = f"p.get({path[0]!r})"
+            if isinstance(field.dataType, StringType):
+                # Objects expand into other keys, leaving this column null
+                lookup = f"(None if (v := {lookup}).__class__ is dict else v)"
+            values.append(lookup)
+        else:
+            parent = struct_var(path[:-1])
+            if field.name in flattener_defaults:
+                values.append(f"({parent}.get({path[-1]!r}, _DEFAULTS[{field.name!r}]) if {parent} else None)")
+            else:
+                values.append(f"{parent}.get({path[-1]!r})")
+
+    source = "def flatten_payload(p, event_date):\n" + "\n".join(body) + "\n    return (\n" + \
+        "".join(f"        {v},\n" for v in values) + "    )\n"
+    namespace = {"_EMPTY": {}, "_DEFAULTS": flattener_defaults}
+    exec(compile(source, "<flatten_payload>", "exec"), namespace)
+    return namespace["flatten_payload"]
+
+
+flatten_payload = compile_flattener()
+
+
+# Download one raw webhook file (segments are decompressed)
+def fetch_raw_object(key):
+    file_obj = s3.get_object(Bucket=raw_bucket, Key=key)
+    body = file_obj['Body'].read()
+    if key.endswith(".gz"):
+        body = gzip.decompress(body)
+    return body.decode('utf-8')
+
+
+# Fetch raw files on a bounded worker pool, yielding (key, content, error) as each completes.
+# At most 2 * fetch_workers requests are in flight, so memory stays bounded by the window.
+def fetch_raw_objects(keys):
+    keys = iter(keys)
+    with ThreadPoolExecutor(max_workers=fetch_workers) as pool:
+        pending = {pool.submit(fetch_raw_object, key): key for key in itertools.islice(keys, fetch_workers * 2)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                for next_key in itertools.islice(keys, 1):
+                    pending[pool.submit(fetch_raw_object, next_key)] = next_key
+                error = future.exception()
+                yield key, (None if error else future.result()), error
+
+
+def main():
+    # awsglue is only available inside the Glue runtime
+    from awsglue.context import GlueContext
+
+    # Initialize Spark and Glue context
+    sc = SparkContext()
+    glueContext = GlueContext(sc)
+    spark = glueContext.spark_session
+
+    # Undo a failed ingest's uncommitted write before any mode reads or rewrites its partitions:
+    # compacting it would fold those files into compacted-* files, which the rollback would then
+    # delete along with the committed rows
+    roll_back_pending_commit()
+    # Finish any partition swap a previous compaction left half done before touching the table
+    resume_compaction()
+    # Register and roll up the partitions a failed upsert run rewrote but never published
+    finish_pending_upsert(spark)
+    if job_mode == "compact":
+        compact_partitions(spark)
+    elif job_mode == "rollup":
+        dates = parse_date_range(rollup_dates) if rollup_dates else sorted(list_processed_partitions())
+        update_rollups(spark, dates)
+    else:
+        process_raw_folders(spark)
+
+    sc.stop()
+    print("Glue job finished.")
+
+
+# Fetch and flatten raw files on the driver; returns the rows and the keys fetched per date
+def read_raw_events_on_driver(keys):
+    flattened_rows = []
+    fetched_keys = {}
+    started = time.perf_counter()
+    fetched_bytes = 0
+    failed_records = 0
+    with metrics.stage("fetch_parse") as stage:
+        for key, raw_content, error in fetch_raw_objects(keys):
+            if error is not None:
+                # Left in raw/ so the next run picks it up again
+                print(f"⚠️ Failed to fetch {key}: {error}")
+                continue
+            date_part = date_from_key(key)
+            fetched_keys.setdefault(date_part, []).append(key)
+            fetched_bytes += len(raw_content)
+
+            # A segment holds one event per line; a plain .json file is a single event
+            lines = raw_content.splitlines() if key.endswith(".json.gz") else [raw_content]
+            for line_no, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                    payload = data.get("payload", {})
+                    flattened_rows.append(flatten_payload(payload, date_part))
+                except Exception as e:
+                    failed_records += 1
+                    where = f"{key} line {line_no}" if len(lines) > 1 else key
+                    print(f"⚠️ Failed to parse {where}: {e}")
+
+        elapsed = time.perf_counter() - started
+        n_fetched = sum(len(k) for k in fetched_keys.values())
+        stage.add(files=n_fetched, bytes=fetched_bytes, records=len(flattened_rows), failed_records=failed_records)
+    print(f"📥 Fetched {n_fetched}/{len(keys)} files ({fetched_bytes} bytes) "
+          f"in {elapsed:.2f}s, {n_fetched / max(elapsed, 1e-9):.1f} files/sec")
+    return flattened_rows, fetched_keys
+
+
+# Small JSON documents under state/ that track what has been processed
+def read_state(key, default):
+    try:
+        body = s3.get_object(Bucket=raw_bucket, Key=key)['Body'].read()
+    except s3.exceptions.NoSuchKey:
+        return default
+    return json.loads(body)
+
+
+def write_state(key, value):
+    s3.put_object(Bucket=raw_bucket, Key=key, Body=json.dumps(value).encode('utf-8'), ContentType='application/json')
+
+
+def manifest_key(date_part):
+    return f"{manifest_prefix}event_date={date_part}.json"
+
+
+# Fully paginated listings (list_objects_v2 returns at most 1000 entries per call)
+def list_keys(prefix):
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=raw_bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            yield obj['Key']
+
+
+def list_date_folders(start_after=None):
+    paginator = s3.get_paginator('list_objects_v2')
+    kwargs = {'Bucket': raw_bucket, 'Prefix': raw_prefix, 'Delimiter': '/'}
+    if start_after:
+        kwargs['StartAfter'] = start_after
+    for page in paginator.paginate(**kwargs):
+        for prefix in page.get('CommonPrefixes', []):
+            yield prefix['Prefix']
+
+
+def delete_keys(keys):
+    for i in range(0, len(keys), 1000):
+        s3.delete_objects(Bucket=raw_bucket, Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]]})
+
+
+# Expand --REPROCESS_DATES into the list of dates it covers
+def parse_date_range(value):
+    first, _, last = value.partition(':')
+    day = datetime.date.fromisoformat(first)
+    last = datetime.date.fromisoformat(last or first)
+    dates = []
+    while day <= last:
+        dates.append(day.isoformat())
+        day += datetime.timedelta(days=1)
+    return dates
+
+
+# List the JSON files in each raw/YYYY-MM-DD/ folder that no earlier run has committed.
+# Folders at or before the watermark are closed and never listed again.
+def list_pending_files(dates=None, use_manifests=True):
+    if dates is None:
+        closed_through = read_state(watermark_key, {}).get("closed_through")
+        # '~' sorts after every key inside the closed folder
+        start_after = f"{raw_prefix}{closed_through}/~" if closed_through else None
+        date_folders = list(list_date_folders(start_after))
+    else:
+        date_folders = [f"{raw_prefix}{d}/" for d in dates]
+
+    pending = {}
+    for folder_path in date_folders:
+        date_part = date_from_key(folder_path)
+        json_files = [key for key in list_keys(folder_path) if key.endswith(raw_suffixes)]
+        if use_manifests and json_files:
+            manifest = read_state(manifest_key(date_part), {})
+            processed = set(manifest.get("keys", [])).union(manifest.get("failed", []))
+            json_files = [key for key in json_files if key not in processed]
+        if not json_files:
+            print(f"🚫 No new JSON files found in {folder_path}, skipping.")
+            continue
+        print(f"📂 Found {len(json_files)} new files in {folder_path}")
+        pending[date_part] = json_files
+    return pending
+
+
+# Undo the output of a run that died between its write and its manifest update,
+# by removing every file that was not in those partitions before the write
+def roll_back_pending_commit():
+    marker = read_state(pending_commit_key, None)
+    if marker is None:
+        return
+    for date_part, existing in marker["existing_files"].items():
+        existing = set(existing)
+        partial = [key for key in list_keys(f"{processed_prefix}event_date={date_part}/") if key not in existing]
+        if partial:
+            delete_keys(partial)
+            print(f"↩️ Rolled back {len(partial)} uncommitted files in event_date={date_part}")
+    s3.delete_object(Bucket=raw_bucket, Key=pending_commit_key)
+
+
+# Reprocessed dates whose manifest lists raw keys that are no longer in raw/ (deleted after an
+# earlier run): overwriting those partitions from the files left would drop the deleted events
+def raw_keys_gone(pending):
+    gone = {}
+    for date_part, keys in pending.items():
+        missing = set(read_state(manifest_key(date_part), {}).get("keys", [])) - set(keys)
+        if missing:
+            gone[date_part] = len(missing)
+    return gone
+
+
+# Raw files read in folders that produced no event at all (every line unparseable). They are
+# recorded in the folder's manifest under "failed", so later runs skip them and the watermark
+# can close the folder; the files themselves stay in raw/ for inspection or a reprocess.
+def record_unparseable(unparseable):
+    unparseable = {d: keys for d, keys in unparseable.items() if keys}
+    if not unparseable:
+        return
+    with metrics.stage("unparseable") as stage:
+        for date_part, keys in sorted(unparseable.items()):
+            key = manifest_key(date_part)
+            manifest = read_state(key, {})
+            manifest["failed"] = sorted(set(manifest.get("failed", [])).union(keys))
+            write_state(key, manifest)
+            print(f"⚠️ {len(keys)} raw files in {raw_prefix}{date_part}/ hold no valid event, recorded as failed")
+        stage.add(failed_files=sum(len(keys) for keys in unparseable.values()))
+
+
+# Close every folder older than yesterday that has nothing left to process,
+# so later runs start listing after it. The watermark never moves backwards.
+def advance_watermark(pending, committed_dates, consumed_keys):
+    # committed_dates includes folders whose files were all recorded as failed
+    state = read_state(watermark_key, {})
+    closed_through = state.get("closed_through")
+    candidate = (datetime.datetime.utcnow().date() - datetime.timedelta(days=2)).isoformat()
+    for date_part, keys in pending.items():
+        if date_part not in committed_dates or len(consumed_keys.get(date_part, [])) < len(keys):
+            # Files still waiting in this folder: keep it open
+            day_before = datetime.date.fromisoformat(date_part) - datetime.timedelta(days=1)
+            candidate = min(candidate, day_before.isoformat())
+    if closed_through is None or candidate > closed_through:
+        write_state(watermark_key, {"closed_through": candidate})
+        print(f"🔖 Watermark advanced to {candidate}")
+
+
+# Upsert key: the scheduled event URI, falling back to the invitee URI
+def event_key():
+    return coalesce(col("event"), col("uri"))
+
+
+# Keep one row per _key: the latest updated_at, preferring rows flagged _incoming on ties
+def latest_per_key(df):
+    order = [col("updated_at").desc_nulls_last()]
+    if "_incoming" in df.columns:
+        order.append(col("_incoming").desc())
+    w = Window.partitionBy("_key").orderBy(*order)
+    return df.withColumn("_rank", row_number().over(w)).where(col("_rank") == 1).drop("_rank")
+
+
+def key_index_key(date_part):
+    return f"{key_index_prefix}event_date={date_part}.json"
+
+
+# Load the key sidecars of these partitions concurrently (missing ones come back empty):
+# {event_date: {"keys": {event key: updated_at}, "files": [data files the keys were read from]}}
+def load_key_indexes(dates):
+    dates = sorted(dates)
+    with ThreadPoolExecutor(max_workers=fetch_workers) as pool:
+        return dict(zip(dates, pool.map(lambda d: read_state(key_index_key(d), {}), dates)))
+
+
+# Earliest partition that can already hold each row's key. A key is first written to the
+# processing date of its first delivery, which is never before the scheduled event (or, for
+# keys falling back to the invitee URI, the invitee) was created; one day of slack covers
+# clock skew. NULL when the creation time is unknown: any earlier partition may hold the key.
+def earliest_owner_date():
+    created = when(col("event").isNotNull(), col("scheduled_event_created_at")).otherwise(col("created_at"))
+    return date_format(date_sub(to_date(created), 1), "yyyy-MM-dd")
+
+
+# Partitions of the listing that fall in any (earliest, event_date) window; earliest None
+# opens the window to every earlier partition
+def candidate_partitions(partitions, windows):
+    return {
+        d: files for d, files in partitions.items()
+        if any((first is None or first <= d) and d <= last for first, last in windows)
+    }
+
+
+# Sorted data file keys of one processed/events partition
+def partition_files(date_part):
+    prefix = f"{processed_prefix}event_date={date_part}/"
+    return sorted(key for key in list_keys(prefix)
+                  if '/' not in key[len(prefix):] and not key[len(prefix):].startswith(('_', '.')))
+
+
+# Build the key sidecars of these partitions ({event_date: [(key, size), ...]}) from their data,
+# e.g. partitions written in append mode or compacted since their sidecar was written.
+# Partitions without keyed rows get an empty index so they aren't rebuilt on every run.
+def build_key_indexes(spark, output_path, partitions):
+    dates = sorted(partitions)
+    existing = (
+        spark.read.schema(schema_with_timestamps())
+        .option("basePath", output_path)
+        .parquet(*[f"{output_path}event_date={d}/" for d in dates])
+    )
+    keyed = existing.withColumn("_key", event_key()).where(col("_key").isNotNull())
+    rows = latest_per_key(keyed).select("_key", "updated_at", "event_date").collect()
+    indexes = {d: {} for d in dates}
+    for r in rows:
+        indexes[r.event_date][r._key] = r.updated_at.isoformat() if r.updated_at else ""
+    for date_part, keys in indexes.items():
+        write_state(key_index_key(date_part), {"keys": keys, "files": sorted(k for k, _ in partitions[date_part])})
+    return indexes
+
+
+# `schema` as written to Parquet (timestamp columns converted)
+def schema_with_timestamps():
+    return StructType([
+        StructField(f.name, TimestampType(), True) if f.name in timestamp_cols else f
+        for f in schema.fields
+    ])
+
+
+# Merge a batch into the processed table. Each key goes to the partition that already holds it
+# (found through the sidecars) or to its own event_date if new; stale redeliveries are dropped.
+# Only partitions inside the batch's key windows (earliest_owner_date .. event_date) are listed
+# and have their sidecars loaded, and only the partitions receiving rows are read and
+# rewritten, so the cost follows the batch rather than the table. Returns the partitions written.
+# Which partitions exist comes from the table listing, not the sidecars: a partition whose
+# sidecar is missing or was written for other files gets its index rebuilt first.
+def upsert_events(spark, df, output_path):
+    keyed = df.withColumn("_key", event_key()).withColumn("_earliest", earliest_owner_date())
+    windows = [(r._earliest, r.event_date) for r in keyed.select("_earliest", "event_date").distinct().collect()]
+    first = None if any(e is None for e, _ in windows) else min(e for e, _ in windows)
+    partitions = candidate_partitions(
+        list_processed_partitions(first, max(d for _, d in windows)), windows)
+    sidecars = load_key_indexes(partitions)
+    stale = {d: files for d, files in partitions.items()
+             if sidecars.get(d, {}).get("files") != sorted(k for k, _ in files)}
+    indexes = {d: sidecars[d].get("keys", {}) for d in partitions if d not in stale}
+    if stale:
+        print(f"🧭 Building the key index of {len(stale)} partitions from the processed table")
+        indexes.update(build_key_indexes(spark, output_path, stale))
+    owners = {}
+    for date_part, keys in sorted(indexes.items()):
+        for key, updated in keys.items():
+            owners[key] = (key, date_part, datetime.datetime.fromisoformat(updated) if updated else None)
+    owner_df = spark.createDataFrame(list(owners.values()), "_key string, _owner_date string, _known timestamp")
+
+    # Routing runs on the executors: keys the table already holds go to their partition unless
+    # the table has this version or a newer one, new keys go to their own event_date
+    incoming = (
+        keyed.drop("_earliest")
+        .join(broadcast(owner_df), "_key", "left")
+        .where(col("_owner_date").isNull()
+               | (col("updated_at").isNotNull() & (col("_known").isNull() | (col("updated_at") > col("_known")))))
+        .withColumn("event_date", coalesce(col("_owner_date"), col("event_date")))
+        .drop("_owner_date", "_known")
+        .withColumn("_incoming", lit(True))
+        .cache()
+    )
+    touched = sorted(r.event_date for r in incoming.select("event_date").distinct().collect())
+    if not touched:
+        incoming.unpersist()
+        print("🔁 Every event in this batch is already up to date")
+        return []
+    routed = incoming.count()
+
+    existing_dates = [d for d in touched if d in partitions]
+    merged = latest_per_key(incoming)
+    if existing_dates:
+        existing = (
+            spark.read.schema(schema_with_timestamps())
+            .option("basePath", output_path)
+            .parquet(*[f"{output_path}event_date={d}/" for d in existing_dates])
+            .withColumn("_key", event_key())
+            .withColumn("_incoming", lit(False))
+        )
+        # Legacy keyless rows can't be merged, so they are carried over untouched
+        merged = latest_per_key(existing.where(col("_key").isNotNull()).unionByName(incoming))
+        merged = merged.unionByName(existing.where(col("_key").isNull()))
+
+    # Materialize before overwriting the partitions the merge reads from
+    merged = merged.drop("_incoming").localCheckpoint()
+
+    # Recorded before the overwrite, cleared by process_raw_folders once they are published
+    owed = set(read_state(upsert_pending_key, {}).get("dates", []))
+    write_state(upsert_pending_key, {"dates": sorted(owed.union(touched))})
+
+    spark.conf.set("spark.sql.sources.partitionOverwriteMode", "dynamic")
+    merged.drop("_key").repartition("event_date").write.mode("overwrite").partitionBy("event_date").parquet(output_path)
+
+    for date_part in touched:
+        keys = {
+            r._key: r.updated_at.isoformat() if r.updated_at else ""
+            for r in merged.where((col("event_date") == date_part) & col("_key").isNotNull())
+            .select("_key", "updated_at").collect()
+        }
+        write_state(key_index_key(date_part), {"keys": keys, "files": partition_files(date_part)})
+    incoming.unpersist()
+    print(f"🔁 Upserted {routed} events into {len(touched)} partitions")
+    return touched
+
+
+# Register and rebuild the rollups of partitions an earlier upsert run rewrote before failing
+def finish_pending_upsert(spark):
+    dates = read_state(upsert_pending_key, {}).get("dates", [])
+    if not dates:
+        return
+    print(f"♻️ Publishing {len(dates)} partitions left by an interrupted upsert")
+    register_partitions(dates)
+    update_rollups(spark, dates)
+    s3.delete_object(Bucket=raw_bucket, Key=upsert_pending_key)
+
+
+# Run an Athena statement and wait for it, raising if it doesn't succeed within timeout_seconds
+def run_athena_query(sql, poll_seconds=1, timeout_seconds=None):
+    timeout_seconds = athena_timeout_seconds if timeout_seconds is None else timeout_seconds
+    query_id = athena.start_query_execution(
+        QueryString=sql,
+        QueryExecutionContext={'Database': athena_db},
+        ResultConfiguration={'OutputLocation': athena_output}
+    )['QueryExecutionId']
+    deadline = time.monotonic() + timeout_seconds
+    while True:
+        status = athena.get_query_execution(QueryExecutionId=query_id)['QueryExecution']['Status']
+        if status['State'] == 'SUCCEEDED':
+            return query_id
+        if status['State'] in ('FAILED', 'CANCELLED'):
+            raise RuntimeError(f"Athena query {query_id} {status['State']}: {status.get('StateChangeReason', '')}")
+        if time.monotonic() >= deadline:
+            athena.stop_query_execution(QueryExecutionId=query_id)
+            raise RuntimeError(f"Athena query {query_id} still {status['State']} after {timeout_seconds}s; stopped it")
+        time.sleep(poll_seconds)
+
+
+# Parquet data files (and their sizes) per event_date partition of processed/events/,
+# optionally only for partitions from first through last (one listing from first onwards)
+def list_processed_partitions(first=None, last=None):
+    paginator = s3.get_paginator('list_objects_v2')
+    kwargs = {'Bucket': raw_bucket, 'Prefix': f"{processed_prefix}event_date="}
+    if first:
+        kwargs['StartAfter'] = f"{processed_prefix}event_date={first}"
+    partitions = {}
+    for page in paginator.paginate(**kwargs):
+        for obj in page.get('Contents', []):
+            partition, _, name = obj['Key'][len(processed_prefix):].partition('/')
+            date_part = partition.split('=', 1)[1]
+            if last and date_part > last:
+                return partitions
+            if not name or '/' in name or name.startswith(('_', '.')):
+                continue
+            partitions.setdefault(date_part, []).append((obj['Key'], obj['Size']))
+    return partitions
+
+
+def set_partition_location(date_part, location):
+    run_athena_query(f"""
+        ALTER TABLE {athena_table}
+        PARTITION (event_date = '{date_part}')
+        SET LOCATION '{location}'
+    """)
+
+
+# Atomic swap of one compacted partition. Readers follow the partition LOCATION, which points at
+# the complete staged copy while the base folder is rewritten, then back at the base folder.
+# Every step is idempotent, so resume_compaction can replay it after a failure.
+def finish_partition_swap(date_part, entry):
+    base = f"{processed_prefix}event_date={date_part}/"
+    if not list(itertools.islice(list_keys(entry['staging']), 1)):
+        # Staged copy already cleaned up: only the final location switch may be missing
+        set_partition_location(date_part, f"{bucket_url}{base}")
+        return
+    set_partition_location(date_part, f"{bucket_url}{entry['staging']}")
+    for staged_key in entry['staged']:
+        target = base + f"compacted-{entry['run_id']}-" + staged_key.rsplit('/', 1)[1]
+        s3.copy({'Bucket': raw_bucket, 'Key': staged_key}, raw_bucket, target)
+    delete_keys(entry['originals'])
+    set_partition_location(date_part, f"{bucket_url}{base}")
+    delete_keys(entry['staged'])
+
+
+def resume_compaction():
+    marker = read_state(compaction_marker_key, None)
+    if marker is None:
+        return
+    for date_part, entry in sorted(marker.items()):
+        print(f"♻️ Resuming compaction swap for event_date={date_part}")
+        finish_partition_swap(date_part, entry)
+    s3.delete_object(Bucket=raw_bucket, Key=compaction_marker_key)
+
+
+# Rewrite each selected partition into ~compact_target_mb files, range-partitioned and sorted
+# by event type and booking time so row-group min/max statistics prune well
+def compact_partitions(spark):
+    run_id = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+    partitions = list_processed_partitions()
+    if compact_dates:
+        wanted = set(parse_date_range(compact_dates))
+        partitions = {d: files for d, files in partitions.items() if d in wanted}
+    else:
+        partitions = {d: files for d, files in partitions.items() if len(files) > 1}
+    if not partitions:
+        print("🚫 Nothing to compact.")
+        return
+
+    data_schema = StructType([f for f in schema_with_timestamps().fields if f.name != "event_date"])
+    target_bytes = compact_target_mb * 1024 * 1024
+    report = []
+    for date_part, files in sorted(partitions.items()):
+        originals = [key for key, _ in files]
+        bytes_before = sum(size for _, size in files)
+        n_files = max(1, math.ceil(bytes_before / target_bytes))
+        staging = f"{compaction_staging_prefix}{run_id}/event_date={date_part}/"
+
+        with metrics.stage("compact_partition") as stage:
+            (
+                spark.read.schema(data_schema)
+                .parquet(*[f"{bucket_url}{key}" for key in originals])
+                .repartitionByRange(n_files, "scheduled_event_event_type", "created_at")
+                .sortWithinPartitions("scheduled_event_event_type", "created_at")
+                .write.mode("overwrite").parquet(f"{bucket_url}{staging}")
+            )
+            staged = [(key, size) for key, size in list_objects_with_size(staging)
+                      if not key.rsplit('/', 1)[1].startswith(('_', '.'))]
+
+            entry = {'run_id': run_id, 'staging': staging, 'originals': originals, 'staged': [k for k, _ in staged]}
+            write_state(compaction_marker_key, {date_part: entry})
+            finish_partition_swap(date_part, entry)
+            s3.delete_object(Bucket=raw_bucket, Key=compaction_marker_key)
+            # Same keys in new files: keep an up-to-date upsert key index valid
+            index = read_state(key_index_key(date_part), None)
+            if index is not None and index.get("files") == sorted(originals):
+                write_state(key_index_key(date_part), {"keys": index["keys"], "files": partition_files(date_part)})
+            stage.add(files=len(originals), bytes=bytes_before)
+
+        row = {
+            'event_date': date_part,
+            'files_before': len(originals),
+            'files_after': len(staged),
+            'bytes_before': bytes_before,
+            'bytes_after': sum(size for _, size in staged),
+        }
+        report.append(row)
+        print(f"🧱 event_date={date_part}: {row['files_before']} -> {row['files_after']} files, "
+              f"{row['bytes_before']} -> {row['bytes_after']} bytes")
+
+    write_state(f"{compaction_report_prefix}{run_id}.json", report)
+    print(f"📝 Compaction report written to s3://{raw_bucket}/{compaction_report_prefix}{run_id}.json")
+
+
+def list_objects_with_size(prefix):
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=raw_bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            yield obj['Key'], obj['Size']
+
+
+# Add partitions to Athena in as few statements as possible (one per 100 partitions keeps
+# well under Athena's query length limit), waiting for each to succeed
+def register_partitions(dates, table=athena_table, prefix=processed_prefix, batch_size=100):
+    for i in range(0, len(dates), batch_size):
+        batch = dates[i:i + batch_size]
+        partition_clauses = "\n".join(
+            f"PARTITION (event_date = '{date_part}') "
+            f"LOCATION '{bucket_url}{prefix}event_date={date_part}/'"
+            for date_part in batch
+        )
+        partition_sql = f"""
+            ALTER TABLE {table}
+            ADD IF NOT EXISTS
+            {partition_clauses}
+        """
+        run_athena_query(partition_sql)
+        print(f"📌 Added {len(batch)} partitions to {table} ({batch[0]} .. {batch[-1]})")
+
+
+# Aggregate processed events into the rollup tables, keeping event_date so each rollup
+# partition is derived from exactly one processed partition
+def build_rollups(spark, events):
+    channels = (
+        spark.table(f"{athena_db}.event_type_channels")
+        .select(col("event_type").alias("scheduled_event_event_type"), col("channel_name").alias("channel"))
+        .dropDuplicates(["scheduled_event_event_type"])
+    )
+    # Left join: unmapped event types still land in their partition (channel NULL)
+    events = events.join(broadcast(channels), "scheduled_event_event_type", "left").withColumn("_key", event_key())
+    return {
+        "rollup_channel_bookings": events.groupBy(
+            "event_date", "channel",
+            to_date("created_at").alias("booking_date"), hour("created_at").alias("booking_hour")
+        ).agg(count("_key").alias("bookings")),
+        "rollup_channel_meetings": events.groupBy(
+            "event_date", "channel",
+            to_date("scheduled_event_start_time").alias("meeting_date"),
+            hour("scheduled_event_start_time").alias("meeting_hour")
+        ).agg(count("_key").alias("meetings")),
+        "rollup_employee_meetings": events.select(
+            "event_date", "_key", "scheduled_event_start_time",
+            explode_outer("scheduled_event_event_memberships").alias("membership")
+        ).groupBy(
+            "event_date", col("membership.user_name").alias("employee_name"),
+            to_date("scheduled_event_start_time").alias("meeting_date")
+        ).agg(countDistinct("_key").alias("meetings")),
+    }
+
+
+# Rollup tables known to be in the Glue catalog during this run
+known_rollup_tables = set()
+
+
+# Create the rollup tables the catalog doesn't have yet: one GetTables call per run, and a
+# CREATE TABLE round trip only for a missing table (in practice, the first run)
+def ensure_rollup_tables():
+    if known_rollup_tables.issuperset(rollup_tables):
+        return
+    for page in glue.get_paginator('get_tables').paginate(DatabaseName=athena_db, Expression='rollup_.*'):
+        known_rollup_tables.update(t['Name'] for t in page['TableList'] if t['Name'] in rollup_tables)
+    for table, columns in rollup_tables.items():
+        if table in known_rollup_tables:
+            continue
+        run_athena_query(f"""
+            CREATE EXTERNAL TABLE IF NOT EXISTS {table} ({columns})
+            PARTITIONED BY (event_date string)
+            STORED AS PARQUET
+            LOCATION '{bucket_url}{rollup_prefix}{table}/'
+        """)
+        known_rollup_tables.add(table)
+
+
+# Recompute the rollup partitions for these event_dates from processed/events and replace
+# just those partitions; a date whose events produce no rollup rows is emptied
+def update_rollups(spark, dates):
+    if not dates:
+        return
+    output_path = f"{bucket_url}{processed_prefix}"
+    events = (
+        spark.read.schema(schema_with_timestamps())
+        .option("basePath", output_path)
+        .parquet(*[f"{output_path}event_date={d}/" for d in dates])
+    )
+    ensure_rollup_tables()
+    spark.conf.set("spark.sql.sources.partitionOverwriteMode", "dynamic")
+    for table, rollup in build_rollups(spark, events).items():
+        table_prefix = f"{rollup_prefix}{table}/"
+        rollup = rollup.localCheckpoint()
+        filled_dates = {r.event_date for r in rollup.select("event_date").distinct().collect()}
+        rollup.coalesce(1).write.mode("overwrite").partitionBy("event_date").parquet(f"{bucket_url}{table_prefix}")
+        for date_part in sorted(set(dates) - filled_dates):
+            delete_keys(list(list_keys(f"{table_prefix}event_date={date_part}/")))
+        register_partitions(sorted(filled_dates), table=table, prefix=table_prefix)
+    print(f"🧮 Rebuilt rollups for {len(dates)} partitions")
+
+
+# Parse the timestamp columns and dedup a raw batch for the write mode; the result is cached
+def prepare_events(df):
+    for c in timestamp_cols:
+        df = df.withColumn(c, to_timestamp(col(c), timestamp_format))
+
+    if write_mode == "upsert":
+        # Keep only the latest version of each event within the batch; keyless rows can't be merged
+        df = df.where(event_key().isNotNull())
+        return latest_per_key(df.withColumn("_key", event_key())).drop("_key").cache()
+    # Same per-folder dedup as before, now across all folders at once
+    return df.dropDuplicates(["event_date", "event"]).cache()
+
+
+# Write a prepared batch holding committed_dates to the processed table at output_path;
+# returns the partitions written
+def write_events(spark, df, output_path, committed_dates, reprocess=False):
+    if write_mode == "upsert":
+        # Merging is idempotent on rerun, so no rollback marker is needed; the rewritten
+        # partitions are kept under upsert_pending_key until they are registered and rolled up
+        return upsert_events(spark, df, output_path)
+    # Write all date partitions at once; one task per date keeps it to one new file per partition
+    writer = df.repartition("event_date").write.partitionBy("event_date")
+    if reprocess:
+        # Replace just the reprocessed partitions
+        spark.conf.set("spark.sql.sources.partitionOverwriteMode", "dynamic")
+        writer.mode("overwrite").parquet(output_path)
+    else:
+        write_state(pending_commit_key, {"existing_files": {
+            d: list(list_keys(f"{processed_prefix}event_date={d}/")) for d in committed_dates
+        }})
+        writer.mode("append").parquet(output_path)
+    return committed_dates
+
+
+# Read every pending date folder in one pass and write all partitions with a single Spark job.
+# Reruns are idempotent: committed keys are recorded per date in a manifest, and a write that
+# never reached its manifest update is rolled back by main() before anything else happens,
+# including before a reprocess (its overwrite would otherwise be deleted by the next rollback).
+def process_raw_folders(spark):
+    reprocess = bool(reprocess_dates)
+
+    with metrics.stage("list") as stage:
+        if reprocess:
+            pending = list_pending_files(parse_date_range(reprocess_dates), use_manifests=False)
+        else:
+            pending = list_pending_files()
+        stage.add(files=sum(len(keys) for keys in pending.values()))
+    if not pending:
+        print("🚫 No raw files to process.")
+        return
+    if reprocess and write_mode != "upsert":
+        # Upsert merges into the partitions instead of replacing them, so only overwrites are at risk
+        gone = raw_keys_gone(pending)
+        if gone:
+            raise RuntimeError(
+                f"Refusing to reprocess {', '.join(sorted(gone))}: "
+                f"{sum(gone.values())} processed raw files were deleted from raw/ (DELETE_RAW), "
+                "so overwriting these partitions would lose their events. "
+                "Reprocess with --WRITE_MODE upsert, or only dates processed with --DELETE_RAW false."
+            )
+
+    all_keys = [key for keys in pending.values() for key in keys]
+    if ingest_mode == "spark":
+        # Executors fetch and parse; every listed key is consumed by the read
+        df = read_raw_events(spark, all_keys)
+        consumed_keys = pending
+    else:
+        flattened_rows, consumed_keys = read_raw_events_on_driver(all_keys)
+        if not flattened_rows:
+            print("🚫 No valid events found, skipping.")
+            record_unparseable(consumed_keys)
+            if not reprocess:
+                advance_watermark(pending, sorted(consumed_keys), consumed_keys)
+            return
+        # Create DataFrame with schema (timestamps as strings)
+        with metrics.stage("create_dataframe") as stage:
+            df = spark.createDataFrame(flattened_rows, schema=schema)
+            stage.add(records=len(flattened_rows))
+
+    df = prepare_events(df)
+
+    # Only folders that actually produced rows are committed; this first action runs the
+    # read (spark mode), timestamp parsing and dedup into the cache
+    with metrics.stage("dedup") as stage:
+        committed_dates = sorted(r.event_date for r in df.select("event_date").distinct().collect())
+        stage.add(partitions=len(committed_dates))
+    for date_part in sorted(set(pending) - set(committed_dates)):
+        print(f"🚫 No valid events found in {raw_prefix}{date_part}/, skipping.")
+    unparseable = {d: keys for d, keys in consumed_keys.items() if d not in committed_dates and keys}
+    if not committed_dates:
+        df.unpersist()
+        record_unparseable(unparseable)
+        if not reprocess:
+            advance_watermark(pending, sorted(unparseable), consumed_keys)
+        return
+
+    output_path = f"{bucket_url}{processed_prefix}"
+    with metrics.stage("write") as stage:
+        written_dates = write_events(spark, df, output_path, committed_dates, reprocess)
+        stage.add(partitions=len(written_dates))
+    df.unpersist()
+    print(f"✅ Wrote processed data for {len(written_dates)} partitions to {output_path}")
+
+    # Register every new partition before the run counts as committed; raises if Athena fails,
+    # leaving the in-flight marker so the next run rolls the write back and retries
+    with metrics.stage("athena_register") as stage:
+        register_partitions(written_dates)
+        stage.add(partitions=len(written_dates))
+    # Rollups are derived from the written partitions, so a failure here retries with the write
+    # (append), or from upsert_pending_key at the start of the next run (upsert)
+    with metrics.stage("rollups") as stage:
+        update_rollups(spark, written_dates)
+        if write_mode == "upsert" and written_dates:
+            s3.delete_object(Bucket=raw_bucket, Key=upsert_pending_key)
+        stage.add(partitions=len(written_dates))
+
+    # Record the committed keys, then clear the in-flight marker
+    with metrics.stage("manifests") as stage:
+        for date_part in committed_dates:
+            key = manifest_key(date_part)
+            manifest = read_state(key, {})
+            consumed = set(consumed_keys.get(date_part, []))
+            processed = set(manifest.get("keys", [])) if not reprocess else set()
+            entry = {"keys": sorted(processed.union(consumed))}
+            failed = set(manifest.get("failed", [])) - consumed
+            if failed:
+                entry["failed"] = sorted(failed)
+            write_state(key, entry)
+        if not reprocess and write_mode != "upsert":
+            s3.delete_object(Bucket=raw_bucket, Key=pending_commit_key)
+        stage.add(files=len(committed_dates))
+    record_unparseable(unparseable)
+
+    with metrics.stage("delete_raw") as stage:
+        for date_part in committed_dates:
+            # Delete raw JSON files in folder (only those that were actually read)
+            if delete_raw and consumed_keys.get(date_part):
+                delete_keys(consumed_keys[date_part])
+                stage.add(files=len(consumed_keys[date_part]))
+                print(f"🗑️ Deleted raw files in folder {raw_prefix}{date_part}/")
+
+    if not reprocess:
+        advance_watermark(pending, sorted(set(committed_dates).union(unparseable)), consumed_keys)
+
+
+if __name__ == "__main__":
+    main()
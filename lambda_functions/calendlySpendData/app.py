@@ -1,64 +1,461 @@
+import os
 import json
+import uuid
+import codecs
+import datetime
 import boto3
-import urllib.request
+import http.client
+import threading
 import re
+from concurrent.futures import ThreadPoolExecutor
+
+# From the shared layer (shared/python/instrumentation.py)
+from instrumentation import Metrics
 
 s3 = boto3.client('s3')
 bucket_name = 'de-calendly-project-bucket'
+spend_host = "dea-data-bucket.s3.us-east-1.amazonaws.com"
+spend_path = "/calendly_spend_data/"
+# "json": NDJSON as before; "parquet": typed, snappy-compressed Parquet (needs pyarrow)
+OUTPUT_FORMAT = os.environ.get("OUTPUT_FORMAT", "json")
+# Parquet goes to its own prefix (same file_date= layout) so one crawled table never mixes formats
+spend_prefix = os.environ.get("SPEND_PREFIX", 'daily_spends/' if OUTPUT_FORMAT == "json" else 'daily_spends_parquet/')
+# Rows buffered per Parquet row group
+PARQUET_BATCH_ROWS = 50000
+# ETag/Last-Modified of the upstream objects from the last successful run: /tmp survives in
+# warm containers, the bucket copy in cold ones
+HTTP_CACHE_TMP = "/tmp/spend_http_cache.json"
+HTTP_CACHE_KEY = "state/calendlySpendData/http_cache.json"
+# Concurrent fetch/filter/upload workers in backfill mode
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", "4"))
 
-def lambda_handler(event, context):
-    try:
-        # Step 1: Fetch the file index JSON from the public S3 URL
-        index_url = "https://dea-data-bucket.s3.us-east-1.amazonaws.com/calendly_spend_data/file_index.json"
-        with urllib.request.urlopen(index_url) as response:
-            if response.status != 200:
-                raise Exception(f"Failed to fetch index: {response.status}")
-            file_index = json.load(response)
-            all_files = file_index.get("files", [])
+# Bytes read from the spend file per step while streaming it
+STREAM_CHUNK_SIZE = 256 * 1024
+# S3 multipart parts must be at least 5 MiB (except the last one)
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+ARRAY_DELIMITER = re.compile(r'\s*[,\]]')
 
-        if not all_files:
-            raise Exception("No files found in the index.")
+metrics = Metrics("calendlySpendData")
 
-        # Step 2: Get the most recent file (assumes filenames sortable by date in name)
-        latest_file = sorted(all_files)[-1]
 
-        # Extract date from filename, assuming pattern like 'spend_data_YYYY-MM-DD.json'
-        match = re.search(r'(\d{4}-\d{2}-\d{2})', latest_file)
-        if not match:
-            raise Exception(f"Could not extract date from filename '{latest_file}'")
-        file_date = match.group(1)
+# Yield the items of a top-level JSON array one at a time, reading the stream in chunks.
+# Only the unparsed tail of the current chunk is buffered, so memory stays bounded by
+# chunk_size plus the largest single item regardless of the file size.
+def iter_json_array(stream, chunk_size=STREAM_CHUNK_SIZE):
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf, pos, eof = '', 0, False
+    expect = '['  # '[' -> 'first' (item or ']') -> ',' (',' or ']') -> 'item' -> ...
+
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n':
+            pos += 1
+
+        item, end = None, None
+        if pos < len(buf) and expect in ('first', 'item') and not (expect == 'first' and buf[pos] == ']'):
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            is_number = isinstance(item, (int, float)) and not isinstance(item, bool)
+            if end is not None and not eof and is_number and not ARRAY_DELIMITER.match(buf, end):
+                end = None  # a number could continue in the next chunk
 
-        data_url = f"https://dea-data-bucket.s3.us-east-1.amazonaws.com/calendly_spend_data/{latest_file}"
+        if pos == len(buf) or (expect in ('first', 'item') and end is None and buf[pos] != ']'):
+            # Need more input: keep only the unparsed tail
+            if eof:
+                raise ValueError("Unexpected end of JSON array")
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buf, pos = buf[pos:] + utf8.decode(chunk or b'', final=eof), 0
+            continue
 
-        with urllib.request.urlopen(data_url) as response:
-            if response.status != 200:
-                raise Exception(f"Failed to fetch data: {response.status}")
-            spend_data = json.load(response)
+        if end is not None:
+            yield item
+            pos, expect = end, ','
+            continue
 
-        # Step 4: Filter records where the 'date' matches the file_date
-        filtered_records = [record for record in spend_data if record.get("date") == file_date]
+        ch = buf[pos]
+        if expect == '[' and ch == '[':
+            pos, expect = pos + 1, 'first'
+        elif expect in ('first', ',') and ch == ']':
+            return
+        elif expect == ',' and ch == ',':
+            pos, expect = pos + 1, 'item'
+        else:
+            raise ValueError(f"Unexpected {ch!r} in JSON array")
 
-        if not filtered_records:
-            raise Exception(f"No records found for date {file_date} in file {latest_file}")
 
-        # Step 5: Save filtered data as line-delimited JSON to S3 under daily_spends/file_date=YYYY-MM-DD/
-        s3_key_prefix = f'daily_spends/file_date={file_date}/'
-        file_name = f'spend_data_{file_date}.json'
-        s3_key = s3_key_prefix + file_name
+class S3MultipartWriter:
+    # File-like writer that uploads to S3 in fixed-size multipart parts, so at most one part is
+    # held in memory. Output smaller than one part is sent as a single put_object on close().
 
-        # Create line-delimited JSON string (one JSON object per line)
-        line_delimited_json = '\n'.join(json.dumps(record) for record in filtered_records)
+    def __init__(self, bucket, key, content_type='application/json', part_size=UPLOAD_PART_SIZE, metadata=None):
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.metadata = metadata or {}
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
 
-        s3.put_object(
-            Bucket=bucket_name,
-            Key=s3_key,
-            Body=line_delimited_json.encode('utf-8'),
-            ContentType='application/json'
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.part_size:
+            self._upload_part()
+
+    def _upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type, Metadata=self.metadata
+            )['UploadId']
+        part_number = len(self.parts) + 1
+        response = s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=bytes(self.buffer)
         )
+        self.parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+        self.buffer = bytearray()
+
+    def close(self):
+        if self.upload_id is None:
+            s3.put_object(
+                Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer),
+                ContentType=self.content_type, Metadata=self.metadata
+            )
+            return
+        if self.buffer:
+            self._upload_part()
+        s3.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts}
+        )
+
+    def abort(self):
+        if self.upload_id is not None:
+            s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+
+
+class JsonLinesSink:
+    # Filtered records as line-delimited JSON (no trailing newline), uploaded in parts
+
+    def __init__(self, s3_key, metadata):
+        self.writer = S3MultipartWriter(bucket_name, s3_key, metadata=metadata)
+        self.count = 0
+
+    def write(self, record):
+        line = json.dumps(record).encode('utf-8')
+        self.writer.write(line if self.count == 0 else b'\n' + line)
+        self.count += 1
+
+    def close(self):
+        self.writer.close()
+
+    def abort(self):
+        self.writer.abort()
+
+
+class ParquetSink:
+    # Filtered records as Parquet with a fixed schema, so the crawler sees the same columns and
+    # types every day whatever extra fields upstream adds. Row groups are written to /tmp as they
+    # fill and the file is uploaded on close, keeping memory bounded by PARQUET_BATCH_ROWS.
+
+    def __init__(self, s3_key, metadata):
+        # Imported here so the default JSON mode doesn't pay for pyarrow at cold start
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema([
+            ('date', pa.date32()),
+            ('channel', pa.string()),
+            ('spend', pa.float64()),
+        ])
+        self.s3_key = s3_key
+        self.metadata = metadata
+        self.path = f"/tmp/{uuid.uuid4()}.parquet"
+        self.writer = pq.ParquetWriter(self.path, self.schema, compression='snappy')
+        self._reset()
+
+    def _reset(self):
+        self.columns = {'date': [], 'channel': [], 'spend': []}
+
+    def write(self, record):
+        spend = record.get('spend')
+        self.columns['date'].append(datetime.date.fromisoformat(record['date']))
+        self.columns['channel'].append(None if record.get('channel') is None else str(record['channel']))
+        self.columns['spend'].append(None if spend is None else float(spend))
+        if len(self.columns['date']) >= PARQUET_BATCH_ROWS:
+            self._flush()
+
+    def _flush(self):
+        if self.columns['date']:
+            self.writer.write_table(self.pa.Table.from_pydict(self.columns, schema=self.schema))
+            self._reset()
+
+    def close(self):
+        try:
+            self._flush()
+            self.writer.close()
+            s3.upload_file(self.path, bucket_name, self.s3_key, ExtraArgs={
+                'Metadata': self.metadata, 'ContentType': 'application/vnd.apache.parquet'
+            })
+        finally:
+            os.remove(self.path)
+
+    # Also called after a failed close(), which has already removed the file
+    def abort(self):
+        self.writer.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# One kept-alive HTTPS connection per thread, reused for the index and the spend files
+_connections = threading.local()
+
+
+def get_connection():
+    conn = getattr(_connections, 'conn', None)
+    if conn is None:
+        conn = http.client.HTTPSConnection(spend_host, timeout=60)
+        _connections.conn = conn
+    return conn
+
+
+def drop_connection():
+    conn = getattr(_connections, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _connections.conn = None
+
+
+# GET an object from the spend bucket. With cached validators the request is conditional,
+# so an unchanged object answers 304 without a body. The caller must read the response fully
+# before the next request on this thread.
+def http_get(file_name, cached=None):
+    headers = {}
+    if cached and cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    if cached and cached.get('last_modified'):
+        headers['If-Modified-Since'] = cached['last_modified']
+    for attempt in (1, 2):
+        conn = get_connection()
+        try:
+            conn.request('GET', f"{spend_path}{file_name}", headers=headers)
+            response = conn.getresponse()
+            break
+        except (http.client.HTTPException, OSError):
+            # The server may have closed the idle connection: reconnect once
+            drop_connection()
+            if attempt == 2:
+                raise
+    if response.status not in (200, 304):
+        response.read()
+        raise Exception(f"Failed to fetch {file_name}: {response.status}")
+    return response
+
+
+def validators(response):
+    return {'etag': response.getheader('ETag'), 'last_modified': response.getheader('Last-Modified')}
+
+
+def load_http_cache():
+    try:
+        with open(HTTP_CACHE_TMP) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    try:
+        return json.loads(s3.get_object(Bucket=bucket_name, Key=HTTP_CACHE_KEY)['Body'].read())
+    except s3.exceptions.NoSuchKey:
+        return {}
+
+
+def save_http_cache(cache):
+    body = json.dumps(cache)
+    with open(HTTP_CACHE_TMP, 'w') as f:
+        f.write(body)
+    s3.put_object(Bucket=bucket_name, Key=HTTP_CACHE_KEY, Body=body.encode('utf-8'), ContentType='application/json')
+
+
+# Returns (files, validators), or (None, validators) when the index hasn't changed since `cached`
+def fetch_file_index(cached=None):
+    with metrics.stage("index_fetch") as stage:
+        response = http_get("file_index.json", cached)
+        if response.status == 304:
+            response.read()
+            return None, cached
+        body = response.read()
+        file_index = json.loads(body)
+        stage.add(bytes=len(body), files=len(file_index.get("files", [])))
+    return file_index.get("files", []), validators(response)
+
+
+# Extract date from filename, assuming pattern like 'spend_data_YYYY-MM-DD.json'
+def file_date_of(file_name):
+    match = re.search(r'(\d{4}-\d{2}-\d{2})', file_name)
+    if not match:
+        raise Exception(f"Could not extract date from filename '{file_name}'")
+    return match.group(1)
+
+
+spend_extension = '.parquet' if OUTPUT_FORMAT == "parquet" else '.json'
+
+
+def spend_key(file_date):
+    return f'{spend_prefix}file_date={file_date}/spend_data_{file_date}{spend_extension}'
+
+
+# Stream one spend file, keep records where 'date' matches its file date and upload them in
+# OUTPUT_FORMAT under <spend_prefix>file_date=YYYY-MM-DD/. Returns (s3_key, records_count, validators).
+# With cached validators, returns (s3_key, None, cached) if the upstream file hasn't changed.
+@metrics.timed("spend_file", count=lambda result: result[1] or 0)
+def process_spend_file(file_name, cached=None):
+    file_date = file_date_of(file_name)
+    s3_key = spend_key(file_date)
+
+    records_count = 0
+    writer = None
+    try:
+        response = http_get(file_name, cached)
+        if response.status == 304:
+            response.read()
+            return s3_key, None, cached
+        # Kept on the object so a later run can tell which upstream version it came from
+        metadata = {'source-etag': (response.getheader('ETag') or '').strip('"')}
+        for record in iter_json_array(response):
+            if record.get("date") != file_date:
+                continue
+            # Nothing is uploaded until the first matching record shows up
+            if writer is None:
+                sink = ParquetSink if OUTPUT_FORMAT == "parquet" else JsonLinesSink
+                writer = sink(s3_key, metadata)
+            writer.write(record)
+            records_count += 1
+        response.read()  # drain the trailer so the connection can be reused
+        # Completing the upload can fail too, and must not leave its parts behind
+        if writer is not None:
+            writer.close()
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        drop_connection()
+        raise
+
+    if writer is None:
+        raise Exception(f"No records found for date {file_date} in file {file_name}")
+    return s3_key, records_count, validators(response)
+
+
+# Dates that already have a spend file in the project bucket (fully paginated)
+def existing_spend_dates():
+    dates = set()
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f'{spend_prefix}file_date='):
+        for obj in page.get('Contents', []):
+            match = re.search(r'file_date=(\d{4}-\d{2}-\d{2})/spend_data_\1' + re.escape(spend_extension) + '$', obj['Key'])
+            if match:
+                dates.add(match.group(1))
+    return dates
+
+
+def already_written(s3_key):
+    try:
+        s3.head_object(Bucket=bucket_name, Key=s3_key)
+        return True
+    except s3.exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+
+def backfill_one(file_name):
+    # HEAD right before the work keeps overlapping runs from redoing a date
+    if already_written(spend_key(file_date_of(file_name))):
+        return 'skipped', 0
+    _, records_count, _ = process_spend_file(file_name)
+    return 'written', records_count
+
+
+# Process every indexed file whose date has no daily_spends partition yet, on a bounded pool.
+# Failed dates are reported and raised after the others finish, so a retry only redoes those.
+@metrics.timed(count=lambda summary: summary['records_count'])
+def backfill(all_files):
+    existing = existing_spend_dates()
+    missing = sorted(f for f in all_files if file_date_of(f) not in existing)
+    print(f"Backfill: {len(all_files)} indexed files, {len(missing)} dates missing")
+
+    summary = {'written': [], 'skipped': [], 'failed': {}, 'records_count': 0}
+    with ThreadPoolExecutor(max_workers=BACKFILL_WORKERS) as pool:
+        futures = {pool.submit(backfill_one, f): f for f in missing}
+        for future, file_name in futures.items():
+            file_date = file_date_of(file_name)
+            try:
+                status, records_count = future.result()
+            except Exception as e:
+                print(f"Failed to backfill {file_name}: {e}")
+                summary['failed'][file_date] = str(e)
+                continue
+            summary[status].append(file_date)
+            summary['records_count'] += records_count
+
+    if summary['failed']:
+        raise Exception(f"Backfill failed for {sorted(summary['failed'])}: {summary['failed']}")
+    return summary
+
+
+def lambda_handler(event, context):
+    try:
+        # Backfill mode: {"mode": "backfill"} in the event, or BACKFILL_MODE=true
+        mode = (event or {}).get("mode") or ("backfill" if os.environ.get("BACKFILL_MODE") == "true" else "latest")
+        if mode == "backfill":
+            all_files, _ = fetch_file_index()
+            if not all_files:
+                raise Exception("No files found in the index.")
+            summary = backfill(all_files)
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': f"Backfilled {len(summary['written'])} dates",
+                    'written': summary['written'],
+                    'skipped': summary['skipped'],
+                    'records_count': summary['records_count'],
+                })
+            }
+
+        # Step 1: Fetch the file index JSON from the public S3 URL, conditionally: an unchanged
+        # index means there is nothing new, and the run ends after one 304
+        cache = load_http_cache()
+        all_files, index_validators = fetch_file_index(cache.get("file_index.json"))
+        if all_files is None:
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'message': 'file_index.json not modified, nothing to do', 'records_count': 0})
+            }
+
+        if not all_files:
+            raise Exception("No files found in the index.")
+
+        # Step 2: Get the most recent file (assumes filenames sortable by date in name)
+        latest_file = sorted(all_files)[-1]
+
+        # Step 3-5: Stream, filter and upload it (skipped if this version was already processed)
+        s3_key, records_count, file_validators = process_spend_file(latest_file, cache.get(latest_file))
+
+        # Validators are only recorded once the upload has succeeded
+        save_http_cache({"file_index.json": index_validators, latest_file: file_validators})
+
+        if records_count is None:
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'message': f'{latest_file} not modified, {s3_key} is up to date', 'records_count': 0})
+            }
 
         return {
             'statusCode': 200,
-            'body': json.dumps({'message': f'Filtered data saved to {s3_key}', 'records_count': len(filtered_records)})
+            'body': json.dumps({'message': f'Filtered data saved to {s3_key}', 'records_count': records_count})
         }
 
     except Exception as e:
@@ -1,46 +1,163 @@
+import os
+import re
 import json
-import boto3
+import gzip
+import hashlib
 import uuid
+import logging
 import datetime
-import traceback
-
-#comment
-s3 = boto3.client('s3')
-BUCKET_NAME = 'de-calendly-project-bucket' 
-ALLOWED_EVENT_TYPES = {
-    "https://api.calendly.com/event_types/d639ecd3-8718-4068-955a-436b10d72c78",
-    "https://api.calendly.com/event_types/dbb4ec50-38cd-4bcd-bbff-efb7b5a6f098",
+
+# From the shared layer (shared/python/instrumentation.py)
+from instrumentation import Metrics
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
+
+BUCKET_NAME = os.environ.get("BUCKET_NAME", "de-calendly-project-bucket")
+# Segment limits of the queue worker; the sync handler writes one JSON object per webhook
+SEGMENT_MAX_BYTES = int(os.environ.get("SEGMENT_MAX_BYTES", str(4 * 1024 * 1024)))
+SEGMENT_MAX_EVENTS = int(os.environ.get("SEGMENT_MAX_EVENTS", "1000"))
+DEFAULT_EVENT_TYPES = (
+    "https://api.calendly.com/event_types/d639ecd3-8718-4068-955a-436b10d72c78,"
+    "https://api.calendly.com/event_types/dbb4ec50-38cd-4bcd-bbff-efb7b5a6f098,"
     "https://api.calendly.com/event_types/bb339e98-7a67-4af2-b584-8dbf95564312"
-}
+)
+# "sync": write to S3 before responding; "queue": enqueue to SQS and let queue_worker_handler persist
+ACK_MODE = os.environ.get("ACK_MODE", "sync")
+QUEUE_URL = os.environ.get("QUEUE_URL")
+# Marker objects recording which Calendly events the worker has already persisted
+DEDUP_PREFIX = os.environ.get("DEDUP_PREFIX", "dedup/")
+# Concurrent marker HEADs/PUTs in the worker (an SQS batch holds up to 100 messages)
+MARKER_WORKERS = int(os.environ.get("MARKER_WORKERS", "16"))
+# Comma-separated list from config, frozen once per container
+ALLOWED_EVENT_TYPES = frozenset(
+    t.strip() for t in os.environ.get("ALLOWED_EVENT_TYPES", DEFAULT_EVENT_TYPES).split(",") if t.strip()
+)
+# Any "event_type": "<string>" member in the raw body; JSON string escapes are allowed inside the value
+EVENT_TYPE_PATTERN = re.compile(r'"event_type"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+# Timing is only emitted for accepted events, so the rejection path stays a regex scan
+metrics = Metrics("calendly_webhook")
+
+# boto3 is imported and the clients created on first use, so rejected events never pay for it
+_s3 = None
+_sqs = None
+
+
+def get_s3():
+    global _s3
+    if _s3 is None:
+        import boto3
+        from botocore.config import Config
+        # One pooled connection per concurrent marker request in the worker
+        _s3 = boto3.client('s3', config=Config(max_pool_connections=MARKER_WORKERS))
+    return _s3
+
+
+def get_sqs():
+    global _sqs
+    if _sqs is None:
+        import boto3
+        _sqs = boto3.client('sqs')
+    return _sqs
+
+
+# Fast rejection: scan the raw body for event_type values without building the object tree.
+# Returns False only when no event_type anywhere in the body is allowed; True still needs the
+# exact payload.scheduled_event.event_type check after parsing.
+def may_be_allowed(body):
+    for match in EVENT_TYPE_PATTERN.finditer(body):
+        if match.group(1).replace('\\/', '/') in ALLOWED_EVENT_TYPES:
+            return True
+    return False
+
+
+class SegmentWriter:
+    # Buffers accepted events as NDJSON lines per processing date and writes each date's lines as one
+    # gzip object, raw/<date>/<timestamp>_<uuid>.json.gz, which the Glue job reads like .json files.
+    # Flushes when the buffer reaches max_bytes or max_events, or when flush() is called. Used by the
+    # queue worker only: batching needs more than one event per invocation, which the sync handler never has.
+
+    def __init__(self, bucket, target_folder='raw', max_bytes=SEGMENT_MAX_BYTES, max_events=SEGMENT_MAX_EVENTS):
+        self.bucket = bucket
+        self.target_folder = target_folder
+        self.max_bytes = max_bytes
+        self.max_events = max_events
+        self._reset()
+
+    def _reset(self):
+        self.lines_by_date = {}
+        self.n_events = 0
+        self.n_bytes = 0
+
+    # Events go to today's (UTC) raw/<date>/ folder, which the Glue job's watermark keeps open.
+    # Returns the keys written when this event filled the buffer, else an empty list.
+    def add(self, data):
+        line = json.dumps(data)
+        today = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+        self.lines_by_date.setdefault(today, []).append(line)
+        self.n_events += 1
+        self.n_bytes += len(line) + 1
+        if self.n_bytes >= self.max_bytes or self.n_events >= self.max_events:
+            return self.flush()
+        return []
+
+    # Returns the keys written. The buffer is detached before uploading, so a failed upload
+    # surfaces as an error for exactly the events the caller has not acknowledged yet.
+    def flush(self):
+        lines_by_date = self.lines_by_date
+        self._reset()
+        keys = []
+        for date, lines in lines_by_date.items():
+            timestamp = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H-%M-%S')
+            key = f"{self.target_folder}/{date}/{timestamp}_{uuid.uuid4()}.json.gz"
+            body = gzip.compress(("\n".join(lines) + "\n").encode('utf-8'))
+            get_s3().put_object(Bucket=self.bucket, Key=key, Body=body, ContentType='application/x-ndjson')
+            logger.info("Uploaded segment with %d events to S3: %s", len(lines), key)
+            keys.append(key)
+        return keys
+
 
 def lambda_handler(event, context):
     try:
         body = event.get("body")
         if body is None:
-            print("Missing body in event:", event)
+            logger.warning("Missing body in event")
             return {"statusCode": 400, "body": "Missing body"}
 
-        data = json.loads(body)
-        print("Parsed data:", data)
+        if not may_be_allowed(body):
+            logger.debug("Skipping event without an allowed event_type")
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'message': 'Event type not of interest'})
+            }
 
+        data = json.loads(body)
         event_type = data.get("payload", {}).get("scheduled_event", {}).get("event_type")
-        print("Event type:", event_type)
+        logger.debug("Event type: %s", event_type)
 
         if event_type not in ALLOWED_EVENT_TYPES:
-            print(f"Skipping event_type {event_type}")
+            logger.debug("Skipping event_type %s", event_type)
             return {
                 'statusCode': 200,
                 'body': json.dumps({'message': 'Event type not of interest'})
             }
 
-        target_folder = 'raw'
-        today = datetime.datetime.utcnow().strftime('%Y-%m-%d')
-        timestamp = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H-%M-%S')
-        unique_id = uuid.uuid4()
-        file_name = f"{target_folder}/{today}/{timestamp}_{unique_id}.json"
+        with metrics.stage("persist") as stage:
+            stage.add(records=1, bytes=len(body))
+            if ACK_MODE == "queue":
+                # Persisted later by queue_worker_handler; S3 latency no longer reaches Calendly
+                get_sqs().send_message(QueueUrl=QUEUE_URL, MessageBody=body)
+                logger.info("Queued event %s", event_id(data))
+            else:
+                target_folder = 'raw'
+                today = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+                timestamp = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H-%M-%S')
+                unique_id = uuid.uuid4()
+                file_name = f"{target_folder}/{today}/{timestamp}_{unique_id}.json"
 
-        s3.put_object(Bucket=BUCKET_NAME, Key=file_name, Body=json.dumps(data))
-        print(f"Uploaded to S3: {file_name}")
+                get_s3().put_object(Bucket=BUCKET_NAME, Key=file_name, Body=json.dumps(data))
+                logger.info("Uploaded to S3: %s", file_name)
 
         return {
             "statusCode": 200,
@@ -48,9 +165,76 @@ def lambda_handler(event, context):
         }
 
     except Exception as e:
-        print("Error occurred:", str(e))
-        traceback.print_exc()
+        logger.exception("Error occurred: %s", e)
         return {
             "statusCode": 500,
             "body": json.dumps({"error": str(e)})
         }
+
+
+# Identity of a webhook delivery: the webhook event name plus the invitee URI, so a redelivery
+# maps to the same id while invitee.created and invitee.canceled for one invitee stay distinct
+def event_id(data):
+    payload = data.get("payload", {})
+    return f"{data.get('event')}|{payload.get('uri') or payload.get('event')}"
+
+
+def dedup_marker_key(data):
+    return DEDUP_PREFIX + hashlib.sha256(event_id(data).encode('utf-8')).hexdigest()
+
+
+def already_persisted(marker_key):
+    from botocore.exceptions import ClientError
+    try:
+        get_s3().head_object(Bucket=BUCKET_NAME, Key=marker_key)
+        return True
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+
+def write_marker(marker_key):
+    get_s3().put_object(Bucket=BUCKET_NAME, Key=marker_key, Body=b"")
+
+
+# SQS-triggered worker: drains a batch of queued webhooks into gzip NDJSON segments of at most
+# SEGMENT_MAX_BYTES / SEGMENT_MAX_EVENTS, filed under the processing date so a late message
+# (DLQ redrive, worker outage) never lands in a folder the Glue job has already closed.
+# Events whose marker already exists (Calendly redeliveries) are skipped; the marker HEADs run
+# concurrently up front. Markers are written only after the segment holding their events is
+# uploaded, so when SQS retries a failed batch only the unwritten events are persisted again.
+def queue_worker_handler(event, context):
+    from concurrent.futures import ThreadPoolExecutor
+
+    messages = []
+    for record in event.get("Records", []):
+        try:
+            data = json.loads(record["body"])
+        except ValueError:
+            logger.warning("Dropping unparseable message %s", record.get("messageId"))
+            continue
+        messages.append((data, dedup_marker_key(data), len(record["body"])))
+
+    writer = SegmentWriter(BUCKET_NAME)
+    new_markers = set()
+    buffered = []
+    skipped = 0
+    with metrics.stage("worker_batch") as stage, ThreadPoolExecutor(max_workers=MARKER_WORKERS) as pool:
+        unique_markers = list(dict.fromkeys(marker_key for _, marker_key, _ in messages))
+        persisted = dict(zip(unique_markers, pool.map(already_persisted, unique_markers)))
+        for data, marker_key, n_bytes in messages:
+            if marker_key in new_markers or persisted[marker_key]:
+                skipped += 1
+                continue
+            new_markers.add(marker_key)
+            buffered.append(marker_key)
+            stage.add(bytes=n_bytes)
+            if writer.add(data):
+                list(pool.map(write_marker, buffered))
+                buffered = []
+        writer.flush()
+        list(pool.map(write_marker, buffered))
+        stage.add(records=len(new_markers), duplicates=skipped)
+    logger.info("Persisted %d queued events, skipped %d duplicates", len(new_markers), skipped)
+    return {"persisted": len(new_markers), "duplicates": skipped}
@@ -0,0 +1,163 @@
+# Per-stage timing and volume metrics shared by the Lambdas, the Glue job and the dashboard.
+#
+# Each finished stage is emitted as one CloudWatch Embedded Metric Format (EMF) JSON line:
+# Duration in milliseconds plus whatever counters the stage recorded (Records, Bytes, Files,
+# ...), dimensioned by Component and Stage. Lambda sends stdout to CloudWatch Logs, which
+# turns EMF lines into metrics without any API calls. Glue only logs them, so the Glue job
+# uses the "cloudwatch" sink, which also publishes each stage with PutMetricData.
+#
+#   metrics = Metrics("calendlySpendData")
+#   with metrics.stage("index_fetch") as stage:
+#       ...
+#       stage.add(bytes=len(body), files=1)
+#
+# Configuration (environment, or the constructor arguments):
+#   METRICS_SINK      "stdout" (default), "file:<path>" to append the lines to a file, "off",
+#                     or "cloudwatch" to print them and publish the values with PutMetricData
+#   METRICS_NAMESPACE CloudWatch namespace, default "CalendlyPipeline"
+#   PROFILE_STAGES    comma-separated stage names to run under cProfile; each run writes
+#                     <PROFILE_DIR>/<component>-<stage>-<timestamp>.prof and prints its top calls
+#   PROFILE_DIR       default /tmp
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+# CloudWatch units for the counters stages usually record; anything else is a Count
+UNITS = {"bytes": "Bytes"}
+PROFILE_TOP_CALLS = 20
+
+
+class Stage:
+    def __init__(self):
+        self.counters = {}
+
+    # Accumulate counters, e.g. stage.add(records=10, bytes=2048)
+    def add(self, **counters):
+        for name, value in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+class Metrics:
+    def __init__(self, component, sink=None, namespace=None, profile_stages=None, profile_dir=None):
+        self.component = component
+        self.namespace = namespace or os.environ.get("METRICS_NAMESPACE", "CalendlyPipeline")
+        sink = sink if sink is not None else os.environ.get("METRICS_SINK", "stdout")
+        self.enabled = sink != "off"
+        self.path = sink[len("file:"):] if sink.startswith("file:") else None
+        self.publish = sink == "cloudwatch"
+        self.cloudwatch = None
+        if profile_stages is None:
+            profile_stages = os.environ.get("PROFILE_STAGES", "")
+        self.profile_stages = {s.strip() for s in profile_stages.split(",") if s.strip()}
+        self.profile_dir = profile_dir or os.environ.get("PROFILE_DIR", "/tmp")
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        return _StageContext(self, name)
+
+    # Decorator timing every call as a stage (default: the function name). count, if given,
+    # maps the return value to the Records counter, e.g. @metrics.timed(count=len)
+    def timed(self, name=None, count=None):
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name or fn.__name__) as stage:
+                    result = fn(*args, **kwargs)
+                    if count is not None:
+                        stage.add(records=count(result))
+                    return result
+            return wrapper
+        return decorator
+
+    def emit(self, stage_name, duration_ms, counters, failed=False):
+        if not self.enabled:
+            return
+        values = {"Duration": round(duration_ms, 3)}
+        units = {"Duration": "Milliseconds"}
+        for name, value in counters.items():
+            metric = name.title().replace("_", "")
+            values[metric] = value
+            units[metric] = UNITS.get(name, "Count")
+        if failed:
+            values["Errors"] = 1
+            units["Errors"] = "Count"
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [["Component", "Stage"]],
+                    "Metrics": [{"Name": metric, "Unit": unit} for metric, unit in units.items()],
+                }],
+            },
+            "Component": self.component,
+            "Stage": stage_name,
+            **values,
+        }
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            if self.path:
+                with open(self.path, "a") as f:
+                    f.write(line)
+            else:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+        if self.publish:
+            self.put_metric_data(stage_name, values, units)
+
+    # Metrics are best effort: a failed publish is reported and the stage carries on
+    def put_metric_data(self, stage_name, values, units):
+        dimensions = [{"Name": "Component", "Value": self.component}, {"Name": "Stage", "Value": stage_name}]
+        data = [
+            {"MetricName": metric, "Dimensions": dimensions, "Value": value, "Unit": units[metric]}
+            for metric, value in values.items()
+        ]
+        try:
+            with self.lock:
+                if self.cloudwatch is None:
+                    import boto3
+                    self.cloudwatch = boto3.client("cloudwatch")
+            self.cloudwatch.put_metric_data(Namespace=self.namespace, MetricData=data)
+        except Exception as e:
+            print(f"Could not publish {self.component}/{stage_name} metrics: {e}", file=sys.stderr)
+
+    def write_profile(self, stage_name, profiler):
+        timestamp = time.strftime("%Y%m%dT%H%M%S")
+        path = os.path.join(self.profile_dir, f"{self.component}-{stage_name}-{timestamp}.prof")
+        profiler.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(PROFILE_TOP_CALLS)
+        print(f"cProfile of {self.component}/{stage_name} written to {path}\n{summary.getvalue()}")
+
+
+class _StageContext:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.stage = Stage()
+        self.profiler = None
+
+    def __enter__(self):
+        if self.name in self.metrics.profile_stages:
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # Only one profiler can run at a time: a stage nested in a profiled one is just timed
+                self.profiler = None
+        self.started = time.perf_counter()
+        return self.stage
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ms = (time.perf_counter() - self.started) * 1000
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.metrics.write_profile(self.name, self.profiler)
+        self.metrics.emit(self.name, duration_ms, self.stage.counters, failed=exc_type is not None)
+        return False
@@ -1,219 +1,469 @@
-import streamlit as st
-import pandas as pd
-from pyathena import connect
-import altair as alt
-
-
-st.set_page_config(layout="wide")  # 👈 must be here, before any st.* calls
-
-# --- Athena Query Wrapper ---
-def query_athena(sql):
-    conn = connect(
-        s3_staging_dir=st.secrets["s3_staging_dir"],
-        region_name=st.secrets["aws_region"],
-        aws_access_key_id=st.secrets["aws_access_key_id"],
-        aws_secret_access_key=st.secrets["aws_secret_access_key"]
-    )
-    return pd.read_sql(sql, conn)
-# --- Cached Queries (refresh daily) ---
-@st.cache_data(ttl=86400)
-def get_cost_per_lead(): #horizontal bar chart by channel
-    return query_athena("""
-    SELECT channel, 
-        ROUND(SUM(spend)/COUNT(event_id),0) AS cost_per_lead
-        FROM calendly_project.calendly_events
-        INNER JOIN calendly_project.event_type_channels  USING (event_type)
-        INNER JOIN calendly_project.daily_spends ON channel_name = channel
-        GROUP BY 1
-        ORDER BY 2                
-                        
-    """)
-
-@st.cache_data(ttl=86400)
-def get_daily_leads_by_channel(): #line chart by date, colors by channel
-    return query_athena("""
-        SELECT channel, 
-        DATE(booking_datetime) AS booking_date,
-        COUNT(event_id) AS n_events
-        FROM calendly_project.calendly_events
-        INNER JOIN calendly_project.event_type_channels  USING (event_type)
-        INNER JOIN calendly_project.daily_spends ON channel_name = channel
-        GROUP BY 1,2
-        ORDER BY 1
-        
-    """)
-
-@st.cache_data(ttl=86400)
-def get_channel_leaderboard(): # table
-    return query_athena("""
-    SELECT channel,
-    ROUND(SUM(spend),0) AS spend,
-    COUNT(event_id) AS bookings,
-    ROUND(SUM(spend)/COUNT(event_id),0) AS cost_per_lead
-    FROM calendly_project.calendly_events
-    INNER JOIN calendly_project.event_type_channels  USING (event_type)
-    INNER JOIN calendly_project.daily_spends ON channel_name = channel
-    GROUP BY 1
-    ORDER BY 2 
-    """)
-
-@st.cache_data(ttl=86400)
-def get_bookings_by_day(): # bar chart by day of week
-    return query_athena("""
-    SELECT 
-    format_datetime(booking_datetime, 'EEEE') AS booking_day,
-    COUNT(event_id) AS bookings
-    FROM calendly_project.calendly_events
-    INNER JOIN calendly_project.event_type_channels  USING (event_type)
-    INNER JOIN calendly_project.daily_spends ON channel_name = channel
-    GROUP BY 1, day_of_week(booking_datetime)
-    ORDER BY day_of_week(booking_datetime)  
-    """)
-
-@st.cache_data(ttl=86400)
-def get_bookings_by_hour(): # line chart 
-    return query_athena("""
-        SELECT 
-        hour(booking_datetime) AS booking_hour,
-        COUNT(event_id) AS bookings
-        FROM calendly_project.calendly_events
-        INNER JOIN calendly_project.event_type_channels  USING (event_type)
-        INNER JOIN calendly_project.daily_spends ON channel_name = channel
-        GROUP BY 1
-        ORDER BY 1
-    """)
-
-@st.cache_data(ttl=86400)
-def get_meeting_by_day(): # bar chart by day of week
-    return query_athena("""
-        SELECT 
-        format_datetime(event_datetime, 'EEEE') AS meeting_day,
-        COUNT(event_id) AS bookings
-        FROM calendly_project.calendly_events
-        INNER JOIN calendly_project.event_type_channels  USING (event_type)
-        INNER JOIN calendly_project.daily_spends ON channel_name = channel
-        GROUP BY 1, day_of_week(event_datetime)
-        ORDER BY day_of_week(event_datetime)  
-    """)
-
-@st.cache_data(ttl=86400)
-def get_meeting_by_hour(): # bar chart by day of week
-    return query_athena("""
-        SELECT 
-        hour(event_datetime) AS event_hour,
-        COUNT(event_id) AS bookings
-        FROM calendly_project.calendly_events
-        INNER JOIN calendly_project.event_type_channels  USING (event_type)
-        INNER JOIN calendly_project.daily_spends ON channel_name = channel
-        GROUP BY 1
-        ORDER BY 1
-    """)
-@st.cache_data(ttl=86400)
-def get_meetings_by_employee_per_day(): # horizontal bar chart by employee
-    return query_athena("""
-        SELECT 
-        employee_name,
-        count(DISTINCT event_id)/count(DISTINCT(DATE(event_datetime))) AS meetings_per_day
-        FROM calendly_project.calendly_events
-        INNER JOIN calendly_project.event_memberships  USING (event_id)
-        INNER JOIN calendly_project.employees USING(employee_id)
-        GROUP BY 1
-        ORDER BY 2 DESC
-    """)
-
-# --- App UI ---
-st.title("📊 Calendly Project Dashboard ")
-st.markdown("Data updates every 24 hours. Click below to refresh manually if needed.")
-
-if st.button("🔄 Refresh Data Now"):
-    st.cache_data.clear()
-    st.success("Cache cleared! Please rerun to fetch fresh data.")
-
-# --- Cost per Lead (Horizontal Bar) + Daily Leads by Channel (Line Chart) ---
-col1, col2 = st.columns(2)
-
-with col1:
-    st.subheader("💰 Cost per Lead by Channel")
-    df_cpl = get_cost_per_lead()
-    chart_cpl = alt.Chart(df_cpl).mark_bar().encode(
-        x=alt.X("cost_per_lead:Q", title="Cost per Lead"),
-        y=alt.Y("channel:N", sort="-x", title="Channel"),
-        tooltip=["channel", "cost_per_lead"]
-    ).properties(height=300)
-    st.altair_chart(chart_cpl, use_container_width=True)
-
-with col2:
-    st.subheader("📈 Daily Leads by Channel")
-    df_daily_leads = get_daily_leads_by_channel()
-    chart_daily = alt.Chart(df_daily_leads).mark_line(point=True).encode(
-        x=alt.X("booking_date:T", title="Date"),
-        y=alt.Y("n_events:Q", title="Number of Events"),
-        color=alt.Color("channel:N", title="Channel"),
-        tooltip=["booking_date", "channel", "n_events"]
-    ).properties(height=300)
-    st.altair_chart(chart_daily, use_container_width=True)
-
-
-# --- Channel Leaderboard (Table) ---
-st.subheader("🏆 Channel Leaderboard")
-df_leaderboard = get_channel_leaderboard()
-st.dataframe(df_leaderboard, use_container_width=True)
-
-
-# --- Bookings by Day (Bar) + Bookings by Hour (Line) ---
-col3, col4 = st.columns(2)
-
-with col3:
-    st.subheader("📅 Bookings by Day of Week")
-    df_by_day = get_bookings_by_day()
-    chart_day = alt.Chart(df_by_day).mark_bar().encode(
-        x=alt.X("booking_day:N", title="Day of Week", sort=["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]),
-        y=alt.Y("bookings:Q", title="Bookings"),
-        tooltip=["booking_day", "bookings"]
-    ).properties(height=300)
-    st.altair_chart(chart_day, use_container_width=True)
-
-with col4:
-    st.subheader("⏰ Bookings by Hour")
-    df_by_hour = get_bookings_by_hour()
-    chart_hour = alt.Chart(df_by_hour).mark_line(point=True).encode(
-        x=alt.X("booking_hour:O", title="Hour (24h)"),
-        y=alt.Y("bookings:Q", title="Bookings"),
-        tooltip=["booking_hour", "bookings"]
-    ).properties(height=300)
-    st.altair_chart(chart_hour, use_container_width=True)
-
-
-# --- Meetings by Day (Bar) + Meetings by Hour (line) ---
-col5, col6 = st.columns(2)
-
-with col5:
-    st.subheader("📅 Meetings by Day of Week")
-    df_meeting_day = get_meeting_by_day()
-    chart_meet_day = alt.Chart(df_meeting_day).mark_bar().encode(
-        x=alt.X("meeting_day:N", title="Day of Week", sort=["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]),
-        y=alt.Y("bookings:Q", title="Meetings"),
-        tooltip=["meeting_day", "bookings"]
-    ).properties(height=300)
-    st.altair_chart(chart_meet_day, use_container_width=True)
-
-with col6:
-    st.subheader("⏰ Meetings by Hour")
-    df_meeting_hour = get_meeting_by_hour()
-    chart_meet_hour = alt.Chart(df_meeting_hour).mark_line(point=True).encode(
-        x=alt.X("event_hour:O", title="Hour (24h)"),
-        y=alt.Y("bookings:Q", title="Meetings"),
-        tooltip=["event_hour", "bookings"]
-    ).properties(height=300)
-    st.altair_chart(chart_meet_hour, use_container_width=True)
-
-
-# --- Meetings per Day per Employee ---
-st.subheader("👩‍💼 Average Meetings per Day per Employee")
-df_meetings_emp = get_meetings_by_employee_per_day()
-chart_emp = alt.Chart(df_meetings_emp).mark_bar().encode(
-    x=alt.X("meetings_per_day:Q", title="Meetings per Day"),
-    y=alt.Y("employee_name:N", sort="-x", title="Employee"),
-    tooltip=["employee_name", "meetings_per_day"]
-).properties(height=400)
-st.altair_chart(chart_emp, use_container_width=True)
+import datetime
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import pandas as pd
+from pyathena import connect
+import altair as alt
+
+# shared/python/instrumentation.py lives at the repo root, next to this app's folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shared", "python"))
+from instrumentation import Metrics
+
+
+st.set_page_config(layout="wide")  # 👈 must be here, before any st.* calls
+
+QUERY_WORKERS = 8  # one per dashboard query, so a cold page waits on the slowest query only
+QUERY_CACHE_ENTRIES = 32  # cached (date range, channels) results kept per query, least recently used evicted
+DEFAULT_RANGE_DAYS = 30
+# "athena": one aggregate query per panel; "local": one extract per date range, aggregated in pandas
+AGGREGATION_MODE = st.secrets.get("aggregation_mode", "athena")
+# Crawled spend table: daily_spends for the spend Lambda's JSON output, daily_spends_parquet
+# for OUTPUT_FORMAT=parquet (its own prefix, so the crawler names the table after it)
+SPEND_TABLE = st.secrets.get("spend_table", "calendly_project.daily_spends")
+# Per-query EMF lines on the app's stdout (METRICS_SINK=file:<path> or off to redirect / silence)
+metrics = Metrics("streamlit_dashboard")
+
+# --- Athena Connection (shared across reruns and sessions) ---
+@st.cache_resource
+def get_connection():
+    return connect(
+        s3_staging_dir=st.secrets["s3_staging_dir"],
+        region_name=st.secrets["aws_region"],
+        aws_access_key_id=st.secrets["aws_access_key_id"],
+        aws_secret_access_key=st.secrets["aws_secret_access_key"]
+    )
+
+# --- Athena Query Wrapper ---
+def query_athena(sql, params=None):
+    # pandas opens a fresh cursor per call, so concurrent queries never share one.
+    # params fill %(name)s placeholders; pyathena escapes them, lists become (a, b, ...)
+    with metrics.stage("query_athena") as stage:
+        df = pd.read_sql(sql, get_connection(), params=params)
+        stage.add(records=len(df))
+    return df
+
+def run_queries(queries):
+    """Run the query callables concurrently, yielding (name, DataFrame) as each finishes."""
+    ctx = get_script_run_ctx()
+
+    def attach_script_run_ctx():
+        # st.cache_data needs the session's context in the worker thread
+        add_script_run_ctx(threading.current_thread(), ctx)
+
+    with ThreadPoolExecutor(max_workers=QUERY_WORKERS, initializer=attach_script_run_ctx) as executor:
+        futures = {executor.submit(query): name for name, query in queries.items()}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+# --- Filters ---
+# Every query is limited to the selected date range through the partition columns
+# (event_date on the rollups, file_date on daily_spends), so Athena only reads the
+# partitions in range, and to the selected channels. event_date is the day the Glue job
+# ingested an event, so the rollup queries also filter on the booking (or meeting) date
+# itself; the partition predicate only prunes.
+def filter_params(start, end, channels):
+    return {"start": start.isoformat(), "end": end.isoformat(), "channels": list(channels)}
+
+# The picker has to be filled before the panel queries can start, so it reads the small
+# event type -> channel lookup, kept to the paid channels: those with spend rows in the
+# selected range (a semi-join on the pruned spend partitions, not a scan of all of them).
+# Every panel filters on the picked channels, so unpaid channels stay out of all of them.
+@st.cache_data(ttl=86400, max_entries=QUERY_CACHE_ENTRIES)
+def get_channels(start, end):
+    return query_athena(f"""
+        SELECT DISTINCT channel_name AS channel
+        FROM calendly_project.event_type_channels
+        WHERE channel_name IN (
+            SELECT channel
+            FROM {SPEND_TABLE}
+            WHERE file_date BETWEEN %(start)s AND %(end)s
+        )
+        ORDER BY 1
+    """, {"start": start.isoformat(), "end": end.isoformat()})["channel"].tolist()
+
+# --- Spend Attribution Layer ---
+# Bookings and spend are aggregated separately per (channel, day) and only then joined on
+# both keys, so every event is counted once and every spend row summed once. Joining the
+# raw tables on channel alone paired each event with every spend day of its channel.
+# Booking and meeting counts come from the rollup tables the Glue job keeps up to date.
+SPEND_ATTRIBUTION = f"""
+    WITH bookings AS (
+        SELECT channel,
+        booking_date AS day,
+        SUM(bookings) AS bookings
+        FROM calendly_project.rollup_channel_bookings
+        WHERE event_date BETWEEN %(start)s AND %(end)s
+        AND booking_date BETWEEN CAST(%(start)s AS DATE) AND CAST(%(end)s AS DATE)
+        AND channel IN %(channels)s
+        GROUP BY 1, 2
+    ),
+    spend AS (
+        SELECT channel,
+        CAST(date AS DATE) AS day,
+        SUM(spend) AS spend
+        FROM {SPEND_TABLE}
+        WHERE file_date BETWEEN %(start)s AND %(end)s
+        AND channel IN %(channels)s
+        GROUP BY 1, 2
+    ),
+    channel_day AS (
+        SELECT COALESCE(b.channel, s.channel) AS channel,
+        COALESCE(b.day, s.day) AS day,
+        COALESCE(b.bookings, 0) AS bookings,
+        COALESCE(s.spend, 0) AS spend
+        FROM bookings b
+        FULL OUTER JOIN spend s ON b.channel = s.channel AND b.day = s.day
+    )
+"""
+
+# --- Cached Queries (refresh daily, one entry per date range and channel selection) ---
+@st.cache_data(ttl=86400, max_entries=QUERY_CACHE_ENTRIES)
+def get_cost_per_lead(start, end, channels): #horizontal bar chart by channel
+    return query_athena(SPEND_ATTRIBUTION + """
+    SELECT channel,
+        ROUND(SUM(spend)/NULLIF(SUM(bookings), 0),0) AS cost_per_lead
+        FROM channel_day
+        GROUP BY 1
+        ORDER BY 2
+    """, filter_params(start, end, channels))
+
+@st.cache_data(ttl=86400, max_entries=QUERY_CACHE_ENTRIES)
+def get_daily_leads_by_channel(start, end, channels): #line chart by date, colors by channel
+    return query_athena(SPEND_ATTRIBUTION + """
+        SELECT channel,
+        day AS booking_date,
+        bookings AS n_events
+        FROM channel_day
+        WHERE bookings > 0
+        ORDER BY 1, 2
+    """, filter_params(start, end, channels))
+
+@st.cache_data(ttl=86400, max_entries=QUERY_CACHE_ENTRIES)
+def get_channel_leaderboard(start, end, channels): # table
+    return query_athena(SPEND_ATTRIBUTION + """
+    SELECT channel,
+    ROUND(SUM(spend),0) AS spend,
+    SUM(bookings) AS bookings,
+    ROUND(SUM(spend)/NULLIF(SUM(bookings), 0),0) AS cost_per_lead
+    FROM channel_day
+    GROUP BY 1
+    ORDER BY 2
+    """, filter_params(start, end, channels))
+
+@st.cache_data(ttl=86400, max_entries=QUERY_CACHE_ENTRIES)
+def get_bookings_by_day(start, end, channels): # bar chart by day of week
+    return query_athena("""
+    SELECT 
+    format_datetime(CAST(booking_date AS TIMESTAMP), 'EEEE') AS booking_day,
+    SUM(bookings) AS bookings
+    FROM calendly_project.rollup_channel_bookings
+    WHERE event_date BETWEEN %(start)s AND %(end)s
+    AND booking_date BETWEEN CAST(%(start)s AS DATE) AND CAST(%(end)s AS DATE)
+    AND channel IN %(channels)s
+    GROUP BY 1, day_of_week(booking_date)
+    ORDER BY day_of_week(booking_date)
+    """, filter_params(start, end, channels))
+
+@st.cache_data(ttl=86400, max_entries=QUERY_CACHE_ENTRIES)
+def get_bookings_by_hour(start, end, channels): # line chart 
+    return query_athena("""
+        SELECT 
+        booking_hour,
+        SUM(bookings) AS bookings
+        FROM calendly_project.rollup_channel_bookings
+        WHERE event_date BETWEEN %(start)s AND %(end)s
+        AND booking_date BETWEEN CAST(%(start)s AS DATE) AND CAST(%(end)s AS DATE)
+        AND channel IN %(channels)s
+        GROUP BY 1
+        ORDER BY 1
+    """, filter_params(start, end, channels))
+
+@st.cache_data(ttl=86400, max_entries=QUERY_CACHE_ENTRIES)
+def get_meeting_by_day(start, end, channels): # bar chart by day of week
+    return query_athena("""
+        SELECT 
+        format_datetime(CAST(meeting_date AS TIMESTAMP), 'EEEE') AS meeting_day,
+        SUM(meetings) AS bookings
+        FROM calendly_project.rollup_channel_meetings
+        WHERE event_date BETWEEN %(start)s AND %(end)s
+        AND meeting_date BETWEEN CAST(%(start)s AS DATE) AND CAST(%(end)s AS DATE)
+        AND channel IN %(channels)s
+        GROUP BY 1, day_of_week(meeting_date)
+        ORDER BY day_of_week(meeting_date)
+    """, filter_params(start, end, channels))
+
+@st.cache_data(ttl=86400, max_entries=QUERY_CACHE_ENTRIES)
+def get_meeting_by_hour(start, end, channels): # bar chart by day of week
+    return query_athena("""
+        SELECT 
+        meeting_hour AS event_hour,
+        SUM(meetings) AS bookings
+        FROM calendly_project.rollup_channel_meetings
+        WHERE event_date BETWEEN %(start)s AND %(end)s
+        AND meeting_date BETWEEN CAST(%(start)s AS DATE) AND CAST(%(end)s AS DATE)
+        AND channel IN %(channels)s
+        GROUP BY 1
+        ORDER BY 1
+    """, filter_params(start, end, channels))
+
+@st.cache_data(ttl=86400, max_entries=QUERY_CACHE_ENTRIES)
+def get_meetings_by_employee_per_day(start, end): # horizontal bar chart by employee
+    return query_athena("""
+        SELECT 
+        employee_name,
+        SUM(meetings)/count(DISTINCT meeting_date) AS meetings_per_day
+        FROM calendly_project.rollup_employee_meetings
+        WHERE event_date BETWEEN %(start)s AND %(end)s
+        AND meeting_date BETWEEN CAST(%(start)s AS DATE) AND CAST(%(end)s AS DATE)
+        AND employee_name IS NOT NULL
+        GROUP BY 1
+        ORDER BY 2 DESC
+    """, {"start": start.isoformat(), "end": end.isoformat()})
+
+# --- Local Aggregation Mode ---
+# The seven channel panels all aggregate the same three rollups, so this mode fetches them
+# once per date range at their stored grain and computes every panel in pandas. Channel
+# changes only re-slice the cached frame; employee meetings still come from their own query.
+BASE_EXTRACT = f"""
+    SELECT 'booking' AS kind, channel, booking_date AS day, booking_hour AS hour,
+    CAST(bookings AS DOUBLE) AS n
+    FROM calendly_project.rollup_channel_bookings
+    WHERE event_date BETWEEN %(start)s AND %(end)s
+    AND booking_date BETWEEN CAST(%(start)s AS DATE) AND CAST(%(end)s AS DATE)
+    UNION ALL
+    SELECT 'meeting' AS kind, channel, meeting_date AS day, meeting_hour AS hour,
+    CAST(meetings AS DOUBLE) AS n
+    FROM calendly_project.rollup_channel_meetings
+    WHERE event_date BETWEEN %(start)s AND %(end)s
+    AND meeting_date BETWEEN CAST(%(start)s AS DATE) AND CAST(%(end)s AS DATE)
+    UNION ALL
+    SELECT 'spend' AS kind, channel, CAST(date AS DATE) AS day, CAST(NULL AS INTEGER) AS hour,
+    SUM(spend) AS n
+    FROM {SPEND_TABLE}
+    WHERE file_date BETWEEN %(start)s AND %(end)s
+    GROUP BY channel, CAST(date AS DATE)
+"""
+
+@st.cache_data(ttl=86400, max_entries=QUERY_CACHE_ENTRIES)
+def get_base_extract(start, end):
+    df = query_athena(BASE_EXTRACT, {"start": start.isoformat(), "end": end.isoformat()})
+    # Categoricals keep the repeated labels to one byte each and make the groupbys cheap
+    return pd.DataFrame({
+        "kind": df["kind"].astype("category"),
+        "channel": df["channel"].astype("category"),
+        "day": pd.to_datetime(df["day"]),
+        "hour": df["hour"].astype("Int8"),
+        "n": df["n"].astype("float64"),
+    })
+
+def by_weekday(df, label, value):
+    days = df.groupby(df["day"].dt.dayofweek)["n"].sum()
+    return pd.DataFrame({
+        label: [DAYS_OF_WEEK[d] for d in days.index],
+        value: days.to_numpy().astype("int64"),
+    })
+
+def by_hour(df, label, value):
+    hours = df.groupby("hour")["n"].sum()
+    return pd.DataFrame({label: hours.index.astype("int64"), value: hours.to_numpy().astype("int64")})
+
+@metrics.timed()
+def aggregate_locally(extract, channels):
+    """Compute the seven channel panels from the base extract, matching their SQL results."""
+    df = extract[extract["channel"].isin(channels)]
+    bookings = df[df["kind"] == "booking"]
+    meetings = df[df["kind"] == "meeting"]
+    spend = df[df["kind"] == "spend"]
+
+    totals = pd.DataFrame({
+        "spend": spend.groupby("channel", observed=True)["n"].sum(),
+        "bookings": bookings.groupby("channel", observed=True)["n"].sum(),
+    }).fillna(0)
+    totals["cost_per_lead"] = (totals["spend"] / totals["bookings"].where(totals["bookings"] > 0)).round(0)
+    totals = totals.rename_axis("channel").reset_index()
+    totals["channel"] = totals["channel"].astype(str)
+    totals["bookings"] = totals["bookings"].astype("int64")
+    totals["spend"] = totals["spend"].round(0)
+
+    daily = bookings.groupby(["channel", "day"], observed=True)["n"].sum()
+    daily = daily[daily > 0].astype("int64")
+    daily_leads = daily.rename("n_events").rename_axis(["channel", "booking_date"]).reset_index()
+    daily_leads["channel"] = daily_leads["channel"].astype(str)
+
+    return {
+        "cost_per_lead": totals[["channel", "cost_per_lead"]].sort_values("cost_per_lead").reset_index(drop=True),
+        "daily_leads": daily_leads,
+        "leaderboard": totals[["channel", "spend", "bookings", "cost_per_lead"]].sort_values("spend").reset_index(drop=True),
+        "bookings_by_day": by_weekday(bookings, "booking_day", "bookings"),
+        "bookings_by_hour": by_hour(bookings, "booking_hour", "bookings"),
+        "meetings_by_day": by_weekday(meetings, "meeting_day", "bookings"),
+        "meetings_by_hour": by_hour(meetings, "event_hour", "bookings"),
+    }
+
+# --- Charts ---
+DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+def chart_cost_per_lead(df_cpl): # horizontal bar chart by channel
+    return alt.Chart(df_cpl).mark_bar().encode(
+        x=alt.X("cost_per_lead:Q", title="Cost per Lead"),
+        y=alt.Y("channel:N", sort="-x", title="Channel"),
+        tooltip=["channel", "cost_per_lead"]
+    ).properties(height=300)
+
+def chart_daily_leads(df_daily_leads): # line chart by date, colors by channel
+    return alt.Chart(df_daily_leads).mark_line(point=True).encode(
+        x=alt.X("booking_date:T", title="Date"),
+        y=alt.Y("n_events:Q", title="Number of Events"),
+        color=alt.Color("channel:N", title="Channel"),
+        tooltip=["booking_date", "channel", "n_events"]
+    ).properties(height=300)
+
+def chart_bookings_by_day(df_by_day): # bar chart by day of week
+    return alt.Chart(df_by_day).mark_bar().encode(
+        x=alt.X("booking_day:N", title="Day of Week", sort=DAYS_OF_WEEK),
+        y=alt.Y("bookings:Q", title="Bookings"),
+        tooltip=["booking_day", "bookings"]
+    ).properties(height=300)
+
+def chart_bookings_by_hour(df_by_hour): # line chart
+    return alt.Chart(df_by_hour).mark_line(point=True).encode(
+        x=alt.X("booking_hour:O", title="Hour (24h)"),
+        y=alt.Y("bookings:Q", title="Bookings"),
+        tooltip=["booking_hour", "bookings"]
+    ).properties(height=300)
+
+def chart_meetings_by_day(df_meeting_day): # bar chart by day of week
+    return alt.Chart(df_meeting_day).mark_bar().encode(
+        x=alt.X("meeting_day:N", title="Day of Week", sort=DAYS_OF_WEEK),
+        y=alt.Y("bookings:Q", title="Meetings"),
+        tooltip=["meeting_day", "bookings"]
+    ).properties(height=300)
+
+def chart_meetings_by_hour(df_meeting_hour): # line chart
+    return alt.Chart(df_meeting_hour).mark_line(point=True).encode(
+        x=alt.X("event_hour:O", title="Hour (24h)"),
+        y=alt.Y("bookings:Q", title="Meetings"),
+        tooltip=["event_hour", "bookings"]
+    ).properties(height=300)
+
+def chart_meetings_by_employee(df_meetings_emp): # horizontal bar chart by employee
+    return alt.Chart(df_meetings_emp).mark_bar().encode(
+        x=alt.X("meetings_per_day:Q", title="Meetings per Day"),
+        y=alt.Y("employee_name:N", sort="-x", title="Employee"),
+        tooltip=["employee_name", "meetings_per_day"]
+    ).properties(height=400)
+
+def show_chart(chart):
+    return lambda slot, df: slot.altair_chart(chart(df), use_container_width=True)
+
+def show_table(slot, df):
+    slot.dataframe(df, use_container_width=True)
+
+# --- App UI ---
+st.title("📊 Calendly Project Dashboard ")
+st.markdown("Data updates every 24 hours. Click below to refresh manually if needed. Use the sidebar to pick dates and channels.")
+
+if st.button("🔄 Refresh Data Now"):
+    st.cache_data.clear()
+    st.success("Cache cleared! Please rerun to fetch fresh data.")
+
+# --- Date Range + Channel Filters ---
+today = datetime.date.today()
+date_range = st.sidebar.date_input(
+    "📆 Booking dates",
+    value=(today - datetime.timedelta(days=DEFAULT_RANGE_DAYS), today),
+    max_value=today,
+)
+if len(date_range) != 2:
+    st.info("Pick an end date to load the dashboard.")
+    st.stop()
+start_date, end_date = date_range
+all_channels = get_channels(start_date, end_date)
+selected_channels = st.sidebar.multiselect("📣 Channels", all_channels, default=all_channels)
+if not selected_channels:
+    st.info("Select at least one channel.")
+    st.stop()
+# Sorted tuple: hashable, and the same selection in any order shares one cache entry
+channels = tuple(sorted(selected_channels))
+
+# The layout is laid down first with an empty slot per panel; each slot is filled
+# as soon as its query returns, so panels appear in completion order.
+
+# --- Cost per Lead (Horizontal Bar) + Daily Leads by Channel (Line Chart) ---
+col1, col2 = st.columns(2)
+
+with col1:
+    st.subheader("💰 Cost per Lead by Channel")
+    slot_cpl = st.empty()
+
+with col2:
+    st.subheader("📈 Daily Leads by Channel")
+    slot_daily_leads = st.empty()
+
+
+# --- Channel Leaderboard (Table) ---
+st.subheader("🏆 Channel Leaderboard")
+slot_leaderboard = st.empty()
+
+
+# --- Bookings by Day (Bar) + Bookings by Hour (Line) ---
+col3, col4 = st.columns(2)
+
+with col3:
+    st.subheader("📅 Bookings by Day of Week")
+    slot_by_day = st.empty()
+
+with col4:
+    st.subheader("⏰ Bookings by Hour")
+    slot_by_hour = st.empty()
+
+
+# --- Meetings by Day (Bar) + Meetings by Hour (line) ---
+col5, col6 = st.columns(2)
+
+with col5:
+    st.subheader("📅 Meetings by Day of Week")
+    slot_meeting_day = st.empty()
+
+with col6:
+    st.subheader("⏰ Meetings by Hour")
+    slot_meeting_hour = st.empty()
+
+
+# --- Meetings per Day per Employee ---
+st.subheader("👩‍💼 Average Meetings per Day per Employee")
+slot_meetings_emp = st.empty()
+
+
+# --- Run all queries at once and render each panel as its result arrives ---
+filters = (start_date, end_date, channels)
+panels = {
+    "cost_per_lead": (partial(get_cost_per_lead, *filters), slot_cpl, show_chart(chart_cost_per_lead)),
+    "daily_leads": (partial(get_daily_leads_by_channel, *filters), slot_daily_leads, show_chart(chart_daily_leads)),
+    "leaderboard": (partial(get_channel_leaderboard, *filters), slot_leaderboard, show_table),
+    "bookings_by_day": (partial(get_bookings_by_day, *filters), slot_by_day, show_chart(chart_bookings_by_day)),
+    "bookings_by_hour": (partial(get_bookings_by_hour, *filters), slot_by_hour, show_chart(chart_bookings_by_hour)),
+    "meetings_by_day": (partial(get_meeting_by_day, *filters), slot_meeting_day, show_chart(chart_meetings_by_day)),
+    "meetings_by_hour": (partial(get_meeting_by_hour, *filters), slot_meeting_hour, show_chart(chart_meetings_by_hour)),
+    "meetings_by_employee": (partial(get_meetings_by_employee_per_day, start_date, end_date), slot_meetings_emp, show_chart(chart_meetings_by_employee)),
+}
+
+if AGGREGATION_MODE == "local":
+    queries = {
+        "extract": partial(get_base_extract, start_date, end_date),
+        "meetings_by_employee": panels["meetings_by_employee"][0],
+    }
+else:
+    queries = {name: query for name, (query, _, _) in panels.items()}
+
+for name, result in run_queries(queries):
+    results = aggregate_locally(result, channels) if name == "extract" else {name: result}
+    for panel, df in results.items():
+        _, slot, show = panels[panel]
+        show(slot, df)
@@ -0,0 +1,76 @@
+# Fixtures for the Glue job tests: a local Spark session and a freshly imported job module
+# per test, with S3 and Athena mocked by moto (see support.LocalTableS3 for processed/).
+import importlib.util
+import os
+import sys
+
+import pytest
+
+from support import ROOT, LocalTableS3
+
+GLUE_JOB = os.path.join(ROOT, "glue_jobs", "CalendlyDailyEventJob.py")
+sys.path.insert(0, os.path.join(ROOT, "shared", "python"))
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ["METRICS_SINK"] = "off"
+
+EVENT_TYPE_CHANNELS = [(f"https://api.calendly.com/event_types/{i}", channel)
+                       for i, channel in enumerate(("youtube", "facebook", "tiktok"), 1)]
+
+
+@pytest.fixture(scope="session")
+def spark(tmp_path_factory):
+    pytest.importorskip("pyspark")
+    from pyspark.sql import SparkSession
+
+    session = (
+        SparkSession.builder.master("local[2]")
+        .config("spark.ui.enabled", "false")
+        .config("spark.sql.shuffle.partitions", "4")
+        .config("spark.sql.session.timeZone", "UTC")
+        # No .crc side files or _SUCCESS markers in the local bucket folder
+        .config("spark.hadoop.fs.file.impl", "org.apache.hadoop.fs.RawLocalFileSystem")
+        .config("spark.hadoop.mapreduce.fileoutputcommitter.marksuccessfuljobs", "false")
+        .config("spark.sql.warehouse.dir", str(tmp_path_factory.mktemp("warehouse")))
+        .getOrCreate()
+    )
+    session.sparkContext.setLogLevel("ERROR")
+    session.sql("CREATE DATABASE IF NOT EXISTS calendly_project")
+    (session.createDataFrame(EVENT_TYPE_CHANNELS, "event_type string, channel_name string")
+     .write.mode("overwrite").saveAsTable("calendly_project.event_type_channels"))
+    yield session
+    session.stop()
+
+
+# load_job(*job_args) imports CalendlyDailyEventJob with those job arguments. Modules loaded
+# in one test share the mocked bucket and the local processed/ folder, like consecutive runs.
+@pytest.fixture
+def load_job(tmp_path, monkeypatch):
+    from moto import mock_aws
+
+    mock = mock_aws()
+    mock.start()
+    bucket_root = tmp_path / "bucket"
+    bucket_root.mkdir()
+
+    def load(*job_args):
+        monkeypatch.setattr(sys, "argv", [GLUE_JOB, *job_args])
+        spec = importlib.util.spec_from_file_location("CalendlyDailyEventJob", GLUE_JOB)
+        job = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(job)
+        try:
+            job.s3.create_bucket(Bucket=job.raw_bucket)
+        except job.s3.exceptions.BucketAlreadyOwnedByYou:
+            pass
+        try:
+            job.glue.create_database(DatabaseInput={"Name": job.athena_db})
+        except job.glue.exceptions.AlreadyExistsException:
+            pass
+        job.s3 = LocalTableS3(job.s3, bucket_root)
+        job.bucket_url = f"file://{bucket_root}/"
+        return job
+
+    yield load
+    mock.stop()
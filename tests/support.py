@@ -0,0 +1,168 @@
+# Helpers for the Glue job tests: a boto3 S3 stand-in that keeps the Spark-written part of the
+# bucket on local disk, and builders for raw webhook files and table reads.
+import copy
+import io
+import json
+import os
+import random
+import shutil
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from synthetic_data import synthetic_payload  # noqa: E402
+
+
+class LocalTableS3:
+    """The job's S3 client with the Spark-written prefixes served from a local folder.
+
+    Spark has no S3 connector in the test environment, so processed/ (events, rollups and
+    compaction staging) is written by Spark under `root` through the job's bucket_url. The
+    job's own calls for those keys (listing, deletes, copies) go to the same folder; every
+    other key (raw/, state/) goes to the wrapped moto client.
+    """
+
+    def __init__(self, client, root, local_prefixes=("processed/",)):
+        self.client = client
+        self.root = str(root)
+        self.local_prefixes = local_prefixes
+        self.exceptions = client.exceptions
+
+    def _local(self, key):
+        return key.startswith(self.local_prefixes)
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def local_keys(self, prefix=""):
+        found = []
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                key = os.path.relpath(os.path.join(folder, name), self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    found.append(key)
+        return sorted(found)
+
+    def get_object(self, Bucket, Key, **kwargs):
+        if not self._local(Key):
+            return self.client.get_object(Bucket=Bucket, Key=Key, **kwargs)
+        if not os.path.exists(self._path(Key)):
+            raise self.exceptions.NoSuchKey({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        with open(self._path(Key), "rb") as f:
+            return {"Body": io.BytesIO(f.read())}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        if not self._local(Key):
+            return self.client.put_object(Bucket=Bucket, Key=Key, Body=Body, **kwargs)
+        os.makedirs(os.path.dirname(self._path(Key)), exist_ok=True)
+        with open(self._path(Key), "wb") as f:
+            f.write(Body)
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        if not self._local(Key):
+            return self.client.delete_object(Bucket=Bucket, Key=Key)
+        if os.path.exists(self._path(Key)):
+            os.remove(self._path(Key))
+        return {}
+
+    def delete_objects(self, Bucket, Delete):
+        remote = [o for o in Delete["Objects"] if not self._local(o["Key"])]
+        for o in Delete["Objects"]:
+            if self._local(o["Key"]):
+                self.delete_object(Bucket, o["Key"])
+        if remote:
+            self.client.delete_objects(Bucket=Bucket, Delete={"Objects": remote})
+        return {}
+
+    def copy(self, CopySource, Bucket, Key):
+        assert self._local(CopySource["Key"]) and self._local(Key)
+        os.makedirs(os.path.dirname(self._path(Key)), exist_ok=True)
+        shutil.copyfile(self._path(CopySource["Key"]), self._path(Key))
+
+    def get_paginator(self, name):
+        assert name == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix="", StartAfter=None, Delimiter=None):
+        if not self._local(Prefix):
+            kwargs = {"Bucket": Bucket, "Prefix": Prefix}
+            if StartAfter:
+                kwargs["StartAfter"] = StartAfter
+            if Delimiter:
+                kwargs["Delimiter"] = Delimiter
+            yield from self.client.get_paginator("list_objects_v2").paginate(**kwargs)
+            return
+        assert Delimiter is None
+        keys = [k for k in self.local_keys(Prefix) if not StartAfter or k > StartAfter]
+        yield {"Contents": [{"Key": k, "Size": os.path.getsize(self._path(k))} for k in keys]}
+
+
+class FakeAthena:
+    """Athena client stand-in that records statements and reports scripted query states.
+
+    Each query reports `states` in order on successive polls, then repeats the last one.
+    """
+
+    def __init__(self, states=("SUCCEEDED",), reason=""):
+        self.states = list(states)
+        self.reason = reason
+        self.queries = []
+        self.stopped = []
+        self.polls = {}
+
+    def start_query_execution(self, QueryString, **kwargs):
+        self.queries.append(QueryString)
+        query_id = f"query-{len(self.queries)}"
+        self.polls[query_id] = 0
+        return {"QueryExecutionId": query_id}
+
+    def get_query_execution(self, QueryExecutionId):
+        poll = self.polls[QueryExecutionId]
+        self.polls[QueryExecutionId] += 1
+        state = self.states[min(poll, len(self.states) - 1)]
+        return {"QueryExecution": {"Status": {"State": state, "StateChangeReason": self.reason}}}
+
+    def stop_query_execution(self, QueryExecutionId):
+        self.stopped.append(QueryExecutionId)
+        return {}
+
+
+# A raw webhook file body as the webhook Lambda stores it
+def raw_body(payload):
+    return json.dumps({"event": "invitee.created", "payload": payload})
+
+
+# One invitee.created payload; created is a Calendly timestamp string
+def payload(seed, created="2024-05-01T10:00:00.000000Z", updated=None):
+    p = synthetic_payload(random.Random(seed), created, created, "https://api.calendly.com/event_types/1")
+    if updated:
+        p = copy.deepcopy(p)
+        p["updated_at"] = updated
+    return p
+
+
+# Store raw/<date>/<name> files; returns their keys
+def put_raw(job, date_part, bodies):
+    keys = []
+    for name, body in bodies.items():
+        key = f"{job.raw_prefix}{date_part}/{name}"
+        job.s3.put_object(Bucket=job.raw_bucket, Key=key, Body=body.encode("utf-8"))
+        keys.append(key)
+    return keys
+
+
+# (event_date, event key, updated_at) of every processed row, sorted
+def table_rows(spark, job):
+    path = f"{job.bucket_url}{job.processed_prefix}"
+    if not job.s3.local_keys(job.processed_prefix):
+        return []
+    rows = spark.read.schema(job.schema_with_timestamps()).parquet(path).collect()
+    return sorted((r.event_date, r.event or r.uri, r.updated_at.isoformat() if r.updated_at else "") for r in rows)
+
+
+# Data file keys of one processed partition
+def partition_keys(job, date_part):
+    prefix = f"{job.processed_prefix}event_date={date_part}/"
+    return [k for k in job.s3.local_keys(prefix) if not k[len(prefix):].startswith(("_", "."))]
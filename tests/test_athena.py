@@ -0,0 +1,79 @@
+# Athena statements: polling, failures, the deadline and batched partition registration
+import re
+
+import pytest
+
+from support import FakeAthena, payload, put_raw, raw_body, table_rows
+
+DAY = "2024-05-01"
+
+
+def test_query_is_polled_until_it_succeeds(load_job):
+    job = load_job()
+    job.athena = FakeAthena(["QUEUED", "RUNNING", "SUCCEEDED"])
+    assert job.run_athena_query("SELECT 1", poll_seconds=0) == "query-1"
+    assert job.athena.polls == {"query-1": 3}
+
+
+@pytest.mark.parametrize("state", ["FAILED", "CANCELLED"])
+def test_failed_or_cancelled_query_raises(load_job, state):
+    job = load_job()
+    job.athena = FakeAthena(["RUNNING", state], reason="HIVE_METASTORE_ERROR")
+    with pytest.raises(RuntimeError, match=f"{state}: HIVE_METASTORE_ERROR"):
+        job.run_athena_query("SELECT 1", poll_seconds=0)
+
+
+def test_query_past_its_deadline_is_stopped(load_job):
+    job = load_job("--ATHENA_TIMEOUT_SECONDS", "0")
+    job.athena = FakeAthena(["RUNNING"])
+    with pytest.raises(RuntimeError, match="still RUNNING after 0s"):
+        job.run_athena_query("SELECT 1", poll_seconds=0)
+    assert job.athena.stopped == ["query-1"]
+
+
+def test_partitions_are_registered_in_batches(load_job):
+    job = load_job()
+    job.athena = FakeAthena()
+    dates = [f"2024-{m:02d}-{d:02d}" for m in range(1, 10) for d in range(1, 29)][:250]
+    job.register_partitions(dates)
+
+    assert len(job.athena.queries) == 3
+    registered = []
+    for sql in job.athena.queries:
+        assert re.search(r"ALTER TABLE events_raw\s+ADD IF NOT EXISTS", sql)
+        registered += re.findall(
+            r"PARTITION \(event_date = '([\d-]+)'\) LOCATION '(\S+)'", sql)
+    assert [len(re.findall("PARTITION", sql)) for sql in job.athena.queries] == [100, 100, 50]
+    assert registered == [(d, f"{job.bucket_url}processed/events/event_date={d}/") for d in dates]
+
+
+def test_raw_files_are_kept_when_registration_fails(spark, load_job):
+    job = load_job()
+    job.athena = FakeAthena(["FAILED"], reason="access denied")
+    keys = put_raw(job, DAY, {f"{seed}.json": raw_body(payload(seed)) for seed in (1, 2)})
+    with pytest.raises(RuntimeError, match="FAILED: access denied"):
+        job.process_raw_folders(spark)
+
+    assert sorted(job.list_keys(f"{job.raw_prefix}{DAY}/")) == sorted(keys)
+    assert job.read_state(job.manifest_key(DAY), None) is None
+    assert job.read_state(job.pending_commit_key, None) is not None
+
+    # The next run rolls the write back and commits the same files once
+    job = load_job()
+    job.athena = FakeAthena()
+    job.roll_back_pending_commit()
+    job.process_raw_folders(spark)
+    assert len(table_rows(spark, job)) == 2
+    assert list(job.list_keys(f"{job.raw_prefix}{DAY}/")) == []
+
+
+def test_only_missing_rollup_tables_are_created_once_per_run(load_job):
+    job = load_job()
+    job.glue.create_table(DatabaseName=job.athena_db, TableInput={"Name": "rollup_channel_bookings"})
+    job.athena = FakeAthena()
+    job.ensure_rollup_tables()
+    created = [re.search(r"EXISTS (\w+)", sql).group(1) for sql in job.athena.queries]
+    assert created == ["rollup_channel_meetings", "rollup_employee_meetings"]
+
+    job.ensure_rollup_tables()
+    assert len(job.athena.queries) == 2
@@ -0,0 +1,66 @@
+# Compaction swaps and their resumption after a failure
+from datetime import datetime, timezone
+
+import pytest
+
+from support import partition_keys, payload, put_raw, raw_body, table_rows
+
+OPEN_DAY = datetime.now(timezone.utc).date().isoformat()
+
+
+# A partition written by two append runs, so it has at least two files
+def two_file_partition(spark, load_job):
+    for seeds in ((1, 2), (3, 4)):
+        job = load_job()
+        put_raw(job, OPEN_DAY, {f"{seed}.json": raw_body(payload(seed)) for seed in seeds})
+        job.process_raw_folders(spark)
+    return job
+
+
+@pytest.mark.parametrize("failing_step", ["copy", "delete_originals"])
+def test_half_done_swap_is_resumed(spark, load_job, monkeypatch, failing_step):
+    job = two_file_partition(spark, load_job)
+    rows = table_rows(spark, job)
+    originals = partition_keys(job, OPEN_DAY)
+    assert len(originals) > 1
+
+    job = load_job("--JOB_MODE", "compact")
+    resume = load_job("--JOB_MODE", "compact")
+
+    def crash(*args, **kwargs):
+        raise RuntimeError("Glue worker lost")
+
+    if failing_step == "copy":
+        monkeypatch.setattr(job.s3, "copy", crash)
+    else:
+        monkeypatch.setattr(job, "delete_keys", crash)
+    with pytest.raises(RuntimeError):
+        job.compact_partitions(spark)
+    assert OPEN_DAY in job.read_state(job.compaction_marker_key, {})
+    assert job.s3.local_keys(job.compaction_staging_prefix)
+
+    resume.resume_compaction()
+    compacted = partition_keys(resume, OPEN_DAY)
+    assert compacted and all(k.rsplit("/", 1)[1].startswith("compacted-") for k in compacted)
+    assert table_rows(spark, resume) == rows
+    assert resume.s3.local_keys(resume.compaction_staging_prefix) == []
+    assert resume.read_state(resume.compaction_marker_key, None) is None
+
+    # Nothing left to resume, and a second resume is a no-op
+    resume.resume_compaction()
+    assert partition_keys(resume, OPEN_DAY) == compacted
+
+
+def test_compaction_keeps_a_current_key_sidecar_current(spark, load_job):
+    job = load_job("--WRITE_MODE", "upsert")
+    put_raw(job, OPEN_DAY, {"1.json": raw_body(payload(1)), "2.json": raw_body(payload(2))})
+    job.process_raw_folders(spark)
+    job = load_job("--WRITE_MODE", "upsert")
+    put_raw(job, OPEN_DAY, {"3.json": raw_body(payload(3))})
+    job.process_raw_folders(spark)
+    keys = job.read_state(job.key_index_key(OPEN_DAY), {})["keys"]
+
+    compact = load_job("--JOB_MODE", "compact", "--COMPACT_DATES", OPEN_DAY)
+    compact.compact_partitions(spark)
+    assert compact.read_state(compact.key_index_key(OPEN_DAY), {}) == {
+        "keys": keys, "files": compact.partition_files(OPEN_DAY)}
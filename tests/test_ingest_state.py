@@ -0,0 +1,95 @@
+# Manifests, the pending-commit rollback, reprocessing and the listing watermark
+from datetime import datetime, timezone
+
+import pytest
+
+from support import partition_keys, payload, put_raw, raw_body, table_rows
+
+DAY = "2024-05-01"
+# A folder the watermark has not closed yet, so new files in it are still listed
+OPEN_DAY = datetime.now(timezone.utc).date().isoformat()
+
+
+def events(*seeds):
+    return {f"{seed}.json": raw_body(payload(seed)) for seed in seeds}
+
+
+def test_crash_between_write_and_manifest_is_rolled_back(spark, load_job, monkeypatch):
+    job = load_job("--DELETE_RAW", "false")
+    keys = put_raw(job, DAY, events(1, 2, 3))
+
+    def athena_down(dates, **kwargs):
+        raise RuntimeError("Athena unavailable")
+
+    register_partitions = job.register_partitions
+    monkeypatch.setattr(job, "register_partitions", athena_down)
+    with pytest.raises(RuntimeError):
+        job.process_raw_folders(spark)
+    # Written but not committed: marker left, no manifest
+    assert job.read_state(job.pending_commit_key, None) == {"existing_files": {DAY: []}}
+    assert job.read_state(job.manifest_key(DAY), None) is None
+    assert len(table_rows(spark, job)) == 3
+
+    job.roll_back_pending_commit()
+    assert partition_keys(job, DAY) == []
+    assert job.read_state(job.pending_commit_key, None) is None
+
+    monkeypatch.setattr(job, "register_partitions", register_partitions)
+    job.process_raw_folders(spark)
+    assert len(table_rows(spark, job)) == 3
+    assert job.read_state(job.manifest_key(DAY), {})["keys"] == sorted(keys)
+    assert job.read_state(job.pending_commit_key, None) is None
+
+
+def test_rerunning_a_committed_date_only_reads_new_files(spark, load_job):
+    job = load_job("--DELETE_RAW", "false")
+    first = put_raw(job, OPEN_DAY, events(1, 2))
+    job.process_raw_folders(spark)
+    rows = table_rows(spark, job)
+
+    # Nothing new: the manifest hides the committed keys, the table is unchanged
+    assert job.list_pending_files() == {}
+    job.process_raw_folders(spark)
+    assert table_rows(spark, job) == rows
+
+    later = put_raw(job, OPEN_DAY, events(3))
+    assert job.list_pending_files() == {OPEN_DAY: later}
+    job.process_raw_folders(spark)
+    assert len(table_rows(spark, job)) == 3
+    assert job.read_state(job.manifest_key(OPEN_DAY), {})["keys"] == sorted(first + later)
+
+
+def test_reprocess_rebuilds_a_partition_from_retained_raw_files(spark, load_job):
+    job = load_job("--DELETE_RAW", "false")
+    put_raw(job, DAY, events(1, 2, 3))
+    job.process_raw_folders(spark)
+    rows = table_rows(spark, job)
+
+    reprocess = load_job("--DELETE_RAW", "false", "--REPROCESS_DATES", DAY)
+    reprocess.process_raw_folders(spark)
+    assert table_rows(spark, reprocess) == rows
+
+
+def test_reprocess_refuses_dates_whose_raw_files_were_deleted(spark, load_job):
+    job = load_job()
+    put_raw(job, DAY, events(1, 2))
+    job.process_raw_folders(spark)
+    assert list(job.list_keys(f"{job.raw_prefix}{DAY}/")) == []
+
+    put_raw(job, DAY, events(3))
+    reprocess = load_job("--REPROCESS_DATES", DAY)
+    with pytest.raises(RuntimeError, match="Refusing to reprocess"):
+        reprocess.process_raw_folders(spark)
+    assert len(table_rows(spark, job)) == 2
+
+
+def test_unparseable_folder_is_recorded_and_closed_by_the_watermark(spark, load_job):
+    job = load_job()
+    bad = put_raw(job, DAY, {"bad-1.json": "{not json", "bad-2.json": "[1, 2"})
+    job.process_raw_folders(spark)
+
+    assert job.read_state(job.manifest_key(DAY), {}) == {"failed": sorted(bad)}
+    assert job.read_state(job.watermark_key, {})["closed_through"] >= DAY
+    # Kept in raw/ for inspection, never listed again
+    assert sorted(job.list_keys(f"{job.raw_prefix}{DAY}/")) == sorted(bad)
+    assert job.list_pending_files() == {}
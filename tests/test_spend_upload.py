@@ -0,0 +1,47 @@
+# The spend Lambda's streaming upload: a failure while completing it leaves no parts behind
+import importlib.util
+import io
+import json
+import os
+
+import pytest
+
+from support import ROOT
+
+SPEND_APP = os.path.join(ROOT, "lambda_functions", "calendlySpendData", "app.py")
+
+
+class FakeResponse(io.BytesIO):
+    status = 200
+
+    def getheader(self, name):
+        return {"ETag": '"abc"'}.get(name)
+
+
+@pytest.fixture
+def spend():
+    from moto import mock_aws
+
+    with mock_aws():
+        spec = importlib.util.spec_from_file_location("calendly_spend_app", SPEND_APP)
+        app = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(app)
+        app.s3.create_bucket(Bucket=app.bucket_name)
+        yield app
+
+
+def test_failed_completion_aborts_the_multipart_upload(spend, monkeypatch):
+    # Enough rows for more than one UPLOAD_PART_SIZE part
+    records = [{"date": "2024-05-01", "channel": "youtube", "spend": i} for i in range(250000)]
+    body = json.dumps(records).encode("utf-8")
+    monkeypatch.setattr(spend, "http_get", lambda name, cached=None: FakeResponse(body))
+
+    def complete_fails(**kwargs):
+        raise RuntimeError("connection reset")
+
+    monkeypatch.setattr(spend.s3, "complete_multipart_upload", complete_fails)
+    with pytest.raises(RuntimeError, match="connection reset"):
+        spend.process_spend_file("spend_data_2024-05-01.json")
+
+    assert spend.s3.list_multipart_uploads(Bucket=spend.bucket_name).get("Uploads", []) == []
+    assert "Contents" not in spend.s3.list_objects_v2(Bucket=spend.bucket_name)
@@ -0,0 +1,73 @@
+# Upsert routing through the key sidecars, their rebuild, and the partition window
+from datetime import datetime, timezone
+
+from support import payload, put_raw, raw_body, table_rows
+
+DAY = "2024-05-01"
+OPEN_DAY = datetime.now(timezone.utc).date().isoformat()
+LATER = "2024-06-01T00:00:00.000000Z"
+
+
+def key_of(seed):
+    return payload(seed)["event"]
+
+
+def test_missing_and_stale_sidecars_are_rebuilt_before_routing(spark, load_job):
+    # Appended history has no sidecars
+    append = load_job()
+    put_raw(append, DAY, {f"{seed}.json": raw_body(payload(seed)) for seed in (1, 2)})
+    append.process_raw_folders(spark)
+
+    job = load_job("--WRITE_MODE", "upsert")
+    put_raw(job, OPEN_DAY, {"1-update.json": raw_body(payload(1, updated=LATER)),
+                            "3.json": raw_body(payload(3))})
+    job.process_raw_folders(spark)
+    assert [(d, k) for d, k, _ in table_rows(spark, job)] == sorted(
+        [(DAY, key_of(1)), (DAY, key_of(2)), (OPEN_DAY, key_of(3))])
+    assert dict((k, u) for _, k, u in table_rows(spark, job))[key_of(1)].startswith("2024-06-01")
+    sidecar = job.read_state(job.key_index_key(DAY), {})
+    assert sidecar["files"] == job.partition_files(DAY)
+    assert sorted(sidecar["keys"]) == sorted([key_of(1), key_of(2)])
+
+    # A sidecar written for other files (e.g. before a compaction) must not be trusted
+    job.write_state(job.key_index_key(DAY), {"keys": {}, "files": ["processed/events/event_date=2024-05-01/gone.parquet"]})
+    job = load_job("--WRITE_MODE", "upsert")
+    put_raw(job, OPEN_DAY, {"2-update.json": raw_body(payload(2, updated=LATER))})
+    job.process_raw_folders(spark)
+    rows = table_rows(spark, job)
+    assert [k for _, k, _ in rows].count(key_of(2)) == 1
+    assert (DAY, key_of(2)) in [(d, k) for d, k, _ in rows]
+    assert job.read_state(job.key_index_key(DAY), {})["files"] == job.partition_files(DAY)
+    assert job.read_state(job.upsert_pending_key, None) is None
+
+
+def test_stale_redelivery_is_dropped(spark, load_job):
+    job = load_job("--WRITE_MODE", "upsert")
+    put_raw(job, OPEN_DAY, {"1.json": raw_body(payload(1, updated=LATER))})
+    job.process_raw_folders(spark)
+    rows = table_rows(spark, job)
+
+    job = load_job("--WRITE_MODE", "upsert")
+    put_raw(job, OPEN_DAY, {"1-old.json": raw_body(payload(1))})
+    job.process_raw_folders(spark)
+    assert table_rows(spark, job) == rows
+
+
+def test_only_partitions_in_the_key_window_are_loaded(spark, load_job, monkeypatch):
+    append = load_job()
+    put_raw(append, DAY, {"1.json": raw_body(payload(1))})
+    put_raw(append, OPEN_DAY, {"6.json": raw_body(payload(6))})
+    append.process_raw_folders(spark)
+
+    job = load_job("--WRITE_MODE", "upsert")
+    loaded = []
+    load_key_indexes = job.load_key_indexes
+    monkeypatch.setattr(job, "load_key_indexes", lambda dates: loaded.extend(dates) or load_key_indexes(dates))
+    created = f"{OPEN_DAY}T08:00:00.000000Z"
+    put_raw(job, OPEN_DAY, {"5.json": raw_body(payload(5, created=created))})
+    job.process_raw_folders(spark)
+
+    assert loaded == [OPEN_DAY]
+    assert (OPEN_DAY, key_of(5)) in [(d, k) for d, k, _ in table_rows(spark, job)]
+    # The old partition was neither read for an index nor given one
+    assert job.read_state(job.key_index_key(DAY), None) is None